@@ -0,0 +1,86 @@
+"""
+Benchmark: match insert latency (fact.fact_matches + fact.fact_match_stats) vs. number of stat rows per match.
+
+Compares the old one-INSERT-per-row loop against the set-based insert_stat_rows()
+path used by /api/add_stats. Uses the same DB_* environment variables as flask_app.py.
+Every run happens inside a transaction that is rolled back, so no data is left behind.
+
+Usage:
+    python benchmarks/bench_add_stats_insert.py --game-id 1 --rows 1 5 10 20 40 80 --repeat 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_app import get_db_connection, release_db_connection, insert_stat_rows, resolve_dimension_ids
+
+
+def make_stat_records(n):
+    return [{
+        "stat_type": f"Bench Stat {i}", "stat_value": i, "game_mode": "Bench", "game_level": 1,
+        "win": 1, "ranked": 1, "pre_match_rank_value": "Gold", "post_match_rank_value": "Platinum"
+    } for i in range(n)]
+
+def insert_row_by_row(cur, game_id, player_id, stat_records, dim_ids):
+    """The pre-batching add_stats loop: one INSERT (and one round trip) per stat row."""
+    match_key = uuid.uuid4().hex
+    stat_record = stat_records[0]
+    cur.execute("""
+        INSERT INTO fact.fact_matches
+        (match_key, game_id, player_id, game_mode_id, game_level, win, ranked, pre_match_rank_value, post_match_rank_value, played_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, GETDATE());
+    """, (
+        match_key, game_id, player_id, dim_ids['game_mode'].get(stat_record.get('game_mode')), stat_record.get('game_level'),
+        stat_record.get('win'), stat_record.get('ranked'), stat_record.get('pre_match_rank_value'), stat_record.get('post_match_rank_value')
+    ))
+    for stat_record in stat_records:
+        cur.execute("""
+            INSERT INTO fact.fact_match_stats (match_id, stat_type_id, stat_value)
+            SELECT match_id, %s, %s FROM fact.fact_matches WHERE match_key = %s;
+        """, (dim_ids['stat_type'][stat_record.get('stat_type')], stat_record.get('stat_value'), match_key))
+
+def insert_batched(cur, game_id, player_id, stat_records, dim_ids):
+    insert_stat_rows(cur, game_id, player_id, stat_records, dim_ids=dim_ids)
+
+def time_strategy(conn, strategy, game_id, player_id, stat_records, repeat):
+    samples = []
+    for _ in range(repeat):
+        cur = conn.cursor()
+        # Dimension lookups are resolved outside the timed section; both paths need them.
+        dim_ids = resolve_dimension_ids(cur, game_id, stat_records)
+        start = time.perf_counter()
+        strategy(cur, game_id, player_id, stat_records, dim_ids)
+        samples.append((time.perf_counter() - start) * 1000)
+        conn.rollback()
+    return statistics.median(samples), max(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 5, 10, 20, 40, 80])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--game-id", type=int, required=True, help="game_id to attach rows to (stat types are per game)")
+    parser.add_argument("--player-id", type=int, default=None, help="player_id to attach rows to (defaults to NULL)")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    if conn is None:
+        sys.exit("Could not get a database connection; check the DB_* environment variables.")
+    try:
+        print(f"{'rows':>6} | {'row-by-row p50 ms':>18} | {'batched p50 ms':>15} | {'speedup':>8}")
+        print("-" * 58)
+        for n in args.rows:
+            stat_records = make_stat_records(n)
+            loop_p50, _ = time_strategy(conn, insert_row_by_row, args.game_id, args.player_id, stat_records, args.repeat)
+            batch_p50, _ = time_strategy(conn, insert_batched, args.game_id, args.player_id, stat_records, args.repeat)
+            print(f"{n:>6} | {loop_p50:>18.2f} | {batch_p50:>15.2f} | {loop_p50 / batch_p50 if batch_p50 else 0:>7.1f}x")
+    finally:
+        conn.rollback()
+        release_db_connection(conn)
+
+if __name__ == "__main__":
+    main()
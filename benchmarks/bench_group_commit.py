@@ -0,0 +1,79 @@
+"""
+Benchmark: commits per second for concurrent small writes, with and without group commit.
+
+Each of --threads threads submits --writes-per-thread single-row inserts through a
+GroupCommitter, the same layer behind run_write_unit() in flask_app.py. Window 0 gives every
+write its own transaction (the behaviour with GROUP_COMMIT_WINDOW_MS unset); the other windows
+coalesce writes that arrive together. Writes go to a scratch table that is dropped at the end.
+Uses the same DB_* environment variables as flask_app.py; set DB_POOL_MAX to at least --threads.
+
+Usage:
+    python benchmarks/bench_group_commit.py --threads 16 --writes-per-thread 25 --windows 0 2 5 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_app import get_db_connection, release_db_connection, GroupCommitter
+
+SCRATCH_TABLE = "ops.bench_group_commit"
+
+def run_ddl(sql):
+    conn = get_db_connection()
+    if conn is None:
+        sys.exit("Could not get a database connection; check the DB_* environment variables.")
+    try:
+        conn.cursor().execute(sql)
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+
+def run_window(window_ms, threads, writes_per_thread, max_units):
+    committer = GroupCommitter(window_ms / 1000, max_units)
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def worker(thread_no):
+        for write_no in range(writes_per_thread):
+            start = time.perf_counter()
+            committer.submit(lambda cur: cur.execute(
+                f"INSERT INTO {SCRATCH_TABLE} (thread_no, write_no) VALUES (%s, %s);", (thread_no, write_no)))
+            with latencies_lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    workers = [threading.Thread(target=worker, args=(thread_no,)) for thread_no in range(threads)]
+    start = time.perf_counter()
+    for thread in workers: thread.start()
+    for thread in workers: thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return committer.stats(), elapsed, statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes-per-thread", type=int, default=25)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10], help="group commit windows in ms (0 = off)")
+    parser.add_argument("--max-units", type=int, default=50)
+    args = parser.parse_args()
+
+    run_ddl(f"CREATE SCHEMA IF NOT EXISTS ops; CREATE TABLE IF NOT EXISTS {SCRATCH_TABLE} (thread_no INTEGER, write_no INTEGER);")
+    try:
+        print(f"{'window ms':>9} | {'writes/s':>9} | {'commits/s':>9} | {'avg group':>9} | {'p50 ms':>8} | {'p95 ms':>8}")
+        print("-" * 67)
+        for window_ms in args.windows:
+            stats, elapsed, p50, p95 = run_window(window_ms, args.threads, args.writes_per_thread, args.max_units)
+            if stats["failed_units"]:
+                print(f"  {stats['failed_units']} write(s) failed at window {window_ms} ms")
+            print(f"{window_ms:>9g} | {stats['units'] / elapsed:>9.1f} | {stats['commits'] / elapsed:>9.1f} | "
+                  f"{stats['avg_group_size'] or 0:>9.2f} | {p50:>8.2f} | {p95:>8.2f}")
+    finally:
+        run_ddl(f"DROP TABLE IF EXISTS {SCRATCH_TABLE};")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+"""
+Load test: throughput and p50/p95/p99 latency per route for the Flask API, with a baseline check.
+
+Starts flask_app.py (gunicorn with gunicorn.conf.py, or Flask's threaded server with --server flask)
+against a throwaway PostgreSQL database: an embedded one from `pip install pgserver` with
+--embedded, or the one in the DB_* environment variables with --drop-schemas. The database
+gets benchmarks/postgres_schema.sql (the Redshift schema without DISTKEY/SORTKEY) and a
+synthetic dataset sized by the --users/--players-per-user/--games/--matches-per-player/
+--stats-per-match flags. Tokens are minted with issue_jwt(), as /api/login does.
+
+--concurrency threads then drive a request mix for --duration seconds, each thread as one seeded
+user: add_stats bursts, the lookup fan-out the Stats page makes when a game is picked, stats and
+summary reads, and stat deletes (single and batch). Requests in the first --warmup seconds
+aren't counted. Results are written as JSON. With --baseline, a route whose p95 or p99 grew by more
+than --max-latency-regression, a drop in total throughput of more than
+--max-throughput-regression, or a higher 5xx rate makes the run exit with status 1.
+
+Usage:
+    python benchmarks/load_test.py --embedded --save-baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --embedded --baseline benchmarks/baseline.json
+    DB_URL=localhost DB_PORT=5432 DB_NAME=vgst_bench DB_USER=postgres DB_PASSWORD=... \\
+        python benchmarks/load_test.py --drop-schemas --server flask --concurrency 32 --duration 120
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_PATH = os.path.join(REPO_ROOT, "benchmarks", "postgres_schema.sql")
+RESULTS_VERSION = 1
+
+DEFAULT_MIX = "add_stats=30,lookups=40,reads=20,deletes=10"
+GAME_MODES = ("Ranked", "Casual", "Arena")
+RANKS = ("Bronze", "Silver", "Gold", "Platinum", "Diamond")
+# Server settings that change what is being measured; recorded with the results and checked against the baseline
+SERVER_ENV_PREFIXES = ("DB_POOL_", "GROUP_COMMIT_", "RESPONSE_CACHE_", "STATS_", "SUMMARY_", "DIM_CACHE_", "SLOW_QUERY_",
+                       "WRITE_QUEUE_", "IDEMPOTENCY_")
+
+SEED_SQL = """
+    SELECT setseed(%(seed_fraction)s);
+    INSERT INTO dim.dim_users (user_email, is_trusted)
+    SELECT 'bench-user-' || u || '@example.com', TRUE FROM generate_series(1, %(users)s) u;
+    INSERT INTO dim.dim_games (game_name, game_installment, game_genre, game_subgenre)
+    SELECT 'Bench Game ' || g, 'Part ' || g, 'Shooter', 'Arena' FROM generate_series(1, %(games)s) g;
+    INSERT INTO dim.dim_players (player_name, user_id)
+    SELECT 'bench_u' || u.user_id || '_p' || p, u.user_id FROM dim.dim_users u CROSS JOIN generate_series(1, %(players_per_user)s) p;
+    INSERT INTO dim.dim_game_modes (game_id, game_mode)
+    SELECT g.game_id, m.game_mode FROM dim.dim_games g CROSS JOIN unnest(%(game_modes)s) AS m(game_mode);
+    INSERT INTO dim.dim_stat_types (game_id, stat_type)
+    SELECT g.game_id, 'Stat ' || s FROM dim.dim_games g CROSS JOIN generate_series(1, %(stats_per_match)s) s;
+    INSERT INTO dim.dim_ranks (game_id, rank_label, rank_ordinal)
+    SELECT g.game_id, r.rank_label, r.rank_ordinal FROM dim.dim_games g
+    CROSS JOIN unnest(%(ranks)s) WITH ORDINALITY AS r(rank_label, rank_ordinal);
+
+    CREATE TEMP TABLE seed_matches AS
+    SELECT p.player_id, n,
+           1 + floor(random() * %(games)s)::INT AS game_no,
+           1 + floor(random() * cardinality(%(game_modes)s))::INT AS mode_no,
+           1 + floor(random() * 50)::INT AS game_level,
+           (random() < 0.5)::INT AS win,
+           (random() < 0.6)::INT AS ranked,
+           1 + floor(random() * cardinality(%(ranks)s))::INT AS pre_ordinal,
+           1 + floor(random() * cardinality(%(ranks)s))::INT AS post_ordinal,
+           (now() - random() * %(days)s * INTERVAL '1 day')::TIMESTAMP AS played_at
+    FROM dim.dim_players p CROSS JOIN generate_series(1, %(matches_per_player)s) n;
+
+    INSERT INTO fact.fact_matches
+    (match_key, game_id, player_id, game_mode_id, game_level, win, ranked,
+     pre_match_rank_value, post_match_rank_value, pre_match_rank_id, post_match_rank_id, played_at)
+    SELECT md5(s.player_id || ':' || s.n), g.game_id, s.player_id, gm.game_mode_id, s.game_level, s.win, s.ranked,
+           pre.rank_label, post.rank_label, pre.rank_id, post.rank_id, s.played_at
+    FROM seed_matches s
+    JOIN dim.dim_games g ON g.game_name = 'Bench Game ' || s.game_no
+    JOIN dim.dim_game_modes gm ON gm.game_id = g.game_id AND gm.game_mode = (%(game_modes)s)[s.mode_no]
+    LEFT JOIN dim.dim_ranks pre ON s.ranked = 1 AND pre.game_id = g.game_id AND pre.rank_ordinal = s.pre_ordinal
+    LEFT JOIN dim.dim_ranks post ON s.ranked = 1 AND post.game_id = g.game_id AND post.rank_ordinal = s.post_ordinal;
+
+    INSERT INTO fact.fact_match_stats (match_id, stat_type_id, stat_value)
+    SELECT m.match_id, st.stat_type_id, floor(random() * 30)::INT
+    FROM fact.fact_matches m JOIN dim.dim_stat_types st ON st.game_id = m.game_id;
+    DROP TABLE seed_matches;
+"""
+
+# --- Database ---
+
+def start_embedded_database():
+    """Starts a throwaway PostgreSQL with pgserver; returns (server, DB_* settings)."""
+    try:
+        import pgserver
+    except ImportError:
+        sys.exit("--embedded needs pgserver: pip install pgserver")
+    server = pgserver.get_server(tempfile.mkdtemp(prefix="vgst_load_test_"), cleanup_mode="delete")
+    info = server.get_postmaster_info()
+    return server, {"DB_URL": str(info.socket_dir), "DB_PORT": str(info.port), "DB_NAME": "postgres",
+                    "DB_USER": "postgres", "DB_PASSWORD": ""}
+
+def prepare_database(flask_app, args):
+    """Applies the stand-in schema, seeds the synthetic dataset and returns row counts."""
+    conn = flask_app.get_db_connection()
+    if conn is None:
+        sys.exit("Could not get a database connection; check the DB_* environment variables.")
+    try:
+        cur = conn.cursor()
+        with open(SCHEMA_PATH) as schema:
+            cur.execute(schema.read())
+        cur.execute(SEED_SQL, {
+            "seed_fraction": random.Random(args.seed).random() * 2 - 1, "users": args.users, "games": args.games,
+            "players_per_user": args.players_per_user, "matches_per_player": args.matches_per_player,
+            "stats_per_match": args.stats_per_match, "days": args.days, "game_modes": list(GAME_MODES), "ranks": list(RANKS),
+        })
+        flask_app.rebuild_daily_rollups(cur)
+        conn.commit()
+        cur.execute("ANALYZE;")
+        conn.commit()
+        counts = {}
+        for table in ("dim.dim_users", "dim.dim_games", "dim.dim_players", "fact.fact_matches", "fact.fact_match_stats",
+                      "fact.agg_daily_player_game_stat"):
+            cur.execute(f"SELECT COUNT(*) FROM {table};")
+            counts[table] = cur.fetchone()[0]
+        return counts
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        flask_app.release_db_connection(conn)
+
+def load_virtual_users(flask_app):
+    """One entry per seeded user: a token minted like /api/login, the user's players and every game."""
+    conn = flask_app.get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT game_id, game_name, game_installment FROM dim.dim_games ORDER BY game_id;")
+        games = cur.fetchall()
+        cur.execute("""
+            SELECT u.user_id, u.user_email, u.is_trusted, u.token_version, p.player_name
+            FROM dim.dim_users u JOIN dim.dim_players p ON p.user_id = u.user_id
+            ORDER BY u.user_id, p.player_id;
+        """)
+        users = {}
+        for user_id, user_email, is_trusted, token_version, player_name in cur.fetchall():
+            user = users.setdefault(user_id, {
+                "email": user_email, "players": [], "games": games,
+                "token": flask_app.issue_jwt(user_email, user_id, is_trusted, token_version),
+            })
+            user["players"].append(player_name)
+        return list(users.values())
+    finally:
+        flask_app.release_db_connection(conn)
+
+# --- Server ---
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(args, env, port, log_file):
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "flask_app:app"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "flask_app", "run", "--host", "127.0.0.1", "--port", str(port),
+                   "--with-threads", "--no-reload", "--no-debugger"]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"The {args.server} server exited with status {process.returncode}; see {log_file.name}")
+        try:
+            if requests.get(f"{base_url}/db_health", timeout=2).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    sys.exit(f"The {args.server} server wasn't healthy after {args.startup_timeout}s; see {log_file.name}")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+# --- Request Mix ---
+
+class VirtualUser:
+    """One load thread: a seeded user making the requests the Streamlit pages make."""
+
+    def __init__(self, base_url, user, rng, args, samples, started_at):
+        self.base_url = base_url
+        self.user = user
+        self.rng = rng
+        self.args = args
+        self.samples = samples
+        self.started_at = started_at
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {user['token']}"
+
+    def call(self, method, route, path, **kwargs):
+        """Sends one request and records (route, seconds since start, latency, status); status 0 is a connection error."""
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.args.request_timeout, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        self.samples.append((f"{method} {route}", start - self.started_at, time.perf_counter() - start, status))
+        return response
+
+    def add_stats(self):
+        for _ in range(self.rng.randint(1, self.args.burst_size)):
+            game_id, game_name, game_installment = self.rng.choice(self.user["games"])
+            ranked = self.rng.random() < 0.6
+            stat_types = self.rng.sample(range(1, self.args.stats_per_match + 1), self.rng.randint(1, self.args.stats_per_match))
+            self.call("POST", "/api/add_stats", "/api/add_stats", json={
+                "game_name": game_name, "game_installment": game_installment, "player_name": self.rng.choice(self.user["players"]),
+                "stats": [{
+                    "stat_type": f"Stat {stat_type}", "stat_value": self.rng.randint(0, 30), "game_mode": self.rng.choice(GAME_MODES),
+                    "game_level": self.rng.randint(1, 50), "win": self.rng.randint(0, 1), "ranked": int(ranked),
+                    "pre_match_rank_value": self.rng.choice(RANKS) if ranked else None,
+                    "post_match_rank_value": self.rng.choice(RANKS) if ranked else None,
+                } for stat_type in stat_types],
+            })
+
+    def lookups(self):
+        """The fan-out the Stats page makes: player and game lists, then everything about one game."""
+        self.call("GET", "/api/get_players", "/api/get_players")
+        self.call("GET", "/api/get_games", "/api/get_games")
+        game_id, game_name, _ = self.rng.choice(self.user["games"])
+        self.call("GET", "/api/get_game_franchises", "/api/get_game_franchises")
+        self.call("GET", "/api/get_game_installments/<franchise_name>", f"/api/get_game_installments/{game_name}")
+        for route in ("get_game_details", "get_game_ranks", "get_game_modes", "get_game_stat_types"):
+            self.call("GET", f"/api/{route}/<game_id>", f"/api/{route}/{game_id}")
+
+    def reads(self):
+        self.call("GET", "/api/stats", "/api/stats", params={"limit": 50})
+        self.call("GET", "/api/summary", "/api/summary", params={"group_by": "game,stat_type", "metrics": "count,avg,p90,win_rate"})
+
+    def deletes(self):
+        """Deletes the newest 1-3 stat rows, usually ones this run added."""
+        response = self.call("GET", "/api/stats", "/api/stats", params={"limit": 3})
+        if response is None or response.status_code != 200:
+            return
+        stat_ids = [row["stat_id"] for row in response.json()["stats"]][:self.rng.randint(1, 3)]
+        if len(stat_ids) == 1:
+            self.call("DELETE", "/api/delete_stats/<stat_id>", f"/api/delete_stats/{stat_ids[0]}")
+        elif stat_ids:
+            self.call("DELETE", "/api/delete_stats", "/api/delete_stats", json={"stat_ids": stat_ids})
+
+    def run(self, mix, stop_at):
+        scenarios, weights = zip(*mix.items())
+        while time.perf_counter() < stop_at:
+            getattr(self, self.rng.choices(scenarios, weights)[0])()
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("add_stats", "lookups", "reads", "deletes"):
+            raise argparse.ArgumentTypeError(f"unknown scenario '{name.strip()}' (add_stats, lookups, reads, deletes)")
+        mix[name.strip()] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one scenario with a positive weight")
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+# --- Results ---
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+def summarize(samples, seconds):
+    latencies = sorted(latency * 1000 for _, _, latency, _ in samples)
+    status_counts = {}
+    for _, _, _, status in samples:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    errors = sum(count for status, count in status_counts.items() if status == "0" or status.startswith("5"))
+    return {
+        "requests": len(samples), "errors": errors, "error_rate": round(errors / len(samples), 4),
+        "throughput_rps": round(len(samples) / seconds, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 2), "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2), "max_ms": round(latencies[-1], 2), "status_counts": status_counts,
+    }
+
+def print_results(results):
+    print(f"\n{'route':<50} | {'requests':>8} | {'req/s':>8} | {'5xx':>5} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    print("-" * 112)
+    for route, stats in sorted(results["routes"].items()) + [("TOTAL", results["overall"])]:
+        print(f"{route:<50} | {stats['requests']:>8} | {stats['throughput_rps']:>8.1f} | {stats['errors']:>5} | "
+              f"{stats['p50_ms']:>8.2f} | {stats['p95_ms']:>8.2f} | {stats['p99_ms']:>8.2f}")
+
+def compare_to_baseline(results, baseline, args):
+    """Prints the per-route change against the baseline and returns the regressions found."""
+    regressions = []
+    base_overall, overall = baseline["overall"], results["overall"]
+    throughput_change = overall["throughput_rps"] / base_overall["throughput_rps"] - 1 if base_overall["throughput_rps"] else 0
+    if throughput_change < -args.max_throughput_regression:
+        regressions.append(f"throughput fell {-throughput_change:.0%} ({base_overall['throughput_rps']} -> {overall['throughput_rps']} req/s)")
+
+    print(f"\n{'route vs baseline':<50} | {'p95 ms':>19} | {'p99 ms':>19} | {'5xx rate':>15}")
+    print("-" * 112)
+    for route, base in sorted(baseline["routes"].items()):
+        current = results["routes"].get(route)
+        if current is None:
+            print(f"{route:<50} | not requested in this run")
+            continue
+        cells = []
+        enough_samples = min(current["requests"], base["requests"]) >= args.min_samples
+        for key in ("p95_ms", "p99_ms"):
+            change = current[key] / base[key] - 1 if base[key] else 0
+            cells.append(f"{base[key]:>7.1f} -> {current[key]:>7.1f}")
+            if enough_samples and change > args.max_latency_regression and current[key] - base[key] > args.min_latency_delta_ms:
+                regressions.append(f"{route} {key[:3]} rose {change:.0%} ({base[key]} -> {current[key]} ms)")
+        if enough_samples and current["error_rate"] > base["error_rate"] + args.max_error_rate_increase:
+            regressions.append(f"{route} 5xx rate rose from {base['error_rate']:.2%} to {current['error_rate']:.2%}")
+        print(f"{route:<50} | {cells[0]:>19} | {cells[1]:>19} | {base['error_rate']:>6.2%} -> {current['error_rate']:>6.2%}")
+    print(f"{'TOTAL throughput':<50} | {base_overall['throughput_rps']:.1f} -> {overall['throughput_rps']:.1f} req/s ({throughput_change:+.0%})")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as out:
+        json.dump(data, out, indent=2, sort_keys=True)
+        out.write("\n")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    database = parser.add_argument_group("database")
+    database.add_argument("--embedded", action="store_true", help="run against a throwaway pgserver database")
+    database.add_argument("--drop-schemas", action="store_true", help="allow dropping dim/fact/ops in the DB_* database")
+    dataset = parser.add_argument_group("synthetic dataset")
+    dataset.add_argument("--users", type=int, default=8)
+    dataset.add_argument("--players-per-user", type=int, default=3)
+    dataset.add_argument("--games", type=int, default=20)
+    dataset.add_argument("--matches-per-player", type=int, default=500)
+    dataset.add_argument("--stats-per-match", type=int, default=4)
+    dataset.add_argument("--days", type=int, default=180, help="played_at is spread over this many past days")
+    load = parser.add_argument_group("load")
+    load.add_argument("--concurrency", type=int, default=8, help="client threads, each acting as one seeded user")
+    load.add_argument("--duration", type=float, default=60, help="seconds of measured load")
+    load.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring starts")
+    load.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    load.add_argument("--burst-size", type=int, default=5, help="most add_stats calls in one burst")
+    load.add_argument("--seed", type=int, default=42)
+    load.add_argument("--request-timeout", type=float, default=60)
+    server = parser.add_argument_group("server")
+    server.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn")
+    server.add_argument("--workers", type=int, default=2, help="GUNICORN_WORKERS")
+    server.add_argument("--threads", type=int, default=4, help="GUNICORN_THREADS (also the minimum DB_POOL_MAX)")
+    server.add_argument("--port", type=int, default=None, help="default: a free port")
+    server.add_argument("--startup-timeout", type=float, default=60)
+    output = parser.add_argument_group("results")
+    output.add_argument("--output", default=None, help="results JSON (default benchmarks/results/load_test_<time>.json)")
+    output.add_argument("--baseline", help="fail (exit 1) on a regression against this results file")
+    output.add_argument("--save-baseline", help="also write this run's results here")
+    output.add_argument("--max-latency-regression", type=float, default=0.20, help="allowed p95/p99 growth per route")
+    output.add_argument("--min-latency-delta-ms", type=float, default=5, help="ignore p95/p99 growth smaller than this")
+    output.add_argument("--max-throughput-regression", type=float, default=0.15, help="allowed drop in total req/s")
+    output.add_argument("--max-error-rate-increase", type=float, default=0.01, help="allowed rise in a route's 5xx rate")
+    output.add_argument("--min-samples", type=int, default=50, help="routes with fewer requests aren't checked")
+    output.add_argument("--allow-config-mismatch", action="store_true", help="compare to a baseline recorded with other settings")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    embedded_server = None
+    if args.embedded:
+        embedded_server, db_env = start_embedded_database()
+    elif not args.drop_schemas:
+        sys.exit("The load test drops and reseeds the dim, fact and ops schemas. Pass --embedded, or --drop-schemas "
+                 "to use the database in the DB_* environment variables.")
+    else:
+        db_env = {name: os.environ[name] for name in ("DB_URL", "DB_PORT", "DB_NAME", "DB_USER", "DB_PASSWORD") if name in os.environ}
+
+    port = args.port or free_port()
+    env = dict(os.environ, **db_env)
+    env.update({
+        "PORT": str(port), "API_KEY": secrets.token_hex(16), "JWT_SECRET_KEY": secrets.token_hex(32),
+        "GUNICORN_WORKERS": str(args.workers), "GUNICORN_THREADS": str(args.threads),
+        "DB_POOL_MAX": str(max(args.threads, int(os.environ.get("DB_POOL_MAX", 0)))),
+        "SUMMARY_PERCENTILE_MODE": "exact", # APPROXIMATE PERCENTILE_DISC is Redshift-only
+        "TABLE_MAINTENANCE_ENABLED": "false", # VACUUM DELETE ONLY is Redshift-only
+    })
+    # flask_app reads its settings at import, so the environment has to be in place first.
+    os.environ.update(env)
+    sys.path.insert(0, REPO_ROOT)
+    import flask_app
+
+    config = {
+        "dataset": {name: getattr(args, name) for name in ("users", "players_per_user", "games", "matches_per_player", "stats_per_match", "days")},
+        "load": {"concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup, "mix": args.mix,
+                 "burst_size": args.burst_size, "seed": args.seed},
+        "server": {"server": args.server, "workers": args.workers if args.server == "gunicorn" else 1, "threads": args.threads,
+                   "embedded_database": args.embedded,
+                   "env": {name: value for name, value in sorted(env.items()) if name.startswith(SERVER_ENV_PREFIXES)}},
+    }
+    if baseline is not None and baseline.get("config") != config:
+        differing = sorted(key for key in set(config) | set(baseline.get("config", {}))
+                           if config.get(key) != baseline.get("config", {}).get(key))
+        print(f"WARNING: the baseline was recorded with different {', '.join(differing)} settings.")
+        if not args.allow_config_mismatch:
+            sys.exit(2)
+
+    log_path = os.path.join(tempfile.gettempdir(), f"vgst_load_test_server_{port}.log")
+    process = None
+    try:
+        print(f"Seeding {args.users * args.players_per_user * args.matches_per_player} matches...")
+        row_counts = prepare_database(flask_app, args)
+        users = load_virtual_users(flask_app)
+        with open(log_path, "w") as log_file:
+            process, base_url = start_server(args, env, port, log_file)
+            print(f"{args.server} is up at {base_url} (log: {log_path}); running {args.concurrency} users for "
+                  f"{args.warmup:g}s warmup + {args.duration:g}s...")
+            samples_per_thread = [[] for _ in range(args.concurrency)]
+            started_at = time.perf_counter()
+            stop_at = started_at + args.warmup + args.duration
+            threads = [threading.Thread(target=VirtualUser(
+                base_url, users[thread_no % len(users)], random.Random(f"{args.seed}:{thread_no}"), args,
+                samples_per_thread[thread_no], started_at).run, args=(args.mix, stop_at)) for thread_no in range(args.concurrency)]
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+            measured_seconds = time.perf_counter() - started_at - args.warmup
+    finally:
+        if process is not None:
+            stop_server(process)
+        if embedded_server is not None:
+            embedded_server.cleanup()
+
+    samples = [sample for thread_samples in samples_per_thread for sample in thread_samples if sample[1] >= args.warmup]
+    if not samples:
+        sys.exit("No requests completed after the warmup; increase --duration.")
+    by_route = {}
+    for sample in samples:
+        by_route.setdefault(sample[0], []).append(sample)
+    results = {
+        "version": RESULTS_VERSION,
+        "recorded_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "git_commit": git_commit(), "python": platform.python_version(), "host": platform.node(),
+        "config": config, "row_counts": row_counts, "measured_seconds": round(measured_seconds, 2),
+        "overall": summarize(samples, measured_seconds),
+        "routes": {route: summarize(route_samples, measured_seconds) for route, route_samples in by_route.items()},
+    }
+    print_results(results)
+
+    output_path = args.output or os.path.join(REPO_ROOT, "benchmarks", "results",
+                                              f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    write_json(output_path, results)
+    print(f"\nResults written to {output_path}")
+    if args.save_baseline:
+        write_json(args.save_baseline, results)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, args)
+        if regressions:
+            print("\nREGRESSIONS against " + args.baseline + ":\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+-- PostgreSQL stand-in for the Redshift schema built by create_tables() in flask_app.py, used by
+-- benchmarks/load_test.py. IDENTITY(1, 1) becomes SERIAL, DISTKEY/SORTKEY are dropped, and GETDATE()
+-- is defined. Redshift declares UNIQUE and REFERENCES constraints but doesn't enforce them, so they
+-- are left off here too, and the stand-in accepts the same writes the cluster does.
+-- Running this file DROPS the dim, fact and ops schemas.
+DROP SCHEMA IF EXISTS dim CASCADE;
+DROP SCHEMA IF EXISTS fact CASCADE;
+DROP SCHEMA IF EXISTS ops CASCADE;
+CREATE SCHEMA dim;
+CREATE SCHEMA fact;
+CREATE SCHEMA ops;
+
+CREATE OR REPLACE FUNCTION public.getdate() RETURNS TIMESTAMP LANGUAGE sql STABLE AS $$ SELECT now()::TIMESTAMP $$;
+
+CREATE TABLE dim.dim_users (
+    user_id SERIAL PRIMARY KEY,
+    user_email VARCHAR(255) NOT NULL,
+    is_trusted BOOLEAN NOT NULL DEFAULT FALSE,
+    token_version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE dim.dim_games (
+    game_id SERIAL PRIMARY KEY,
+    game_name VARCHAR(255) NOT NULL,
+    game_installment VARCHAR(255),
+    game_genre VARCHAR(255),
+    game_subgenre VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE dim.dim_players (
+    player_id SERIAL PRIMARY KEY,
+    player_name VARCHAR(255) NOT NULL,
+    user_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE dim.dim_ranks (
+    rank_id SERIAL PRIMARY KEY,
+    game_id INTEGER NOT NULL,
+    rank_label VARCHAR(50) NOT NULL,
+    rank_ordinal INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE dim.dim_game_modes (
+    game_mode_id SERIAL PRIMARY KEY,
+    game_id INTEGER NOT NULL,
+    game_mode VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE dim.dim_stat_types (
+    stat_type_id SERIAL PRIMARY KEY,
+    game_id INTEGER NOT NULL,
+    stat_type VARCHAR(50) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE fact.fact_matches (
+    match_id SERIAL PRIMARY KEY,
+    match_key CHAR(32) NOT NULL,
+    game_id INTEGER,
+    player_id INTEGER,
+    game_mode_id INTEGER,
+    game_level INTEGER,
+    win INTEGER,
+    ranked INTEGER,
+    pre_match_rank_value VARCHAR(50),
+    post_match_rank_value VARCHAR(50),
+    pre_match_rank_id INTEGER,
+    post_match_rank_id INTEGER,
+    played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- Stand-ins for the sort keys: COMPOUND SORTKEY(player_id, played_at) and SORTKEY(match_id)
+CREATE INDEX fact_matches_player_played_at ON fact.fact_matches (player_id, played_at);
+CREATE INDEX fact_matches_match_key ON fact.fact_matches (match_key);
+
+CREATE TABLE fact.fact_match_stats (
+    stat_id SERIAL PRIMARY KEY,
+    match_id INTEGER NOT NULL,
+    stat_type_id INTEGER NOT NULL,
+    stat_value INTEGER
+);
+CREATE INDEX fact_match_stats_match_id ON fact.fact_match_stats (match_id);
+
+CREATE TABLE fact.agg_daily_player_game_stat (
+    stat_date DATE NOT NULL,
+    player_id INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    stat_type VARCHAR(50) NOT NULL,
+    game_mode VARCHAR(255),
+    stat_count BIGINT NOT NULL,
+    value_count BIGINT NOT NULL,
+    stat_sum BIGINT,
+    stat_min INTEGER,
+    stat_max INTEGER,
+    win_count BIGINT NOT NULL,
+    loss_count BIGINT NOT NULL,
+    ranked_count BIGINT NOT NULL,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX agg_daily_player_game_stat_player ON fact.agg_daily_player_game_stat (player_id, game_id, stat_date);
+
+CREATE TABLE ops.idempotency_keys (
+    user_id INTEGER NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    claim_token CHAR(32),
+    status_code INTEGER,
+    response_body VARCHAR(65535),
+    claimed_at TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX idempotency_keys_user_key ON ops.idempotency_keys (user_id, idempotency_key);
@@ -0,0 +1,368 @@
+"""
+Staged COPY loader for fact.fact_matches / fact.fact_match_stats.
+
+For very large imports, INSERT is the slow path on Redshift. This module turns batches of
+add_stats-shaped match records into compressed Parquet or gzipped CSV files, stages them in an
+object store, COPYs them into a temp staging table and then merges the staging rows into
+dim.dim_games, dim.dim_players and the match tables (filling in rank ids and refreshing the
+daily rollups for the affected players/games) in a single transaction.
+
+The object store is pluggable:
+  - S3ObjectStore: Redshift COPY from S3 (endpoint_url can point at a local S3 stand-in).
+  - LocalObjectStore: files on disk, loaded with COPY FROM STDIN (CSV only). Intended for tests
+    and a local PostgreSQL stand-in.
+
+Usage:
+    python copy_loader.py --email you@example.com --input matches.ndjson --format parquet
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import uuid
+from datetime import datetime
+
+import psycopg2
+
+from flask_app import refresh_daily_rollups, backfill_rank_ids, MATCH_HEADER_FIELDS
+
+STAGING_TABLE = "stage_match_stats"
+
+# Staging layout. Files are written with exactly these columns in this order.
+STAGING_COLUMNS = [
+    ("game_name", "VARCHAR(255)"),
+    ("game_installment", "VARCHAR(255)"),
+    ("game_genre", "VARCHAR(255)"),
+    ("game_subgenre", "VARCHAR(255)"),
+    ("player_name", "VARCHAR(255)"),
+    ("stat_type", "VARCHAR(50)"),
+    ("stat_value", "INTEGER"),
+    ("game_mode", "VARCHAR(255)"),
+    ("game_level", "INTEGER"),
+    ("win", "INTEGER"),
+    ("ranked", "INTEGER"),
+    ("pre_match_rank_value", "VARCHAR(50)"),
+    ("post_match_rank_value", "VARCHAR(50)"),
+    ("played_at", "TIMESTAMP"),
+    ("match_key", "CHAR(32)"),
+]
+
+FILE_EXTENSIONS = {"parquet": "parquet", "csv": "csv.gz"}
+DEFAULT_ROWS_PER_FILE = 100000
+
+# --- Record Flattening & Serialization ---
+
+def flatten_records(records):
+    """
+    Yields one staging row per valid stat in add_stats-shaped match records. Uses the same
+    rules as /api/add_stats: a match needs game_name, player_name and a list of stats, and a
+    stat needs a stat_type and a non-null stat_value. Invalid matches/stats are skipped.
+    An optional ISO-8601 'played_at' is parsed here; rows without one get GETDATE() on merge.
+    Stats of a record that share match header attributes get the same match_key, which becomes
+    one fact.fact_matches row on merge (as with insert_stat_rows).
+    """
+    for record in records:
+        stats = record.get('stats')
+        if not record.get('game_name') or not record.get('player_name') or not isinstance(stats, list):
+            continue
+        played_at = record.get('played_at')
+        if played_at is not None:
+            played_at = datetime.fromisoformat(str(played_at))
+        match_keys = {}
+        for stat_record in stats:
+            if not isinstance(stat_record, dict) or not stat_record.get('stat_type') or stat_record.get('stat_value') is None:
+                continue
+            header = tuple(stat_record.get(field) for field in MATCH_HEADER_FIELDS)
+            yield (
+                record['game_name'], record.get('game_installment') or None,
+                record.get('game_genre'), record.get('game_subgenre'), record['player_name'],
+                stat_record['stat_type'], stat_record['stat_value'], stat_record.get('game_mode'),
+                stat_record.get('game_level'), stat_record.get('win'), stat_record.get('ranked'),
+                stat_record.get('pre_match_rank_value'), stat_record.get('post_match_rank_value'),
+                played_at, match_keys.setdefault(header, uuid.uuid4().hex),
+            )
+
+def serialize_rows(rows, file_format):
+    """Encodes staging rows as snappy-compressed Parquet or gzipped CSV bytes."""
+    if file_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([
+            (name, pa.timestamp("us") if sql_type == "TIMESTAMP" else pa.int32() if sql_type == "INTEGER" else pa.string())
+            for name, sql_type in STAGING_COLUMNS
+        ])
+        columns = list(zip(*rows)) if rows else [[] for _ in STAGING_COLUMNS]
+        arrays = [pa.array(list(values), type=field.type) for field, values in zip(schema, columns)]
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_arrays(arrays, schema=schema), buffer, compression="snappy")
+        return buffer.getvalue()
+    if file_format == "csv":
+        text = io.StringIO()
+        writer = csv.writer(text)
+        for row in rows:
+            writer.writerow(["" if value is None else value for value in row])
+        return gzip.compress(text.getvalue().encode("utf-8"))
+    raise ValueError(f"Unsupported file format: {file_format}")
+
+# --- Object Stores ---
+
+class LocalObjectStore:
+    """Stages files under a local directory and loads them with COPY FROM STDIN (CSV only)."""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def _path(self, key):
+        return os.path.join(self.root_dir, *key.split("/"))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def copy_into(self, cur, table, key, file_format):
+        if file_format != "csv":
+            raise ValueError("LocalObjectStore can only COPY csv files")
+        with gzip.open(self._path(key), "rt", encoding="utf-8", newline="") as f:
+            cur.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv);", f)
+
+class S3ObjectStore:
+    """Stages files in S3 and loads them with Redshift COPY using an IAM role."""
+
+    def __init__(self, bucket, prefix="", iam_role=None, region=None, endpoint_url=None, client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.iam_role = iam_role
+        self.region = region
+        if client is None:
+            import boto3
+            client = boto3.client("s3", region_name=region, endpoint_url=endpoint_url)
+        self.client = client
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def copy_into(self, cur, table, key, file_format):
+        if not self.iam_role:
+            raise ValueError("S3ObjectStore needs an IAM role to COPY into Redshift")
+        source = f"s3://{self.bucket}/{self._key(key)}"
+        options = "FORMAT AS PARQUET" if file_format == "parquet" else "FORMAT AS CSV GZIP EMPTYASNULL TIMEFORMAT 'auto'"
+        region = f" REGION '{self.region}'" if self.region else ""
+        cur.execute(f"COPY {table} FROM %s IAM_ROLE %s {options}{region};", (source, self.iam_role))
+
+# --- Loader ---
+
+class StatsCopyLoader:
+    """
+    Loads add_stats-shaped match records for one user via staged files and COPY.
+    Nothing is visible until the final merge commits; staged files are removed afterwards.
+    """
+
+    def __init__(self, conn, store, file_format="parquet", rows_per_file=DEFAULT_ROWS_PER_FILE, keep_files=False):
+        if file_format not in FILE_EXTENSIONS:
+            raise ValueError(f"Unsupported file format: {file_format}")
+        self.conn = conn
+        self.store = store
+        self.file_format = file_format
+        self.rows_per_file = rows_per_file
+        self.keep_files = keep_files
+
+    def _stage(self, cur, records, batch_id):
+        """Writes and COPYs one file per rows_per_file staging rows. Returns (keys, rows_staged)."""
+        keys, rows_staged, chunk = [], 0, []
+
+        def stage_chunk():
+            key = f"match_stats/{batch_id}/part-{len(keys):05d}.{FILE_EXTENSIONS[self.file_format]}"
+            self.store.put(key, serialize_rows(chunk, self.file_format))
+            keys.append(key)
+            self.store.copy_into(cur, STAGING_TABLE, key, self.file_format)
+
+        for row in flatten_records(records):
+            chunk.append(row)
+            if len(chunk) >= self.rows_per_file:
+                stage_chunk(); rows_staged += len(chunk); chunk = []
+        if chunk:
+            stage_chunk(); rows_staged += len(chunk)
+        return keys, rows_staged
+
+    def _merge(self, cur, user_id):
+        """Creates missing games/players/labels and moves staged rows into the match tables."""
+        result = {}
+        cur.execute("LOCK dim.dim_games, dim.dim_players;")
+        cur.execute(f"""
+            INSERT INTO dim.dim_games (game_name, game_installment, game_genre, game_subgenre, created_at, last_played_at)
+            SELECT s.game_name, s.game_installment, MAX(s.game_genre), MAX(s.game_subgenre), GETDATE(), GETDATE()
+            FROM {STAGING_TABLE} s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM dim.dim_games g
+                WHERE g.game_name = s.game_name
+                AND (g.game_installment = s.game_installment OR (g.game_installment IS NULL AND s.game_installment IS NULL))
+            )
+            GROUP BY s.game_name, s.game_installment;
+        """)
+        result["games_created"] = cur.rowcount
+        cur.execute(f"""
+            INSERT INTO dim.dim_players (player_name, user_id, created_at)
+            SELECT DISTINCT s.player_name, %s, GETDATE()
+            FROM {STAGING_TABLE} s
+            WHERE NOT EXISTS (SELECT 1 FROM dim.dim_players p WHERE p.player_name = s.player_name AND p.user_id = %s);
+        """, (user_id, user_id))
+        result["players_created"] = cur.rowcount
+        resolved = f"""
+            FROM {STAGING_TABLE} s
+            JOIN (
+                SELECT game_name, game_installment, MIN(game_id) AS game_id
+                FROM dim.dim_games GROUP BY game_name, game_installment
+            ) g ON g.game_name = s.game_name
+                AND (g.game_installment = s.game_installment OR (g.game_installment IS NULL AND s.game_installment IS NULL))
+            JOIN (
+                SELECT player_name, MIN(player_id) AS player_id
+                FROM dim.dim_players WHERE user_id = %s GROUP BY player_name
+            ) p ON p.player_name = s.player_name
+        """
+        # Same lock order as add_stats: games/players, then the label dictionaries, then ranks.
+        cur.execute("LOCK dim.dim_game_modes, dim.dim_stat_types;")
+        cur.execute(f"""
+            INSERT INTO dim.dim_game_modes (game_id, game_mode, created_at)
+            SELECT DISTINCT g.game_id, s.game_mode, GETDATE()
+            {resolved}
+            WHERE s.game_mode IS NOT NULL AND s.game_mode != ''
+            AND NOT EXISTS (SELECT 1 FROM dim.dim_game_modes d WHERE d.game_id = g.game_id AND d.game_mode = s.game_mode);
+        """, (user_id,))
+        cur.execute(f"""
+            INSERT INTO dim.dim_stat_types (game_id, stat_type, created_at)
+            SELECT DISTINCT g.game_id, s.stat_type, GETDATE()
+            {resolved}
+            WHERE NOT EXISTS (SELECT 1 FROM dim.dim_stat_types d WHERE d.game_id = g.game_id AND d.stat_type = s.stat_type);
+        """, (user_id,))
+        cur.execute(f"""
+            INSERT INTO fact.fact_matches
+            (match_key, game_id, player_id, game_mode_id, game_level, win, ranked, pre_match_rank_value, post_match_rank_value, played_at)
+            SELECT s.match_key, g.game_id, p.player_id, gm.game_mode_id, s.game_level, s.win, s.ranked,
+                   s.pre_match_rank_value, s.post_match_rank_value, COALESCE(s.played_at, GETDATE())
+            {resolved}
+            LEFT JOIN (
+                SELECT game_id, game_mode, MIN(game_mode_id) AS game_mode_id FROM dim.dim_game_modes GROUP BY game_id, game_mode
+            ) gm ON gm.game_id = g.game_id AND gm.game_mode = s.game_mode
+            GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10;
+        """, (user_id,))
+        result["matches_merged"] = cur.rowcount
+        cur.execute(f"""
+            INSERT INTO fact.fact_match_stats (match_id, stat_type_id, stat_value)
+            SELECT m.match_id, st.stat_type_id, s.stat_value
+            FROM {STAGING_TABLE} s
+            JOIN fact.fact_matches m ON m.match_key = s.match_key
+            JOIN (
+                SELECT game_id, stat_type, MIN(stat_type_id) AS stat_type_id FROM dim.dim_stat_types GROUP BY game_id, stat_type
+            ) st ON st.game_id = m.game_id AND st.stat_type = s.stat_type
+            WHERE m.player_id IN (SELECT player_id FROM dim.dim_players WHERE user_id = %s);
+        """, (user_id,))
+        result["rows_merged"] = cur.rowcount
+        cur.execute(f"""
+            SELECT p.player_id, g.game_id,
+                   MIN(CAST(COALESCE(s.played_at, GETDATE()) AS DATE)), MAX(CAST(COALESCE(s.played_at, GETDATE()) AS DATE))
+            {resolved}
+            GROUP BY 1, 2;
+        """, (user_id,))
+        spans = cur.fetchall()
+        # Ranks before rollups, the same order add_stats writes them in.
+        if spans:
+            result["rank_ids_set"] = backfill_rank_ids(cur, {game_id for _, game_id, _, _ in spans})
+        refresh_daily_rollups(cur, [(player_id, game_id, day) for player_id, game_id, first_day, last_day in spans
+                                    for day in (first_day, last_day)])
+        cur.execute(f"UPDATE dim.dim_games SET last_played_at = GETDATE() WHERE game_id IN (SELECT g.game_id {resolved});", (user_id,))
+        return result
+
+    def load(self, records, user_id):
+        """Stages, COPYs and merges `records` (any iterable of dicts) for `user_id`. Returns load counts."""
+        batch_id = uuid.uuid4().hex
+        keys = []
+        cur = self.conn.cursor()
+        try:
+            columns_sql = ", ".join(f"{name} {sql_type}" for name, sql_type in STAGING_COLUMNS)
+            cur.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}; CREATE TEMP TABLE {STAGING_TABLE} ({columns_sql});")
+            keys, rows_staged = self._stage(cur, records, batch_id)
+            result = {"batch_id": batch_id, "files": len(keys), "rows_staged": rows_staged,
+                      "games_created": 0, "players_created": 0, "rows_merged": 0}
+            if rows_staged:
+                result.update(self._merge(cur, user_id))
+            cur.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE};")
+            self.conn.commit()
+            print(f"COPY load {batch_id} committed: {result}")
+            return result
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"COPY load {batch_id} failed: {error}")
+            self.conn.rollback()
+            raise
+        finally:
+            if not self.keep_files:
+                for key in keys:
+                    try:
+                        self.store.delete(key)
+                    except Exception as error:
+                        print(f"Warning: could not remove staged file {key}: {error}")
+
+# --- CLI ---
+
+def store_from_env():
+    """Builds the object store from COPY_* environment variables (S3 if COPY_S3_BUCKET is set)."""
+    bucket = os.environ.get("COPY_S3_BUCKET")
+    if bucket:
+        return S3ObjectStore(
+            bucket,
+            prefix=os.environ.get("COPY_S3_PREFIX", ""),
+            iam_role=os.environ.get("COPY_IAM_ROLE"),
+            region=os.environ.get("AWS_REGION"),
+            endpoint_url=os.environ.get("COPY_S3_ENDPOINT_URL"),
+        )
+    return LocalObjectStore(os.environ.get("COPY_LOCAL_DIR", "copy_staging"))
+
+def read_ndjson(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--email", required=True, help="Owner of the imported players")
+    parser.add_argument("--input", required=True, help="NDJSON file of add_stats-shaped match records")
+    parser.add_argument("--format", choices=sorted(FILE_EXTENSIONS), default="parquet")
+    parser.add_argument("--rows-per-file", type=int, default=DEFAULT_ROWS_PER_FILE)
+    parser.add_argument("--keep-files", action="store_true", help="Leave staged files in the object store")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=os.environ.get("DB_URL"), database=os.environ.get("DB_NAME"),
+        user=os.environ.get("DB_USER"), password=os.environ.get("DB_PASSWORD"),
+        port=int(os.environ.get("DB_PORT", 5439)), connect_timeout=10
+    )
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT user_id, is_trusted FROM dim.dim_users WHERE user_email = %s;", (args.email,))
+            user_record = cur.fetchone()
+        if not user_record or not user_record[1]:
+            raise SystemExit(f"User {args.email} not found or not trusted.")
+        loader = StatsCopyLoader(conn, store_from_env(), file_format=args.format,
+                                 rows_per_file=args.rows_per_file, keep_files=args.keep_files)
+        print(json.dumps(loader.load(read_ndjson(args.input), user_record[0])))
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,23 @@
 import os
+import json
+import base64
+import hashlib
+import time
+import random
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
 import psycopg2
-from psycopg2.pool import SimpleConnectionPool
-from flask import Flask, request, jsonify
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from cachelib import SimpleCache, FileSystemCache, RedisCache, NullCache
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 import jwt
+from write_queue import WriteQueue, QueueFlusher, QueueKeyReused
+from metrics import REGISTRY, REQUEST_SECONDS, DB_POOL_WAIT_SECONDS, ROWS_INSERTED, InstrumentedConnection, InstrumentedCursor
+from slow_queries import SlowQueryLog
 
 app = Flask(__name__)
 
@@ -17,49 +31,256 @@ JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
 TRUSTED_EMAILS_STR = os.environ.get("TRUSTED_EMAILS", "")
 TRUSTED_EMAILS_LIST = [email.strip() for email in TRUSTED_EMAILS_STR.split(',') if email.strip()]
 
+# Max rows per multi-row INSERT statement when writing fact rows
+STATS_INSERT_CHUNK_SIZE = int(os.environ.get("STATS_INSERT_CHUNK_SIZE", 100))
+# Match records (NDJSON lines) per transaction for /api/bulk_add_stats
+BULK_COMMIT_CHUNK_SIZE = int(os.environ.get("BULK_COMMIT_CHUNK_SIZE", 500))
+BULK_MAX_CHUNK_SIZE = 5000
+# Process-local dimension cache bounds
+DIM_CACHE_MAX_ENTRIES = int(os.environ.get("DIM_CACHE_MAX_ENTRIES", 10000))
+DIM_CACHE_TTL_SECONDS = int(os.environ.get("DIM_CACHE_TTL_SECONDS", 300))
+# How long a worker reuses a user's token_version when checking JWTs. add_trusted_user only clears the
+# cache of the worker that handled it, so this is how long other workers may still accept a revoked
+# token (0 reads dim_users on every request)
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_CACHE_TTL_SECONDS", 5))
+# Page size bounds for /api/stats
+STATS_PAGE_DEFAULT_LIMIT = 50
+STATS_PAGE_MAX_LIMIT = 500
+# /api/summary: max groups returned, and 'approximate' (Redshift APPROXIMATE PERCENTILE_DISC)
+# or 'exact' (PERCENTILE_CONT, also works on PostgreSQL) percentiles
+SUMMARY_MAX_GROUPS = 1000
+SUMMARY_PERCENTILE_MODE = os.environ.get("SUMMARY_PERCENTILE_MODE", "approximate").lower()
+# Serve /api/summary from fact.agg_daily_player_game_stat when the query allows it
+SUMMARY_USE_ROLLUPS = os.environ.get("SUMMARY_USE_ROLLUPS", "true").lower() == "true"
+# Per-user response cache for read endpoints: 'simple' (in-process), 'filesystem', 'redis' or 'null'
+RESPONSE_CACHE_TYPE = os.environ.get("RESPONSE_CACHE_TYPE", "simple").lower()
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 5000))
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", 300))
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR", "/tmp/vgst_response_cache")
+RESPONSE_CACHE_REDIS_URL = os.environ.get("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Idempotency-Key records: how long a finished response is replayed, and how long an unfinished
+# attempt blocks retries before it counts as abandoned (keep it above GUNICORN_TIMEOUT)
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 86400))
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", 180))
+IDEMPOTENCY_KEY_MAX_LENGTH = 200 # Bulk imports store one record per line under "<key>:<line>"
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = 3600
+# Cascading deletes (delete_player) remove matches in chunks of this size, committing in between.
+# Tables that lose TABLE_MAINTENANCE_MIN_ROWS rows get VACUUM DELETE ONLY + ANALYZE after a delay.
+CASCADE_DELETE_BATCH_SIZE = int(os.environ.get("CASCADE_DELETE_BATCH_SIZE", 5000))
+TABLE_MAINTENANCE_ENABLED = os.environ.get("TABLE_MAINTENANCE_ENABLED", "true").lower() == "true"
+TABLE_MAINTENANCE_DELAY_SECONDS = float(os.environ.get("TABLE_MAINTENANCE_DELAY_SECONDS", 300))
+TABLE_MAINTENANCE_MIN_ROWS = int(os.environ.get("TABLE_MAINTENANCE_MIN_ROWS", 10000))
+# Group commit for add_stats, update_game and delete_stats: how long the first write waits for
+# others to share its transaction (0 disables), and the most writes per transaction
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("GROUP_COMMIT_WINDOW_MS", 0))
+GROUP_COMMIT_MAX_UNITS = int(os.environ.get("GROUP_COMMIT_MAX_UNITS", 50))
+# Rollup refreshes take no table lock, so Redshift may abort a write that conflicts with a
+# concurrent one (serializable isolation violation, error 1023); it is rerun up to this many times
+WRITE_CONFLICT_RETRIES = int(os.environ.get("WRITE_CONFLICT_RETRIES", 3))
+# Write-behind queue for add_stats requests sent with 'Prefer: respond-async' (off when unset)
+WRITE_QUEUE_PATH = os.environ.get("WRITE_QUEUE_PATH")
+WRITE_QUEUE_BATCH_SIZE = int(os.environ.get("WRITE_QUEUE_BATCH_SIZE", 200))
+WRITE_QUEUE_FLUSH_INTERVAL_SECONDS = float(os.environ.get("WRITE_QUEUE_FLUSH_INTERVAL_SECONDS", 1.0))
+WRITE_QUEUE_MAX_ATTEMPTS = int(os.environ.get("WRITE_QUEUE_MAX_ATTEMPTS", 8))
+# Slow-query log: statements at or over the threshold (negative disables) go to a rotating JSON-lines
+# file and /admin/slow_queries; the first SLOW_QUERY_EXPLAIN_LIMIT of each normalized statement get an EXPLAIN
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 500))
+SLOW_QUERY_EXPLAIN_LIMIT = int(os.environ.get("SLOW_QUERY_EXPLAIN_LIMIT", 3))
+SLOW_QUERY_LOG_PATH = os.environ.get("SLOW_QUERY_LOG_PATH", "/tmp/vgst_slow_queries.log")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get("SLOW_QUERY_LOG_MAX_BYTES", 10 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUP_COUNT = int(os.environ.get("SLOW_QUERY_LOG_BACKUP_COUNT", 5))
+
 if not all([DB_URL, DB_NAME, DB_USER, DB_PASSWORD, API_KEY, JWT_SECRET_KEY]):
     print("WARNING: One or more environment variables are not set. Using default values.")
 if not TRUSTED_EMAILS_LIST:
     print("WARNING: TRUSTED_EMAILS environment variable is not set or empty. No users will be automatically marked as trusted.")
 
 # --- Database Connection Pool ---
-# Create the connection pool once when the app starts
-try:
-    print("Initializing database connection pool...")
-    db_pool = SimpleConnectionPool(
-        minconn=1,  # Minimum number of connections to keep open
-        maxconn=10, # Maximum number of connections
-        host=DB_URL,
-        database=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        port=5439, # Default Redshift port
-        connect_timeout=10
-    )
-    print("Database connection pool initialized successfully.")
-except (Exception, psycopg2.Error) as error:
-    print(f"FATAL ERROR: Failed to initialize database connection pool: {error}")
-    db_pool = None # Set to None to indicate failure
+# psycopg2's SimpleConnectionPool is neither thread-safe nor fork-safe, and building it at import
+# time means gunicorn workers forked after --preload would share the parent's sockets.
+# WorkerConnectionPool is created lazily in each process on first use and guarded by a lock.
+class PoolTimeout(Exception):
+    pass
+
+class WorkerConnectionPool:
+    """Thread-safe connection pool owned by a single process (gunicorn worker)."""
+
+    def __init__(self, minconn, maxconn, timeout_seconds, ping_interval_seconds, **connect_kwargs):
+        self.pid = os.getpid()
+        self.maxconn = maxconn
+        self.timeout_seconds = timeout_seconds
+        self.ping_interval_seconds = ping_interval_seconds
+        self.connect_kwargs = connect_kwargs
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn) # one slot per connection that may be checked out
+        self._idle = []                                    # [(conn, returned_at)], most recently used last
+        self._in_use = set()
+        self._counters = {"checkouts": 0, "waits": 0, "timeouts": 0, "wait_ms_total": 0.0,
+                          "connections_opened": 0, "dead_connections_discarded": 0}
+        try:
+            for _ in range(minconn):
+                self._idle.append((self._connect(), time.monotonic()))
+        except (Exception, psycopg2.Error):
+            for conn, _ in self._idle: conn.close()
+            raise
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self._lock:
+            self._counters["connections_opened"] += 1
+        return conn
+
+    def _is_alive(self, conn, idle_seconds):
+        """Cheap check first; connections idle past the ping interval also get a round trip."""
+        if conn.closed:
+            return False
+        if idle_seconds < self.ping_interval_seconds:
+            return True
+        try:
+            cur = conn.cursor(); cur.execute("SELECT 1;"); cur.fetchone()
+            conn.rollback()
+            return True
+        except (Exception, psycopg2.Error):
+            return False
 
-def get_db_connection():
-    """Gets a connection from the pool."""
-    if db_pool:
+    def _discard(self, conn):
+        with self._lock:
+            self._counters["dead_connections_discarded"] += 1
         try:
-            # print("Getting connection from pool...")
-            return db_pool.getconn()
-        except (Exception, psycopg2.Error) as error:
-            print(f"Error getting connection from pool: {error}")
-            return None
-    else:
-        print("Error: Database pool is not initialized.")
+            conn.close()
+        except (Exception, psycopg2.Error):
+            pass
+
+    def getconn(self):
+        """Checks out a connection, waiting up to timeout_seconds when every slot is in use."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counters["waits"] += 1
+            wait_start = time.perf_counter()
+            acquired = self._slots.acquire(timeout=self.timeout_seconds)
+            wait_seconds = time.perf_counter() - wait_start
+            DB_POOL_WAIT_SECONDS.observe(wait_seconds)
+            with self._lock:
+                self._counters["wait_ms_total"] += wait_seconds * 1000
+                if not acquired:
+                    self._counters["timeouts"] += 1
+            if not acquired:
+                raise PoolTimeout(f"No database connection available within {self.timeout_seconds}s")
+        try:
+            while True:
+                with self._lock:
+                    conn, returned_at = self._idle.pop() if self._idle else (None, None)
+                if conn is None:
+                    conn = self._connect()
+                    break
+                if self._is_alive(conn, time.monotonic() - returned_at):
+                    break
+                self._discard(conn)
+            with self._lock:
+                self._in_use.add(conn)
+                self._counters["checkouts"] += 1
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        """Returns a connection; open transactions are rolled back and broken connections dropped."""
+        with self._lock:
+            if conn not in self._in_use:
+                return # Already returned (or not ours)
+            self._in_use.discard(conn)
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except (Exception, psycopg2.Error):
+                self._discard(conn)
+                return
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, pid=self.pid, max_connections=self.maxconn,
+                         in_use=len(self._in_use), idle=len(self._idle))
+        stats["wait_ms_total"] = round(stats["wait_ms_total"], 2)
+        return stats
+
+DB_PORT = int(os.environ.get("DB_PORT", 5439)) # Default Redshift port
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 10))
+DB_POOL_PING_INTERVAL_SECONDS = float(os.environ.get("DB_POOL_PING_INTERVAL_SECONDS", 30))
+
+db_pool = None
+db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Returns this process's pool, creating it on first use (and again after a fork)."""
+    global db_pool
+    if db_pool is not None and db_pool.pid == os.getpid():
+        return db_pool
+    with db_pool_lock:
+        if db_pool is None or db_pool.pid != os.getpid():
+            # Connections inherited from a parent process are left alone, not closed:
+            # closing them here would terminate the parent's sessions.
+            print(f"Initializing database connection pool for worker {os.getpid()}...")
+            db_pool = WorkerConnectionPool(
+                DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT_SECONDS, DB_POOL_PING_INTERVAL_SECONDS,
+                host=DB_URL,
+                database=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                port=DB_PORT,
+                connect_timeout=10,
+                connection_factory=InstrumentedConnection # Times queries and commits for /metrics
+            )
+            print("Database connection pool initialized successfully.")
+    return db_pool
+
+def get_db_connection():
+    """Gets a connection from this worker's pool."""
+    try:
+        return get_db_pool().getconn()
+    except (Exception, psycopg2.Error) as error:
+        print(f"Error getting connection from pool: {error}")
         return None
 
+def db_pool_stats():
+    """Checkout/wait/timeout counters for this worker's pool (None if it hasn't been created)."""
+    pool = db_pool
+    return pool.stats() if pool is not None and pool.pid == os.getpid() else None
+
 def release_db_connection(conn):
     """Returns a connection to the pool."""
-    if db_pool and conn:
-        # print("Returning connection to pool...")
+    if conn and db_pool and db_pool.pid == os.getpid():
         db_pool.putconn(conn)
         
+def column_exists(cur, schema_name, table_name, column_name):
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND column_name = %s;
+    """, (schema_name, table_name, column_name))
+    return cur.fetchone() is not None
+
+def add_column_if_missing(cur, schema_name, table_name, column_name, column_ddl):
+    """Adds a column to an existing table (Redshift has no ADD COLUMN IF NOT EXISTS)."""
+    if not column_exists(cur, schema_name, table_name, column_name):
+        print(f"Adding column {schema_name}.{table_name}.{column_name}")
+        cur.execute(f"ALTER TABLE {schema_name}.{table_name} ADD COLUMN {column_name} {column_ddl};")
+
+def table_exists(cur, schema_name, table_name):
+    cur.execute("SELECT 1 FROM information_schema.tables WHERE table_schema = %s AND table_name = %s;", (schema_name, table_name))
+    return cur.fetchone() is not None
+
 def create_tables():
     """Creates the necessary database tables if they do not exist."""
     conn = None
@@ -76,13 +297,19 @@ def create_tables():
         cur.execute("""
             CREATE SCHEMA IF NOT EXISTS dim;
             CREATE SCHEMA IF NOT EXISTS fact;
+            CREATE SCHEMA IF NOT EXISTS ops;
         """)
+        rollups_missing = not table_exists(cur, "fact", "agg_daily_player_game_stat")
+        ranks_missing = not table_exists(cur, "dim", "dim_ranks")
+        legacy_stats = table_exists(cur, "fact", "fact_game_stats")
+        labels_unencoded = column_exists(cur, "fact", "fact_matches", "game_mode")
         
         cur.execute("""
             CREATE TABLE IF NOT EXISTS dim.dim_users (
                 user_id INT IDENTITY(1, 1) PRIMARY KEY,
                 user_email VARCHAR(255) NOT NULL UNIQUE,
-                is_trusted BOOLEAN NOT NULL DEFAULT FALSE
+                is_trusted BOOLEAN NOT NULL DEFAULT FALSE,
+                token_version INTEGER NOT NULL DEFAULT 0
             );
             
             CREATE TABLE IF NOT EXISTS dim.dim_games (
@@ -103,22 +330,105 @@ def create_tables():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 UNIQUE(player_name, user_id) 
             );
+
+            -- Per-game rank ladder; rank_ordinal is 1 for the lowest rank
+            CREATE TABLE IF NOT EXISTS dim.dim_ranks (
+                rank_id INT IDENTITY(1, 1) PRIMARY KEY,
+                game_id INTEGER REFERENCES dim.dim_games(game_id) NOT NULL,
+                rank_label VARCHAR(50) NOT NULL,
+                rank_ordinal INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(game_id, rank_label)
+            );
             
-            CREATE TABLE IF NOT EXISTS fact.fact_game_stats (
-                stat_id INT IDENTITY(1, 1) PRIMARY KEY,
+            -- Per-game dictionaries for the labels stored on the match tables
+            CREATE TABLE IF NOT EXISTS dim.dim_game_modes (
+                game_mode_id INT IDENTITY(1, 1) PRIMARY KEY,
+                game_id INTEGER REFERENCES dim.dim_games(game_id) NOT NULL,
+                game_mode VARCHAR(255) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(game_id, game_mode)
+            );
+
+            CREATE TABLE IF NOT EXISTS dim.dim_stat_types (
+                stat_type_id INT IDENTITY(1, 1) PRIMARY KEY,
+                game_id INTEGER REFERENCES dim.dim_games(game_id) NOT NULL,
+                stat_type VARCHAR(50) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(game_id, stat_type)
+            );
+
+            -- One row per submitted match; match_key ties a header to its stat rows on insert
+            CREATE TABLE IF NOT EXISTS fact.fact_matches (
+                match_id INT IDENTITY(1, 1) PRIMARY KEY,
+                match_key CHAR(32) NOT NULL,
                 game_id INTEGER REFERENCES dim.dim_games(game_id),
                 player_id INTEGER REFERENCES dim.dim_players(player_id),
-                stat_type VARCHAR(50) NOT NULL,
-                stat_value INTEGER,
-                game_mode VARCHAR(255),
+                game_mode_id INTEGER REFERENCES dim.dim_game_modes(game_mode_id),
                 game_level INTEGER,
                 win INTEGER,
                 ranked INTEGER,
                 pre_match_rank_value VARCHAR(50),
                 post_match_rank_value VARCHAR(50),
+                pre_match_rank_id INTEGER REFERENCES dim.dim_ranks(rank_id),
+                post_match_rank_id INTEGER REFERENCES dim.dim_ranks(rank_id),
                 played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            DISTKEY(match_id) COMPOUND SORTKEY(player_id, played_at);
+
+            CREATE TABLE IF NOT EXISTS fact.fact_match_stats (
+                stat_id INT IDENTITY(1, 1) PRIMARY KEY,
+                match_id INTEGER REFERENCES fact.fact_matches(match_id) NOT NULL,
+                stat_type_id INTEGER REFERENCES dim.dim_stat_types(stat_type_id) NOT NULL,
+                stat_value INTEGER
+            )
+            DISTKEY(match_id) SORTKEY(match_id);
+
+            -- Daily rollup of the match tables, maintained by refresh_daily_rollups()
+            CREATE TABLE IF NOT EXISTS fact.agg_daily_player_game_stat (
+                stat_date DATE NOT NULL,
+                player_id INTEGER NOT NULL,
+                game_id INTEGER NOT NULL,
+                stat_type VARCHAR(50) NOT NULL,
+                game_mode VARCHAR(255),
+                stat_count BIGINT NOT NULL,
+                value_count BIGINT NOT NULL,
+                stat_sum BIGINT,
+                stat_min INTEGER,
+                stat_max INTEGER,
+                win_count BIGINT NOT NULL,
+                loss_count BIGINT NOT NULL,
+                ranked_count BIGINT NOT NULL,
+                refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
+
+            -- Responses of write requests sent with an Idempotency-Key; status_code is NULL while
+            -- the first attempt is still running
+            CREATE TABLE IF NOT EXISTS ops.idempotency_keys (
+                user_id INTEGER NOT NULL,
+                idempotency_key VARCHAR(255) NOT NULL,
+                request_hash CHAR(64) NOT NULL,
+                claim_token CHAR(32),
+                status_code INTEGER,
+                response_body VARCHAR(65535),
+                claimed_at TIMESTAMP NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            )
+            DISTKEY(user_id) COMPOUND SORTKEY(user_id, idempotency_key);
         """)
+
+        # Columns added after the initial release
+        add_column_if_missing(cur, "dim", "dim_users", "token_version", "INTEGER NOT NULL DEFAULT 0")
+
+        if labels_unencoded:
+            print("Encoded match labels: {matches} matches, {stats} stat rows.".format(**encode_match_labels(cur)))
+        if legacy_stats:
+            print("Migrated fact.fact_game_stats: {matches} matches, {stats} stat rows.".format(**migrate_legacy_game_stats(cur)))
+        if rollups_missing:
+            print(f"Backfilled {rebuild_daily_rollups(cur)} daily rollup rows.")
+        if ranks_missing or legacy_stats:
+            print(f"Backfilled rank ids on {backfill_rank_ids(cur)} matches.")
+
         conn.commit()
         print("Schema and tables created or already exist.")
     except (Exception, psycopg2.DatabaseError) as error:
@@ -128,6 +438,1156 @@ def create_tables():
     finally:
         release_db_connection(conn)
 
+# --- Dimension Cache ---
+# Process-local caches for hot dimension lookups. Entries expire after DIM_CACHE_TTL_SECONDS
+# so changes made through other gunicorn workers are picked up eventually; changes made in
+# this process are invalidated immediately by the endpoints that make them.
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping with per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_entries, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached value (refreshing its LRU position) or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_value(self, value):
+        """Removes every key mapped to `value` (e.g. all names cached for a renamed game_id)."""
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[0] == value]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries), "max_entries": self.max_entries,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
+
+user_cache = LRUCache(DIM_CACHE_MAX_ENTRIES, DIM_CACHE_TTL_SECONDS)    # user_email -> (user_id, is_trusted, token_version)
+auth_cache = LRUCache(DIM_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)   # Same, for JWT revocation checks only
+game_cache = LRUCache(DIM_CACHE_MAX_ENTRIES, DIM_CACHE_TTL_SECONDS)    # (game_name, game_installment) -> game_id
+player_cache = LRUCache(DIM_CACHE_MAX_ENTRIES, DIM_CACHE_TTL_SECONDS)  # (player_name, user_id) -> player_id
+rank_cache = LRUCache(DIM_CACHE_MAX_ENTRIES, DIM_CACHE_TTL_SECONDS)    # (game_id, rank_label) -> rank_id
+game_mode_cache = LRUCache(DIM_CACHE_MAX_ENTRIES, DIM_CACHE_TTL_SECONDS)  # (game_id, game_mode) -> game_mode_id
+stat_type_cache = LRUCache(DIM_CACHE_MAX_ENTRIES, DIM_CACHE_TTL_SECONDS)  # (game_id, stat_type) -> stat_type_id
+
+def get_user_record(cur, user_email):
+    """Returns (user_id, is_trusted, token_version) for an email, or None if the user does not exist."""
+    user_record = user_cache.get(user_email)
+    if user_record is None:
+        cur.execute("SELECT user_id, is_trusted, token_version FROM dim.dim_users WHERE user_email = %s;", (user_email,))
+        user_record = cur.fetchone()
+        if user_record:
+            user_record = tuple(user_record)
+            user_cache.set(user_email, user_record)
+    return user_record
+
+# --- Dimension Helpers ---
+
+def game_cache_key(game_name, game_installment):
+    """Cache key for a game; an empty installment is the same game as a NULL one."""
+    return (game_name, game_installment or None)
+
+def get_or_create_game_id(cur, game_name, game_installment, game_genre=None, game_subgenre=None):
+    """
+    Returns the game_id for (game_name, game_installment), creating the game if needed, and
+    bumps last_played_at. An empty installment is treated as NULL (standalone game).
+
+    A cache hit costs one UPDATE (whose row count also proves the game still exists). A miss is
+    a single round trip: LOCK + INSERT ... WHERE NOT EXISTS + SELECT sent as one batch. The lock
+    serializes concurrent creators until the caller commits, so two requests can never create
+    the same game twice. Does not commit and does not populate the cache, because the row may
+    still be rolled back; callers cache the id after a successful commit.
+    """
+    game_installment = game_installment or None
+    game_key = game_cache_key(game_name, game_installment)
+    cached_game_id = game_cache.get(game_key)
+    if cached_game_id is not None:
+        cur.execute("UPDATE dim.dim_games SET last_played_at = GETDATE() WHERE game_id = %s;", (cached_game_id,))
+        if cur.rowcount:
+            return cached_game_id
+        game_cache.discard(game_key) # Deleted by another worker
+
+    game_match = "game_name = %(game_name)s AND (game_installment = %(game_installment)s OR (game_installment IS NULL AND %(game_installment)s IS NULL))"
+    cur.execute(f"""
+        LOCK dim.dim_games;
+        INSERT INTO dim.dim_games (game_name, game_installment, game_genre, game_subgenre, created_at, last_played_at)
+        SELECT %(game_name)s, %(game_installment)s, %(game_genre)s, %(game_subgenre)s, GETDATE(), GETDATE()
+        WHERE NOT EXISTS (SELECT 1 FROM dim.dim_games WHERE {game_match});
+        UPDATE dim.dim_games SET last_played_at = GETDATE() WHERE {game_match};
+        SELECT MIN(game_id) FROM dim.dim_games WHERE {game_match};
+    """, {"game_name": game_name, "game_installment": game_installment, "game_genre": game_genre, "game_subgenre": game_subgenre})
+    game_id_result = cur.fetchone()
+    if not game_id_result or game_id_result[0] is None: raise Exception("Failed to get or create game_id.")
+    return game_id_result[0]
+
+def get_or_create_player_id(cur, player_name, user_id):
+    """
+    Returns the player_id for (player_name, user_id), creating the player if needed.
+    A cache hit costs one SELECT proving the player still exists (another worker may have
+    deleted it); a miss is the same single-round-trip, lock-protected pattern as
+    get_or_create_game_id. Does not commit and does not populate the cache; callers cache
+    the id after a successful commit.
+    """
+    cached_player_id = player_cache.get((player_name, user_id))
+    if cached_player_id is not None:
+        cur.execute("SELECT 1 FROM dim.dim_players WHERE player_id = %s;", (cached_player_id,))
+        if cur.fetchone():
+            return cached_player_id
+        player_cache.discard((player_name, user_id)) # Deleted by another worker
+
+    cur.execute("""
+        LOCK dim.dim_players;
+        INSERT INTO dim.dim_players (player_name, user_id, created_at)
+        SELECT %(player_name)s, %(user_id)s, GETDATE()
+        WHERE NOT EXISTS (SELECT 1 FROM dim.dim_players WHERE player_name = %(player_name)s AND user_id = %(user_id)s);
+        SELECT MIN(player_id) FROM dim.dim_players WHERE player_name = %(player_name)s AND user_id = %(user_id)s;
+    """, {"player_name": player_name, "user_id": user_id})
+    player_id_result = cur.fetchone()
+    if not player_id_result or player_id_result[0] is None: raise Exception("Failed to get or create player_id.")
+    return player_id_result[0]
+
+# Per-game label dictionaries (dim.dim_game_modes, dim.dim_stat_types)
+GameLabelDimension = namedtuple('GameLabelDimension', ['table', 'id_column', 'label_column', 'cache'])
+GAME_MODE_DIM = GameLabelDimension("dim.dim_game_modes", "game_mode_id", "game_mode", game_mode_cache)
+STAT_TYPE_DIM = GameLabelDimension("dim.dim_stat_types", "stat_type_id", "stat_type", stat_type_cache)
+
+def get_or_create_label_ids(cur, dimension, game_id, labels):
+    """
+    Returns ({label: id}, created) for a game in a GameLabelDimension, creating missing labels;
+    `created` is True when a row was inserted. All-cached label sets cost nothing; otherwise
+    LOCK + INSERT ... WHERE NOT EXISTS, as in get_or_create_player_id, then a SELECT (two round
+    trips, so the INSERT's rowcount is seen). Does not commit and does not populate the cache;
+    callers use cache_dimension_ids after a successful commit.
+    """
+    label_ids = {}
+    for label in labels:
+        cached_id = dimension.cache.get((game_id, label))
+        if cached_id is not None:
+            label_ids[label] = cached_id
+    missing = sorted(set(labels) - label_ids.keys())
+    if not missing:
+        return label_ids, False
+
+    candidates = " UNION ALL ".join(
+        cur.mogrify("SELECT CAST(%s AS VARCHAR(255)) AS label", (label,)).decode() for label in missing
+    ).replace("%", "%%") # Embedded in a query that is formatted again below
+    table, id_column, label_column = dimension.table, dimension.id_column, dimension.label_column
+    cur.execute(f"""
+        LOCK {table};
+        INSERT INTO {table} (game_id, {label_column}, created_at)
+        SELECT %(game_id)s, v.label, GETDATE() FROM ({candidates}) v
+        WHERE NOT EXISTS (SELECT 1 FROM {table} d WHERE d.game_id = %(game_id)s AND d.{label_column} = v.label);
+    """, {"game_id": game_id})
+    created = cur.rowcount > 0
+    cur.execute(f"""
+        SELECT {label_column}, MIN({id_column}) FROM {table}
+        WHERE game_id = %(game_id)s AND {label_column} IN %(labels)s GROUP BY {label_column};
+    """, {"game_id": game_id, "labels": tuple(missing)})
+    label_ids.update(dict(cur.fetchall()))
+    if set(missing) - label_ids.keys(): raise Exception(f"Failed to get or create {label_column} ids.")
+    return label_ids, created
+
+# Known rank tiers, lowest first. New rank labels are slotted into a game's ordering by the
+# longest tier word they contain ("Gold 2" -> gold, "Grand Champion" -> grand champion);
+# labels without a known tier are appended after the highest rank. Divisions within a tier
+# keep their order of first appearance; PUT /api/game_ranks/<game_id>/order fixes the rest.
+RANK_TIERS = (
+    "unranked", "rookie", "iron", "wood", "bronze", "silver", "gold", "platinum", "emerald",
+    "diamond", "ascendant", "master", "grandmaster", "champion", "grand champion", "challenger",
+    "immortal", "radiant", "predator", "legend", "top 500"
+)
+
+def rank_tier(rank_label):
+    """Index into RANK_TIERS of the longest tier word found in the label, or None."""
+    lowered = rank_label.lower()
+    matches = [tier for tier in RANK_TIERS if tier in lowered]
+    return RANK_TIERS.index(max(matches, key=len)) if matches else None
+
+def rank_labels(stat_records):
+    """Distinct non-empty pre/post match rank labels in a list of stat records."""
+    return {
+        stat_record.get(field) for stat_record in stat_records
+        for field in ('pre_match_rank_value', 'post_match_rank_value') if stat_record.get(field)
+    }
+
+def order_rank_labels(existing_labels, new_labels):
+    """Returns existing_labels (already in ordinal order) with new_labels slotted in by tier."""
+    ordered = list(existing_labels)
+    for label in sorted(new_labels):
+        tier = rank_tier(label)
+        position = len(ordered)
+        if tier is not None:
+            for index, other in enumerate(ordered):
+                other_tier = rank_tier(other)
+                if other_tier is not None and other_tier > tier:
+                    position = index
+                    break
+        ordered.insert(position, label)
+    return ordered
+
+def renumber_ranks(cur, game_id, ordered_labels, ranks):
+    """
+    Rewrites rank_ordinal as 1..N following ordered_labels, touching only ranks whose ordinal
+    changes. `ranks` maps rank_label -> (rank_id, current ordinal). One UPDATE at most.
+    """
+    changes = [
+        (ranks[label][0], ordinal) for ordinal, label in enumerate(ordered_labels, start=1)
+        if label in ranks and ranks[label][1] != ordinal
+    ]
+    if changes:
+        cases = " ".join(cur.mogrify("WHEN %s THEN %s", change).decode() for change in changes)
+        cur.execute(f"""
+            UPDATE dim.dim_ranks SET rank_ordinal = CASE rank_id {cases} END
+            WHERE game_id = %s AND rank_id IN %s;
+        """, (game_id, tuple(rank_id for rank_id, _ in changes)))
+
+def get_or_create_rank_ids(cur, game_id, labels):
+    """
+    Returns ({rank_label: rank_id}, created) for a game, creating missing ranks in dim.dim_ranks;
+    `created` is True when a rank was inserted. All-cached label sets cost nothing. Otherwise the game's ranks are read under LOCK
+    dim.dim_ranks, new labels are slotted in with order_rank_labels and the game's ordinals
+    are renumbered densely, so rank_ordinal deltas count steps on the ladder. Does not commit
+    and does not populate the cache; callers use cache_rank_ids after a successful commit.
+    """
+    rank_ids = {}
+    for label in labels:
+        cached_rank_id = rank_cache.get((game_id, label))
+        if cached_rank_id is not None:
+            rank_ids[label] = cached_rank_id
+    missing = set(labels) - rank_ids.keys()
+    if not missing:
+        return rank_ids, False
+
+    cur.execute("""
+        LOCK dim.dim_ranks;
+        SELECT rank_label, MIN(rank_id), MIN(rank_ordinal) FROM dim.dim_ranks
+        WHERE game_id = %s GROUP BY rank_label ORDER BY 3, 2;
+    """, (game_id,))
+    ranks = {label: (rank_id, ordinal) for label, rank_id, ordinal in cur.fetchall()}
+    new_labels = missing - ranks.keys()
+    if new_labels:
+        ordered = order_rank_labels(ranks.keys(), new_labels)
+        execute_values(cur, """
+            INSERT INTO dim.dim_ranks (game_id, rank_label, rank_ordinal, created_at) VALUES %s;
+        """, [(game_id, label, ordered.index(label) + 1) for label in new_labels],
+            template="(%s, %s, %s, GETDATE())")
+        renumber_ranks(cur, game_id, ordered, ranks)
+        cur.execute("""
+            SELECT rank_label, MIN(rank_id) FROM dim.dim_ranks
+            WHERE game_id = %s AND rank_label IN %s GROUP BY rank_label;
+        """, (game_id, tuple(new_labels)))
+        ranks.update({label: (rank_id, None) for label, rank_id in cur.fetchall()})
+    for label in missing:
+        rank_ids[label] = ranks[label][0]
+    return rank_ids, bool(new_labels)
+
+def cache_rank_ids(game_id, rank_ids):
+    for label, rank_id in rank_ids.items():
+        rank_cache.set((game_id, label), rank_id)
+
+def resolve_dimension_ids(cur, game_id, stat_records, known=None):
+    """
+    Resolves the game modes, stat types and rank labels in `stat_records` to dimension ids for
+    one game, creating missing entries. Returns {"game_mode": {...}, "stat_type": {...},
+    "rank": {...}, "created": bool}, each map going label -> id; "created" is set when a
+    lookup inserted a row, so cache_dimension_ids knows to invalidate the game. `known` (an earlier result for the same game) is
+    extended in place and its labels are skipped, so bulk imports resolve each label once.
+    Label dictionaries are locked before dim.dim_ranks, the same order copy_loader uses.
+    Does not commit; pass the result to cache_dimension_ids after a successful commit.
+    """
+    dim_ids = known if known is not None else {"game_mode": {}, "stat_type": {}, "rank": {}, "created": False}
+    for name, dimension in (("game_mode", GAME_MODE_DIM), ("stat_type", STAT_TYPE_DIM)):
+        new_labels = {stat_record.get(name) for stat_record in stat_records if stat_record.get(name)} - dim_ids[name].keys()
+        if new_labels:
+            label_ids, created = get_or_create_label_ids(cur, dimension, game_id, new_labels)
+            dim_ids[name].update(label_ids)
+            dim_ids["created"] = dim_ids["created"] or created
+    new_ranks = rank_labels(stat_records) - dim_ids["rank"].keys()
+    if new_ranks:
+        rank_ids, created = get_or_create_rank_ids(cur, game_id, new_ranks)
+        dim_ids["rank"].update(rank_ids)
+        dim_ids["created"] = dim_ids["created"] or created
+    return dim_ids
+
+def cache_dimension_ids(game_id, dim_ids):
+    """Call after committing the writes that used `dim_ids` (from resolve_dimension_ids)."""
+    for name, dimension in (("game_mode", GAME_MODE_DIM), ("stat_type", STAT_TYPE_DIM)):
+        for label, label_id in dim_ids[name].items():
+            dimension.cache.set((game_id, label), label_id)
+    cache_rank_ids(game_id, dim_ids["rank"])
+    if dim_ids["created"]:
+        dim_ids["created"] = False # `known` dicts are reused across bulk chunks
+        invalidate_game_responses(game_id)
+
+def backfill_rank_ids(cur, game_ids=None):
+    """
+    Points matches that have rank labels but no rank ids at dim.dim_ranks, creating the
+    ranks as needed. Used for matches written before the rank dimension existed and by
+    copy_loader (restricted to the games it loaded). Does not commit. Returns rows updated.
+    """
+    game_filter = "AND game_id IN %(game_ids)s" if game_ids else ""
+    params = {"game_ids": tuple(game_ids) if game_ids else None}
+    cur.execute(f"""
+        SELECT game_id, pre_match_rank_value FROM fact.fact_matches
+        WHERE pre_match_rank_id IS NULL AND pre_match_rank_value IS NOT NULL AND pre_match_rank_value != '' {game_filter}
+        UNION
+        SELECT game_id, post_match_rank_value FROM fact.fact_matches
+        WHERE post_match_rank_id IS NULL AND post_match_rank_value IS NOT NULL AND post_match_rank_value != '' {game_filter};
+    """, params)
+    labels_by_game = {}
+    for game_id, label in cur.fetchall():
+        labels_by_game.setdefault(game_id, set()).add(label)
+    for game_id, labels in labels_by_game.items():
+        if game_id is not None:
+            get_or_create_rank_ids(cur, game_id, labels)
+
+    updated = 0
+    for column in ("pre_match_rank", "post_match_rank"):
+        cur.execute(f"""
+            UPDATE fact.fact_matches SET {column}_id = r.rank_id
+            FROM (SELECT game_id, rank_label, MIN(rank_id) AS rank_id FROM dim.dim_ranks GROUP BY game_id, rank_label) r
+            WHERE r.game_id = fact_matches.game_id AND r.rank_label = fact_matches.{column}_value
+            AND fact_matches.{column}_id IS NULL {"AND fact_matches.game_id IN %(game_ids)s" if game_ids else ""};
+        """, params)
+        updated += cur.rowcount
+    return updated
+
+# --- Fact Insert Helpers ---
+
+def is_valid_stat_record(stat_record):
+    """A stat record needs a stat_type and a non-null stat_value to be stored."""
+    return bool(stat_record.get('stat_type')) and stat_record.get('stat_value') is not None
+
+# Match header attributes, stored once per match in fact.fact_matches
+MATCH_HEADER_FIELDS = ('game_mode', 'game_level', 'win', 'ranked', 'pre_match_rank_value', 'post_match_rank_value')
+
+def insert_stat_rows(cur, game_id, player_id, stat_records, played_at=None, dim_ids=None):
+    """
+    Inserts stat records for one game/player: a header row in fact.fact_matches per match plus
+    one narrow fact.fact_match_stats row per stat. Records sharing the same header attributes
+    (normally a whole submission) form one match. Each match is a single round trip: the header
+    INSERT and its stat rows (in chunks of STATS_INSERT_CHUNK_SIZE) go as one batch, with the
+    stat rows finding their match_id through a client-generated match_key, since Redshift has no
+    RETURNING. played_at defaults to GETDATE() (historical imports pass their own). dim_ids
+    (from resolve_dimension_ids) supplies the game mode, stat type and rank ids; it is resolved
+    here when omitted, which leaves nothing for the caller to cache. Does not commit.
+    Returns the number of stat rows written.
+    """
+    if dim_ids is None:
+        dim_ids = resolve_dimension_ids(cur, game_id, stat_records)
+    rank_ids = dim_ids["rank"]
+    matches = {}
+    for stat_record in stat_records:
+        matches.setdefault(tuple(stat_record.get(field) for field in MATCH_HEADER_FIELDS), []).append(stat_record)
+    for header, records in matches.items():
+        header = dict(zip(MATCH_HEADER_FIELDS, header))
+        match_key = uuid.uuid4().hex
+        statements = [cur.mogrify(f"""
+            INSERT INTO fact.fact_matches
+            (match_key, game_id, player_id, game_mode_id, game_level, win, ranked, pre_match_rank_value, post_match_rank_value,
+             pre_match_rank_id, post_match_rank_id, played_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, {"GETDATE()" if played_at is None else "%s"});
+        """, (
+            match_key, game_id, player_id, dim_ids["game_mode"].get(header['game_mode']), header['game_level'], header['win'], header['ranked'],
+            header['pre_match_rank_value'], header['post_match_rank_value'],
+            rank_ids.get(header['pre_match_rank_value']), rank_ids.get(header['post_match_rank_value'])
+        ) + (() if played_at is None else (played_at,))).decode()]
+        for start in range(0, len(records), STATS_INSERT_CHUNK_SIZE):
+            stat_rows = " UNION ALL ".join(
+                cur.mogrify("SELECT CAST(%s AS INTEGER) AS stat_type_id, CAST(%s AS INTEGER) AS stat_value",
+                            (dim_ids["stat_type"].get(stat_record.get('stat_type')), stat_record.get('stat_value'))).decode()
+                for stat_record in records[start:start + STATS_INSERT_CHUNK_SIZE]
+            )
+            statements.append(cur.mogrify(f"""
+                INSERT INTO fact.fact_match_stats (match_id, stat_type_id, stat_value)
+                SELECT m.match_id, v.stat_type_id, v.stat_value
+                FROM fact.fact_matches m CROSS JOIN ({stat_rows}) v
+                WHERE m.match_key = %s AND m.player_id = %s AND m.game_id = %s;
+            """, (match_key, player_id, game_id)).decode())
+        cur.execute("".join(statements))
+    ROWS_INSERTED.inc(len(matches), table="fact_matches")
+    ROWS_INSERTED.inc(len(stat_records), table="fact_match_stats")
+    return len(stat_records)
+
+# Null-safe grouping key over the legacy per-stat columns that make up a match header
+LEGACY_MATCH_KEY = "MD5(" + " || '|' || ".join(
+    f"COALESCE('v' || CAST(gs.{column} AS VARCHAR), 'n')"
+    for column in ('game_id', 'player_id') + MATCH_HEADER_FIELDS + ('played_at',)
+) + ")"
+
+def migrate_legacy_game_stats(cur):
+    """
+    Moves rows from the old one-row-per-stat fact.fact_game_stats into fact.fact_matches /
+    fact.fact_match_stats, then renames it to fact.fact_game_stats_legacy (drop it once the
+    migration is verified). A match is every legacy row with the same player, game, played_at
+    and header attributes, i.e. one add_stats submission. Game modes and stat types are added to
+    their dictionaries first. stat_ids are reassigned; rows without a game_id can't be keyed
+    into dim.dim_stat_types and are left behind in the legacy table.
+    Does not commit. Returns {"matches": n, "stats": n}.
+    """
+    cur.execute("LOCK fact.fact_game_stats, dim.dim_game_modes, dim.dim_stat_types, fact.fact_matches, fact.fact_match_stats;")
+    for dimension in (GAME_MODE_DIM, STAT_TYPE_DIM):
+        cur.execute(f"""
+            INSERT INTO {dimension.table} (game_id, {dimension.label_column}, created_at)
+            SELECT DISTINCT gs.game_id, gs.{dimension.label_column}, GETDATE()
+            FROM fact.fact_game_stats gs
+            WHERE gs.game_id IS NOT NULL AND gs.{dimension.label_column} IS NOT NULL AND gs.{dimension.label_column} != ''
+            AND NOT EXISTS (
+                SELECT 1 FROM {dimension.table} d
+                WHERE d.game_id = gs.game_id AND d.{dimension.label_column} = gs.{dimension.label_column}
+            );
+        """)
+    cur.execute(f"""
+        INSERT INTO fact.fact_matches
+        (match_key, game_id, player_id, game_mode_id, game_level, win, ranked, pre_match_rank_value, post_match_rank_value, played_at)
+        SELECT {LEGACY_MATCH_KEY}, gs.game_id, gs.player_id, gm.game_mode_id, gs.game_level, gs.win, gs.ranked,
+               gs.pre_match_rank_value, gs.post_match_rank_value, gs.played_at
+        FROM fact.fact_game_stats gs
+        LEFT JOIN (
+            SELECT game_id, game_mode, MIN(game_mode_id) AS game_mode_id FROM dim.dim_game_modes GROUP BY game_id, game_mode
+        ) gm ON gm.game_id = gs.game_id AND gm.game_mode = gs.game_mode
+        WHERE gs.game_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10;
+    """)
+    matches = cur.rowcount
+    cur.execute(f"""
+        INSERT INTO fact.fact_match_stats (match_id, stat_type_id, stat_value)
+        SELECT m.match_id, st.stat_type_id, gs.stat_value
+        FROM fact.fact_game_stats gs
+        JOIN fact.fact_matches m ON m.match_key = {LEGACY_MATCH_KEY}
+        JOIN (
+            SELECT game_id, stat_type, MIN(stat_type_id) AS stat_type_id FROM dim.dim_stat_types GROUP BY game_id, stat_type
+        ) st ON st.game_id = gs.game_id AND st.stat_type = gs.stat_type
+        ORDER BY gs.stat_id;
+    """)
+    stats = cur.rowcount
+    cur.execute("ALTER TABLE fact.fact_game_stats RENAME TO fact_game_stats_legacy;")
+    return {"matches": matches, "stats": stats}
+
+def encode_match_labels(cur):
+    """
+    Replaces the text game_mode / stat_type columns of match tables created before the label
+    dictionaries existed with game_mode_id / stat_type_id. The added stat_type_id column is
+    nullable (Redshift can't add a NOT NULL column without a default); stats of matches
+    without a game_id stay NULL. Does not commit. Returns {"matches": n, "stats": n} updated.
+    """
+    cur.execute("LOCK dim.dim_game_modes, dim.dim_stat_types, fact.fact_matches, fact.fact_match_stats;")
+    cur.execute("""
+        INSERT INTO dim.dim_game_modes (game_id, game_mode, created_at)
+        SELECT DISTINCT m.game_id, m.game_mode, GETDATE() FROM fact.fact_matches m
+        WHERE m.game_id IS NOT NULL AND m.game_mode IS NOT NULL AND m.game_mode != ''
+        AND NOT EXISTS (SELECT 1 FROM dim.dim_game_modes d WHERE d.game_id = m.game_id AND d.game_mode = m.game_mode);
+
+        INSERT INTO dim.dim_stat_types (game_id, stat_type, created_at)
+        SELECT DISTINCT m.game_id, s.stat_type, GETDATE()
+        FROM fact.fact_match_stats s JOIN fact.fact_matches m ON m.match_id = s.match_id
+        WHERE m.game_id IS NOT NULL AND s.stat_type IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM dim.dim_stat_types d WHERE d.game_id = m.game_id AND d.stat_type = s.stat_type);
+
+        ALTER TABLE fact.fact_matches ADD COLUMN game_mode_id INTEGER REFERENCES dim.dim_game_modes(game_mode_id);
+        ALTER TABLE fact.fact_match_stats ADD COLUMN stat_type_id INTEGER REFERENCES dim.dim_stat_types(stat_type_id);
+    """)
+    cur.execute("""
+        UPDATE fact.fact_matches SET game_mode_id = gm.game_mode_id
+        FROM (SELECT game_id, game_mode, MIN(game_mode_id) AS game_mode_id FROM dim.dim_game_modes GROUP BY game_id, game_mode) gm
+        WHERE gm.game_id = fact_matches.game_id AND gm.game_mode = fact_matches.game_mode;
+    """)
+    matches = cur.rowcount
+    cur.execute("""
+        UPDATE fact.fact_match_stats SET stat_type_id = st.stat_type_id
+        FROM fact.fact_matches m,
+             (SELECT game_id, stat_type, MIN(stat_type_id) AS stat_type_id FROM dim.dim_stat_types GROUP BY game_id, stat_type) st
+        WHERE m.match_id = fact_match_stats.match_id AND st.game_id = m.game_id AND st.stat_type = fact_match_stats.stat_type;
+    """)
+    stats = cur.rowcount
+    cur.execute("""
+        ALTER TABLE fact.fact_matches DROP COLUMN game_mode;
+        ALTER TABLE fact.fact_match_stats DROP COLUMN stat_type;
+    """)
+    return {"matches": matches, "stats": stats}
+
+# --- Rollup Helpers ---
+# fact.agg_daily_player_game_stat holds one row per (day, player, game, stat_type, game_mode).
+# Min/max can't be decremented, so writers recompute the affected (player, game) day spans
+# from the match tables inside their own transaction instead of applying deltas. There is no
+# table lock, which would block every other writer and every reader of the rollup until the
+# commit; concurrent refreshes can instead abort with a write conflict, and the transaction
+# runners (group commit, write queue, bulk import, cascading deletes) rerun them.
+
+ROLLUP_REFRESH_CHUNK_SIZE = 100
+ROLLUP_COLUMNS = """stat_date, player_id, game_id, stat_type, game_mode, stat_count, value_count,
+                    stat_sum, stat_min, stat_max, win_count, loss_count, ranked_count, refreshed_at"""
+ROLLUP_SELECT = """
+    SELECT CAST(m.played_at AS DATE), m.player_id, m.game_id, st.stat_type, gm.game_mode,
+           COUNT(*), COUNT(s.stat_value), SUM(s.stat_value), MIN(s.stat_value), MAX(s.stat_value),
+           SUM(CASE WHEN m.win = 1 THEN 1 ELSE 0 END), SUM(CASE WHEN m.win = 0 THEN 1 ELSE 0 END),
+           SUM(CASE WHEN m.ranked = 1 THEN 1 ELSE 0 END), GETDATE()
+    FROM fact.fact_matches m
+    JOIN fact.fact_match_stats s ON s.match_id = m.match_id
+    JOIN dim.dim_stat_types st ON st.stat_type_id = s.stat_type_id
+    LEFT JOIN dim.dim_game_modes gm ON gm.game_mode_id = m.game_mode_id
+    WHERE m.played_at IS NOT NULL AND m.player_id IS NOT NULL AND m.game_id IS NOT NULL AND ({where})
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+def rollup_days(played_at=None):
+    """Rollup days touched by rows written with `played_at`. Rows stamped by GETDATE() get
+    today's UTC date plus both neighbours, so clock skew around midnight can't miss a day."""
+    if played_at is not None:
+        return [played_at.date()]
+    today = datetime.now(timezone.utc).date()
+    return [today - timedelta(days=1), today, today + timedelta(days=1)]
+
+def refresh_daily_rollups(cur, touched):
+    """
+    Recomputes rollup rows for every (player_id, game_id) in `touched` (an iterable of
+    (player_id, game_id, day)) across the span of days touched. Caller commits, and reruns
+    the transaction when it fails with is_write_conflict.
+    """
+    spans = {}
+    for player_id, game_id, day in touched:
+        first_day, last_day = spans.get((player_id, game_id), (day, day))
+        spans[(player_id, game_id)] = (min(first_day, day), max(last_day, day))
+    if not spans:
+        return
+    items = list(spans.items())
+    for start in range(0, len(items), ROLLUP_REFRESH_CHUNK_SIZE):
+        chunk = items[start:start + ROLLUP_REFRESH_CHUNK_SIZE]
+        rollup_where = " OR ".join(["(player_id = %s AND game_id = %s AND stat_date BETWEEN %s AND %s)"] * len(chunk))
+        fact_where = " OR ".join(["(m.player_id = %s AND m.game_id = %s AND m.played_at >= %s AND m.played_at < %s)"] * len(chunk))
+        rollup_params = [value for (player_id, game_id), (first_day, last_day) in chunk for value in (player_id, game_id, first_day, last_day)]
+        fact_params = [value for (player_id, game_id), (first_day, last_day) in chunk
+                       for value in (player_id, game_id, first_day, last_day + timedelta(days=1))]
+        cur.execute(f"""
+            DELETE FROM fact.agg_daily_player_game_stat WHERE {rollup_where};
+            INSERT INTO fact.agg_daily_player_game_stat ({ROLLUP_COLUMNS})
+            {ROLLUP_SELECT.format(where=fact_where)};
+        """, rollup_params + fact_params)
+
+def is_write_conflict(error):
+    """
+    True when the database aborted the transaction because it conflicted with a concurrent one:
+    Redshift's serializable isolation violation (error 1023), or SQLSTATE 40001 elsewhere.
+    Nothing was written, so the whole transaction can be rerun.
+    """
+    return getattr(error, 'pgcode', None) == '40001' or "Serializable isolation violation" in str(error)
+
+def write_conflict_backoff(attempt):
+    """Sleeps a jittered, doubling delay before rerunning a transaction that hit a write conflict."""
+    time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+def rebuild_daily_rollups(cur):
+    """Recomputes the whole rollup table from the match tables. Caller commits. Returns rows written."""
+    cur.execute("LOCK fact.agg_daily_player_game_stat;")
+    cur.execute("DELETE FROM fact.agg_daily_player_game_stat;")
+    cur.execute(f"INSERT INTO fact.agg_daily_player_game_stat ({ROLLUP_COLUMNS}) {ROLLUP_SELECT.format(where='1 = 1')};")
+    return cur.rowcount
+
+# --- Cascading Deletes ---
+# Large deletes run in bounded chunks that each commit, so locks are held for one chunk at a time
+# and the rollups stay consistent with whatever has been deleted so far. Redshift only marks
+# deleted rows; the space and sort order come back with VACUUM DELETE ONLY, which can't run
+# inside a transaction and is expensive, so it is batched up and run later on its own.
+
+maintenance_lock = threading.Lock()
+maintenance_pending = {} # table -> rows deleted since its last scheduled VACUUM
+maintenance_timer = None
+maintenance_counters = {"runs": 0, "tables_vacuumed": 0, "errors": 0, "last_run_at": None, "last_error": None}
+
+def delete_matches_in_batches(conn, where_sql, params, batch_size=None):
+    """
+    Deletes the fact.fact_matches rows matching `where_sql` (with `params`), their stats, and
+    refreshes the rollups they fed, CASCADE_DELETE_BATCH_SIZE matches per transaction. A
+    generator: yields a progress dict after each commit. Deleted row counts are passed to
+    schedule_table_maintenance() as it goes, so an interrupted delete still gets its VACUUM.
+    A batch aborted by a write conflict is rerun, up to WRITE_CONFLICT_RETRIES times.
+    """
+    batch_size = batch_size or CASCADE_DELETE_BATCH_SIZE
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM fact.fact_matches WHERE {where_sql};", params)
+    total = cur.fetchone()[0]
+    conn.commit()
+    progress = {"matches_total": total, "matches_deleted": 0, "stats_deleted": 0, "batches": 0}
+    conflicts = 0
+    while True:
+        try:
+            matches_deleted, stats_deleted = delete_match_batch(cur, where_sql, params, batch_size)
+            conn.commit()
+        except (Exception, psycopg2.DatabaseError) as error:
+            if not is_write_conflict(error) or conflicts >= WRITE_CONFLICT_RETRIES:
+                raise
+            conn.rollback()
+            conflicts += 1
+            print(f"Cascading delete batch hit a write conflict, rerunning it: {error}")
+            write_conflict_backoff(conflicts)
+            continue
+        conflicts = 0
+        if matches_deleted == 0:
+            break
+        progress["matches_deleted"] += matches_deleted
+        progress["stats_deleted"] += stats_deleted
+        progress["batches"] += 1
+        schedule_table_maintenance({"fact.fact_match_stats": stats_deleted, "fact.fact_matches": matches_deleted})
+        yield dict(progress)
+        if matches_deleted < batch_size:
+            break
+
+def delete_match_batch(cur, where_sql, params, batch_size):
+    """One delete_matches_in_batches batch: up to batch_size matches, their stats and rollups. Does not commit."""
+    cur.execute(f"""
+        DROP TABLE IF EXISTS match_delete_batch;
+        CREATE TEMP TABLE match_delete_batch AS
+        SELECT match_id, player_id, game_id, played_at FROM fact.fact_matches
+        WHERE {where_sql} ORDER BY match_id LIMIT %s;
+        SELECT DISTINCT player_id, game_id, CAST(played_at AS DATE) FROM match_delete_batch
+        WHERE played_at IS NOT NULL AND player_id IS NOT NULL AND game_id IS NOT NULL;
+    """, tuple(params) + (batch_size,))
+    touched = cur.fetchall()
+    cur.execute("DELETE FROM fact.fact_match_stats WHERE match_id IN (SELECT match_id FROM match_delete_batch);")
+    stats_deleted = cur.rowcount
+    cur.execute("DELETE FROM fact.fact_matches WHERE match_id IN (SELECT match_id FROM match_delete_batch);")
+    matches_deleted = cur.rowcount
+    if matches_deleted:
+        refresh_daily_rollups(cur, touched)
+    return matches_deleted, stats_deleted
+
+def schedule_table_maintenance(deleted_rows):
+    """
+    Counts deleted rows per table ({table: rows}). Once a table reaches TABLE_MAINTENANCE_MIN_ROWS,
+    a VACUUM DELETE ONLY + ANALYZE run is scheduled TABLE_MAINTENANCE_DELAY_SECONDS out; deletes
+    before it fires are covered by the same run. Process-local and best effort.
+    """
+    global maintenance_timer
+    if not TABLE_MAINTENANCE_ENABLED:
+        return
+    with maintenance_lock:
+        for table, rows in deleted_rows.items():
+            maintenance_pending[table] = maintenance_pending.get(table, 0) + max(rows, 0)
+        if not any(rows >= TABLE_MAINTENANCE_MIN_ROWS for rows in maintenance_pending.values()):
+            return
+        if maintenance_timer is not None and maintenance_timer.pid == os.getpid() and maintenance_timer.is_alive():
+            return
+        maintenance_timer = threading.Timer(TABLE_MAINTENANCE_DELAY_SECONDS, run_table_maintenance)
+        maintenance_timer.daemon = True
+        maintenance_timer.pid = os.getpid() # A timer inherited through fork never fires in the child
+        maintenance_timer.start()
+        print(f"Table maintenance scheduled in {TABLE_MAINTENANCE_DELAY_SECONDS}s for {maintenance_pending}")
+
+def run_table_maintenance():
+    """Runs VACUUM DELETE ONLY and ANALYZE on every table that reached TABLE_MAINTENANCE_MIN_ROWS."""
+    with maintenance_lock:
+        tables = sorted(table for table, rows in maintenance_pending.items() if rows >= TABLE_MAINTENANCE_MIN_ROWS)
+        for table in tables:
+            maintenance_pending.pop(table)
+    if not tables:
+        return
+    conn = get_db_connection()
+    vacuumed = []
+    try:
+        if conn is None:
+            raise Exception("Database connection failed")
+        conn.autocommit = True # VACUUM can't run inside a transaction block
+        cur = conn.cursor()
+        for table in tables:
+            start = time.perf_counter()
+            cur.execute(f"VACUUM DELETE ONLY {table};")
+            cur.execute(f"ANALYZE {table};")
+            vacuumed.append(table)
+            print(f"Table maintenance: VACUUM DELETE ONLY + ANALYZE {table} took {time.perf_counter() - start:.1f}s")
+    except (Exception, psycopg2.DatabaseError) as error:
+        # Redshift runs one VACUUM at a time per cluster; tables not done are retried next time.
+        print(f"Table maintenance failed after {vacuumed}: {error}")
+        with maintenance_lock:
+            maintenance_counters["errors"] += 1
+            maintenance_counters["last_error"] = str(error)
+            for table in tables:
+                if table not in vacuumed:
+                    maintenance_pending[table] = maintenance_pending.get(table, 0) + TABLE_MAINTENANCE_MIN_ROWS
+    finally:
+        if conn is not None and not conn.closed:
+            conn.autocommit = False
+        release_db_connection(conn)
+    with maintenance_lock:
+        maintenance_counters["runs"] += 1
+        maintenance_counters["tables_vacuumed"] += len(vacuumed)
+        maintenance_counters["last_run_at"] = utc_now().isoformat()
+
+def table_maintenance_stats():
+    with maintenance_lock:
+        return dict(maintenance_counters, pending_deleted_rows=dict(maintenance_pending), enabled=TABLE_MAINTENANCE_ENABLED)
+
+# --- Response Cache ---
+# Read endpoints are cached per user. Every key embeds the user's generation counter, a
+# shared generation for dim_games and, for /<game_id> routes, that game's generation (bumped
+# when any user adds or reorders its ranks, modes or stat types); write endpoints bump them
+# after commit, which orphans the
+# stale entries (they age out via TTL / size-bounded eviction instead of being deleted).
+# Generations live in the same backend as the entries, so with 'filesystem' or 'redis' all
+# gunicorn workers see each other's invalidations.
+
+def create_response_cache():
+    if RESPONSE_CACHE_TYPE == "filesystem":
+        return FileSystemCache(RESPONSE_CACHE_DIR, threshold=RESPONSE_CACHE_MAX_ENTRIES, default_timeout=RESPONSE_CACHE_TTL_SECONDS)
+    if RESPONSE_CACHE_TYPE == "redis":
+        import redis # Optional dependency, only needed for the shared backend
+        return RedisCache(redis.from_url(RESPONSE_CACHE_REDIS_URL), key_prefix="vgst:", default_timeout=RESPONSE_CACHE_TTL_SECONDS)
+    if RESPONSE_CACHE_TYPE == "null":
+        return NullCache()
+    return SimpleCache(threshold=RESPONSE_CACHE_MAX_ENTRIES, default_timeout=RESPONSE_CACHE_TTL_SECONDS)
+
+try:
+    response_cache = create_response_cache()
+except Exception as error:
+    print(f"WARNING: Failed to initialize '{RESPONSE_CACHE_TYPE}' response cache ({error}). Falling back to in-process cache.")
+    response_cache = SimpleCache(threshold=RESPONSE_CACHE_MAX_ENTRIES, default_timeout=RESPONSE_CACHE_TTL_SECONDS)
+response_cache_counters = {"hits": 0, "misses": 0, "not_modified": 0, "errors": 0}
+
+def get_generation(name):
+    """Current generation for `name`. A missing counter (expired, or a fresh backend) starts
+    from a time-based value so it can never collide with one that keyed older entries.
+    Counters expire with the TTL too, which bounds how long a per-worker ('simple') counter
+    can miss a write handled by another worker, for cached bodies and ETags alike."""
+    generation = response_cache.get(f"gen:{name}")
+    if generation is None:
+        response_cache.add(f"gen:{name}", time.time_ns())
+        generation = response_cache.get(f"gen:{name}") or 0
+    return generation
+
+def bump_generation(name):
+    try:
+        if response_cache.inc(f"gen:{name}") is None:
+            response_cache.set(f"gen:{name}", time.time_ns())
+    except Exception as error:
+        # A failed bump would leave stale entries being served; drop everything instead.
+        print(f"Error bumping response cache generation {name}: {error}")
+        response_cache.clear()
+
+def invalidate_user_responses(user_id):
+    """Call after committing a write that changes what `user_id` reads."""
+    bump_generation(f"user:{user_id}")
+
+def invalidate_shared_responses():
+    """Call after committing a change to a shared dimension (dim_games)."""
+    bump_generation("dims")
+
+def invalidate_game_responses(game_id):
+    """Call after committing new or reordered ranks, modes or stat types for a shared game."""
+    bump_generation(f"game:{game_id}")
+
+def response_cache_stats():
+    lookups = response_cache_counters["hits"] + response_cache_counters["misses"]
+    return dict(response_cache_counters, backend=RESPONSE_CACHE_TYPE,
+                hit_rate=round(response_cache_counters["hits"] / lookups, 4) if lookups else None)
+
+# --- Idempotency Keys ---
+# Writers that accept an Idempotency-Key header store their response in ops.idempotency_keys in
+# the same transaction as the data, so a retry after a lost response replays it instead of
+# writing the match twice. A short claim transaction runs first, so a concurrent retry gets a
+# 409 instead of waiting on the table lock for the length of the write.
+
+IdempotencyClaim = namedtuple('IdempotencyClaim', ['user_id', 'key', 'token', 'status_code', 'body'])
+
+class IdempotencyError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+last_idempotency_purge = 0.0
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def get_idempotency_key():
+    """The request's Idempotency-Key header, or None. Raises ValueError if it is malformed."""
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise ValueError(f"'Idempotency-Key' must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+    return key
+
+def request_fingerprint(*parts):
+    """sha256 over what identifies a request, so a key reused for a different request is caught."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def claim_idempotency_key(cur, user_id, key, fingerprint):
+    """
+    Claims `key` for this attempt, or returns the stored outcome of an earlier one. Returns an
+    IdempotencyClaim: status_code/body are set when the response should be replayed, otherwise
+    `token` identifies this attempt. Raises IdempotencyError: 422 if the key was used for a
+    different request, 409 while another attempt's claim is live. Takes LOCK
+    ops.idempotency_keys; the caller commits right away to release it.
+    """
+    global last_idempotency_purge
+    now = utc_now()
+    cur.execute("""
+        LOCK ops.idempotency_keys;
+        SELECT request_hash, status_code, response_body, claimed_at FROM ops.idempotency_keys
+        WHERE user_id = %s AND idempotency_key = %s AND expires_at > %s;
+    """, (user_id, key, now))
+    row = cur.fetchone()
+    token = uuid.uuid4().hex
+    if row is None:
+        cur.execute("""
+            INSERT INTO ops.idempotency_keys (user_id, idempotency_key, request_hash, claim_token, claimed_at, expires_at)
+            VALUES (%s, %s, %s, %s, %s, %s);
+        """, (user_id, key, fingerprint, token, now, now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)))
+    else:
+        request_hash, status_code, body, claimed_at = row
+        if request_hash != fingerprint:
+            raise IdempotencyError("Idempotency-Key was already used for a different request", 422)
+        if status_code is not None:
+            return IdempotencyClaim(user_id, key, None, status_code, body)
+        if claimed_at > now - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS):
+            raise IdempotencyError("A request with this Idempotency-Key is still being processed", 409)
+        print(f"Taking over an abandoned Idempotency-Key claim for user {user_id}")
+        cur.execute("""
+            UPDATE ops.idempotency_keys SET claim_token = %s, claimed_at = %s
+            WHERE user_id = %s AND idempotency_key = %s AND expires_at > %s;
+        """, (token, now, user_id, key, now))
+    if time.time() - last_idempotency_purge > IDEMPOTENCY_PURGE_INTERVAL_SECONDS:
+        last_idempotency_purge = time.time()
+        cur.execute("DELETE FROM ops.idempotency_keys WHERE expires_at <= %s;", (now,))
+    return IdempotencyClaim(user_id, key, token, None, None)
+
+def complete_idempotency_claim(cur, claim, status_code, body):
+    """Stores the response on `claim` in the caller's write transaction. Raises IdempotencyError if the claim was taken over."""
+    cur.execute("""
+        UPDATE ops.idempotency_keys SET status_code = %s, response_body = %s, claim_token = NULL
+        WHERE user_id = %s AND idempotency_key = %s AND claim_token = %s;
+    """, (status_code, body, claim.user_id, claim.key, claim.token))
+    if cur.rowcount != 1:
+        raise IdempotencyError("This request's Idempotency-Key claim was taken over by a retry", 409)
+
+def renew_idempotency_claim(cur, claim):
+    """Pushes back the lease of a long-running attempt (bulk imports renew it on every commit)."""
+    cur.execute("""
+        UPDATE ops.idempotency_keys SET claimed_at = %s
+        WHERE user_id = %s AND idempotency_key = %s AND claim_token = %s;
+    """, (utc_now(), claim.user_id, claim.key, claim.token))
+    if cur.rowcount != 1:
+        raise IdempotencyError("This request's Idempotency-Key claim was taken over by a retry", 409)
+
+def release_idempotency_claim(claim):
+    """Drops an unfinished claim after a failed attempt so a retry can run right away. Best effort."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM ops.idempotency_keys
+            WHERE user_id = %s AND idempotency_key = %s AND claim_token = %s AND status_code IS NULL;
+        """, (claim.user_id, claim.key, claim.token))
+        conn.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Could not release Idempotency-Key claim for user {claim.user_id}: {error}")
+        if conn: conn.rollback()
+    finally:
+        release_db_connection(conn)
+
+def record_idempotent_response(cur, body, status_code, claim=None):
+    """
+    For endpoints wrapped in @idempotent: stores `body` as the response to replay for this
+    request's Idempotency-Key (a no-op without one). Call it right before the commit. Code that
+    runs off the request thread (a group-commit unit) passes the request's claim explicitly.
+    """
+    claim = claim if claim is not None else g.get('idempotency_claim')
+    if claim is not None:
+        complete_idempotency_claim(cur, claim, status_code, json.dumps(body))
+
+# --- Write-Behind Queue ---
+# With WRITE_QUEUE_PATH set, add_stats requests sent with 'Prefer: respond-async' are appended
+# to a local SQLite queue (write_queue.py) and answered 202 with a ticket. Each worker runs a
+# QueueFlusher that writes queued matches to Redshift in batches, one transaction per batch.
+
+write_queue_flusher = None
+write_queue_lock = threading.Lock()
+write_queue_pid = None
+
+def get_write_queue():
+    """This process's QueueFlusher (its .queue is the WriteQueue), started on first use and again
+    after a fork. None when WRITE_QUEUE_PATH is unset."""
+    global write_queue_flusher, write_queue_pid
+    if not WRITE_QUEUE_PATH:
+        return None
+    if write_queue_flusher is not None and write_queue_pid == os.getpid():
+        return write_queue_flusher
+    with write_queue_lock:
+        if write_queue_flusher is None or write_queue_pid != os.getpid():
+            # A flusher thread inherited through fork doesn't run in the child; start a new one.
+            print(f"Starting write queue flusher for worker {os.getpid()} ({WRITE_QUEUE_PATH})...")
+            flusher = QueueFlusher(
+                WriteQueue(WRITE_QUEUE_PATH, lease_seconds=max(300, IDEMPOTENCY_LEASE_SECONDS)),
+                flush_queued_matches,
+                batch_size=WRITE_QUEUE_BATCH_SIZE,
+                interval_seconds=WRITE_QUEUE_FLUSH_INTERVAL_SECONDS,
+                max_attempts=WRITE_QUEUE_MAX_ATTEMPTS,
+            )
+            flusher.start()
+            write_queue_flusher, write_queue_pid = flusher, os.getpid()
+    return write_queue_flusher
+
+def queued_write_requested():
+    """True when the client sent 'Prefer: respond-async' and the write queue is enabled."""
+    preferences = [value.strip().lower() for value in request.headers.get('Prefer', '').split(',')]
+    return bool(WRITE_QUEUE_PATH) and 'respond-async' in preferences
+
+def queue_record_key(ticket_id):
+    return f"queue:{ticket_id}"
+
+def flush_queued_matches(tickets):
+    """
+    QueueFlusher callback: writes a batch of queued add_stats payloads in one transaction and
+    commits once. Each match keeps the time it was queued as played_at. A ticket that fails is
+    reported for retry and the batch is rewritten without it; a batch aborted by a write
+    conflict is rerun as it was. Every ticket also gets an
+    ops.idempotency_keys record under "queue:<ticket_id>" in the same transaction, so a batch
+    that committed but was never marked done in the queue isn't written a second time.
+    Connection errors propagate and the flusher retries the whole batch.
+    """
+    outcomes = {}
+    pending = list(tickets)
+    conn = get_db_connection()
+    if conn is None:
+        raise Exception("Database connection failed")
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT idempotency_key, response_body FROM ops.idempotency_keys
+            WHERE idempotency_key IN %s AND status_code IS NOT NULL;
+        """, (tuple(queue_record_key(ticket['ticket_id']) for ticket in pending),))
+        written = dict(cur.fetchall())
+        conn.commit()
+        for ticket in [ticket for ticket in pending if queue_record_key(ticket['ticket_id']) in written]:
+            outcomes[ticket['ticket_id']] = ("done", json.loads(written[queue_record_key(ticket['ticket_id'])]))
+            pending.remove(ticket)
+
+        conflicts = 0
+        while pending:
+            game_ids, player_ids, dim_ids, touched, results = {}, {}, {}, set(), {}
+            ticket = None
+            try:
+                for ticket in pending:
+                    data = ticket['payload']['request']
+                    played_at = datetime.fromisoformat(ticket['payload']['queued_at'])
+                    valid_stats = [stat_record for stat_record in data['stats'] if is_valid_stat_record(stat_record)]
+                    game_key = game_cache_key(data['game_name'], data.get('game_installment'))
+                    if game_key not in game_ids:
+                        game_ids[game_key] = get_or_create_game_id(cur, data['game_name'], data.get('game_installment'),
+                                                                   data.get('game_genre'), data.get('game_subgenre'))
+                    game_id = game_ids[game_key]
+                    player_key = (data['player_name'], ticket['user_id'])
+                    if player_key not in player_ids:
+                        player_ids[player_key] = get_or_create_player_id(cur, *player_key)
+                    dim_ids[game_id] = resolve_dimension_ids(cur, game_id, valid_stats, dim_ids.get(game_id))
+                    inserted = insert_stat_rows(cur, game_id, player_ids[player_key], valid_stats, played_at, dim_ids[game_id])
+                    touched.update((player_ids[player_key], game_id, day) for day in rollup_days(played_at))
+                    results[ticket['ticket_id']] = {"message": f"Stats successfully added ({inserted} records)!"}
+                ticket = None
+                refresh_daily_rollups(cur, touched)
+                now = utc_now()
+                execute_values(cur, """
+                    INSERT INTO ops.idempotency_keys
+                    (user_id, idempotency_key, request_hash, status_code, response_body, claimed_at, expires_at) VALUES %s;
+                """, [(ticket['user_id'], queue_record_key(ticket['ticket_id']), request_fingerprint(ticket['ticket_id']), 201,
+                       json.dumps(results[ticket['ticket_id']]), now, now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS))
+                      for ticket in pending])
+                conn.commit()
+            except (Exception, psycopg2.DatabaseError) as error:
+                if not conn.closed: conn.rollback()
+                # Checked first: psycopg2 raises SQLSTATE 40001 as an OperationalError
+                if is_write_conflict(error) and conflicts < WRITE_CONFLICT_RETRIES:
+                    conflicts += 1
+                    print(f"Queued write batch hit a write conflict, rerunning it: {error}")
+                    write_conflict_backoff(conflicts)
+                    continue
+                if ticket is None or isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+                    raise
+                print(f"Queued write {ticket['ticket_id']} failed, retrying the batch without it: {error}")
+                outcomes[ticket['ticket_id']] = ("retry", str(error))
+                pending.remove(ticket)
+                continue
+
+            for game_key, game_id in game_ids.items():
+                game_cache.set(game_key, game_id)
+            for player_key, player_id in player_ids.items():
+                player_cache.set(player_key, player_id)
+            for game_id, ids in dim_ids.items():
+                cache_dimension_ids(game_id, ids)
+            for user_id in {ticket['user_id'] for ticket in pending}:
+                invalidate_user_responses(user_id)
+            outcomes.update({ticket['ticket_id']: ("done", results[ticket['ticket_id']]) for ticket in pending})
+            pending = []
+    finally:
+        release_db_connection(conn)
+    return outcomes
+
+# --- Group Commit ---
+# Redshift serializes commits across the cluster, so concurrent single-row writes spend most of
+# their time queued behind each other's commits. A write endpoint hands its work to
+# run_write_unit() as a function of a cursor; the first unit to arrive waits up to
+# GROUP_COMMIT_WINDOW_MS for others, then runs them all in one transaction and commits once.
+# Units must not commit, and must not touch `request` or `g` (they may run on another request's
+# thread). A unit that raises is dropped and the rest are rerun without it, since Redshift has
+# no savepoints; its caller gets the exception. A group aborted by a write conflict (see
+# is_write_conflict) is rerun whole, up to WRITE_CONFLICT_RETRIES times.
+
+class GroupCommitter:
+    """Coalesces write units from concurrent requests into shared transactions (leader/follower)."""
+
+    def __init__(self, window_seconds, max_units):
+        self.window_seconds = window_seconds
+        self.max_units = max(1, max_units)
+        self._cond = threading.Condition()
+        self._pending = []
+        self._leading = False
+        self._counters = {"units": 0, "groups": 0, "commits": 0, "reruns": 0, "conflicts": 0, "failed_units": 0, "max_group_size": 0}
+
+    def submit(self, unit):
+        """Runs unit(cur) in a shared transaction and returns its result once that transaction has committed."""
+        entry = {"unit": unit, "taken": False, "done": False, "result": None, "error": None}
+        with self._cond:
+            self._pending.append(entry)
+            if len(self._pending) >= self.max_units:
+                self._cond.notify_all()
+            # Wait for a leader to run this unit, or become the leader if there is none.
+            while not entry["done"] and (entry["taken"] or self._leading):
+                self._cond.wait()
+            lead = not entry["done"]
+            if lead:
+                self._leading = True
+        if lead:
+            self._lead(entry)
+        if entry["error"] is not None:
+            raise entry["error"]
+        return entry["result"]
+
+    def _lead(self, entry):
+        with self._cond:
+            deadline = time.monotonic() + self.window_seconds
+            while len(self._pending) < self.max_units:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._pending.remove(entry)
+            batch = [entry] + self._pending[:self.max_units - 1]
+            self._pending = self._pending[self.max_units - 1:]
+            for member in batch:
+                member["taken"] = True
+            # Units that didn't fit elect the next leader while this group runs.
+            self._leading = False
+            self._cond.notify_all()
+        try:
+            self._run(batch)
+        finally:
+            with self._cond:
+                for member in batch:
+                    member["done"] = True
+                self._cond.notify_all()
+
+    def _run(self, batch):
+        pending = list(batch)
+        commits = reruns = conflicts = 0
+        conn = get_db_connection()
+        try:
+            if conn is None:
+                raise Exception("Database connection failed")
+            cur = conn.cursor()
+            while pending:
+                current = None
+                try:
+                    for current in pending:
+                        current["result"] = current["unit"](cur)
+                    current = None
+                    conn.commit()
+                    commits += 1
+                    break
+                except (Exception, psycopg2.DatabaseError) as error:
+                    if not conn.closed: conn.rollback()
+                    # Checked first: psycopg2 raises SQLSTATE 40001 as an OperationalError
+                    if is_write_conflict(error) and conflicts < WRITE_CONFLICT_RETRIES:
+                        conflicts += 1
+                        print(f"Group commit hit a write conflict, rerunning {len(pending)} unit(s): {error}")
+                        write_conflict_backoff(conflicts)
+                        continue
+                    if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+                        raise # Connection trouble fails the whole group
+                    if current is None:
+                        raise # The commit itself failed
+                    print(f"Group commit unit failed, rerunning {len(pending) - 1} other unit(s) without it: {error}")
+                    current["error"] = error
+                    pending.remove(current)
+                    reruns += 1 if pending else 0
+        except (Exception, psycopg2.DatabaseError) as error:
+            for member in pending:
+                member["error"] = error
+        finally:
+            release_db_connection(conn)
+        with self._cond:
+            self._counters["units"] += len(batch)
+            self._counters["groups"] += 1
+            self._counters["commits"] += commits
+            self._counters["reruns"] += reruns
+            self._counters["conflicts"] += conflicts
+            self._counters["failed_units"] += sum(1 for member in batch if member["error"] is not None)
+            self._counters["max_group_size"] = max(self._counters["max_group_size"], len(batch))
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters, window_ms=self.window_seconds * 1000, max_units=self.max_units)
+        stats["avg_group_size"] = round(stats["units"] / stats["groups"], 2) if stats["groups"] else None
+        return stats
+
+group_committer = GroupCommitter(GROUP_COMMIT_WINDOW_MS / 1000, GROUP_COMMIT_MAX_UNITS)
+
+def run_write_unit(unit):
+    """Runs unit(cur) through the group committer and returns its result after the commit; re-raises its errors."""
+    return group_committer.submit(unit)
+
 # --- Custom Decorators ---
 
 def requires_api_key(f):
@@ -140,8 +1600,50 @@ def requires_api_key(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+# Resolved identity passed to JWT-protected handlers as the `auth` keyword argument
+AuthContext = namedtuple('AuthContext', ['user_email', 'user_id', 'is_trusted', 'token_version'])
+
+def issue_jwt(user_email, user_id, is_trusted, token_version):
+    """Signs a 60 minute JWT carrying the user's id, trust level and token version."""
+    payload = {
+        'email': user_email,
+        'user_id': user_id,
+        'is_trusted': is_trusted,
+        'tv': token_version,
+        'exp': datetime.now(timezone.utc) + timedelta(minutes=60) # Token expiry time
+    }
+    return jwt.encode(payload, JWT_SECRET_KEY, algorithm='HS256')
+
+def get_current_user_record(user_email):
+    """
+    (user_id, is_trusted, token_version) for the JWT check, managing its own pooled connection.
+    Cached for AUTH_CACHE_TTL_SECONDS only, so a version bumped by another worker is seen within that window.
+    """
+    user_record = auth_cache.get(user_email) if AUTH_CACHE_TTL_SECONDS > 0 else None
+    if user_record is not None:
+        return user_record
+    conn = get_db_connection()
+    if conn is None:
+        raise psycopg2.OperationalError("Database connection failed")
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT user_id, is_trusted, token_version FROM dim.dim_users WHERE user_email = %s;", (user_email,))
+            user_record = cur.fetchone()
+    finally:
+        release_db_connection(conn)
+    if user_record:
+        user_record = tuple(user_record)
+        if AUTH_CACHE_TTL_SECONDS > 0:
+            auth_cache.set(user_email, user_record)
+    return user_record
+
 def requires_jwt_auth(f):
-    """Decorator to check for a valid JWT in the Authorization header."""
+    """
+    Decorator to check for a valid JWT in the Authorization header.
+    Passes an AuthContext built from the signed claims as `auth`. The token's version claim
+    must match dim_users.token_version, which add_trusted_user bumps to revoke older tokens;
+    workers other than the one that bumped it notice within AUTH_CACHE_TTL_SECONDS.
+    """
     def decorated_function(*args, **kwargs):
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
@@ -152,23 +1654,198 @@ def requires_jwt_auth(f):
         try:
             payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'], leeway=timedelta(seconds=10))
             user_email = payload.get('email')
-            if not user_email:
-                print("Invalid JWT payload: email missing.")
+            user_id = payload.get('user_id')
+            token_version = payload.get('tv')
+            if not user_email or user_id is None or token_version is None:
+                print("Invalid JWT payload: email, user_id or tv missing.")
                 return jsonify({"error": "Invalid JWT payload"}), 401
-            # Add user_email from token payload into function arguments
-            kwargs['user_email'] = user_email
-            # print(f"JWT authenticated for user: {user_email}") # Less verbose
         except jwt.ExpiredSignatureError:
             print("JWT has expired.")
             return jsonify({"error": "JWT has expired"}), 401
         except jwt.InvalidTokenError as e:
             print(f"Invalid JWT: {e}")
             return jsonify({"error": "Invalid JWT"}), 401
-        
+
+        try:
+            user_record = get_current_user_record(user_email)
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Error validating JWT version for {user_email}: {error}")
+            return jsonify({"error": "An error occurred while validating the JWT."}), 500
+        if not user_record or user_record[0] != user_id or user_record[2] != token_version:
+            print(f"JWT for {user_email} has been revoked (token version {token_version}).")
+            return jsonify({"error": "JWT has been revoked"}), 401
+
+        kwargs['auth'] = AuthContext(user_email, user_id, bool(payload.get('is_trusted')), token_version)
         return f(*args, **kwargs)
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+def cached_response(f):
+    """
+    Caches a JWT-protected read endpoint's 200 responses per user, keyed by endpoint, URL args,
+    query string and the current generations. Apply below @requires_jwt_auth.
+    The same key, hashed, is the response's strong ETag: a matching If-None-Match gets a 304
+    without touching the database or the cached body.
+    """
+    def decorated_function(*args, **kwargs):
+        auth = kwargs['auth']
+        try:
+            game_id = request.view_args.get('game_id')
+            cache_key = "resp:{}:{}:{}:{}:{}:{}:{}".format(
+                request.endpoint, auth.user_id, get_generation(f"user:{auth.user_id}"), get_generation("dims"),
+                get_generation(f"game:{game_id}") if game_id is not None else "",
+                json.dumps(request.view_args, sort_keys=True, default=str), request.query_string.decode())
+        except Exception as error:
+            print(f"Response cache lookup failed: {error}")
+            response_cache_counters["errors"] += 1
+            return f(*args, **kwargs)
+        etag = hashlib.sha256(cache_key.encode()).hexdigest()[:32]
+        if request.if_none_match.contains(etag):
+            response_cache_counters["not_modified"] += 1
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        try:
+            cached = response_cache.get(cache_key)
+        except Exception as error:
+            print(f"Response cache lookup failed: {error}")
+            response_cache_counters["errors"] += 1
+            cached = None
+        if cached is not None:
+            response_cache_counters["hits"] += 1
+            response = Response(cached, status=200, mimetype='application/json')
+            response.set_etag(etag)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        response_cache_counters["misses"] += 1
+        result = f(*args, **kwargs)
+        response, status = result if isinstance(result, tuple) else (result, 200)
+        if status == 200:
+            try:
+                response_cache.set(cache_key, response.get_data())
+            except Exception as error:
+                print(f"Response cache store failed: {error}")
+                response_cache_counters["errors"] += 1
+            response.set_etag(etag)
+        response.headers['X-Cache'] = 'MISS'
+        return response, status
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+def idempotent(f):
+    """
+    Makes a JWT-protected write endpoint safe to retry when the client sends an Idempotency-Key
+    header. Apply below @requires_jwt_auth. The endpoint calls record_idempotent_response()
+    before its commit; retries with the same key and body then get that response back (with
+    Idempotent-Replayed: true) for IDEMPOTENCY_TTL_SECONDS. A non-2xx outcome releases the key.
+    """
+    def decorated_function(*args, **kwargs):
+        auth = kwargs['auth']
+        try:
+            key = get_idempotency_key()
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
+        if key is None or queued_write_requested():
+            return f(*args, **kwargs) # Queued writes are deduplicated by the write queue
+
+        fingerprint = request_fingerprint(request.endpoint, json.dumps(request.view_args, sort_keys=True, default=str), request.get_data())
+        conn = None
+        try:
+            conn = get_db_connection()
+            claim = claim_idempotency_key(conn.cursor(), auth.user_id, key, fingerprint)
+            conn.commit()
+        except IdempotencyError as error:
+            conn.rollback()
+            return jsonify({"error": str(error)}), error.status_code
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Idempotency-Key claim failed for {auth.user_email}: {error}")
+            if conn: conn.rollback()
+            return jsonify({"error": "An error occurred while checking the Idempotency-Key."}), 500
+        finally:
+            release_db_connection(conn)
+        if claim.status_code is not None:
+            response = Response(claim.body, status=claim.status_code, mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        g.idempotency_claim = claim
+        result = f(*args, **kwargs)
+        response, status = result if isinstance(result, tuple) else (result, 200)
+        if not 200 <= status < 300:
+            release_idempotency_claim(claim)
+        return response, status
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+# --- Slow Query Log ---
+# InstrumentedCursor hands statements over the threshold to this log (see slow_queries.py).
+# EXPLAINs run on a plain, uninstrumented connection so they never show up as slow queries themselves.
+
+def connect_for_explain():
+    return psycopg2.connect(host=DB_URL, database=DB_NAME, user=DB_USER, password=DB_PASSWORD, port=DB_PORT, connect_timeout=10)
+
+slow_query_log = None
+if SLOW_QUERY_THRESHOLD_MS >= 0:
+    slow_query_log = SlowQueryLog(
+        SLOW_QUERY_THRESHOLD_MS / 1000, SLOW_QUERY_LOG_PATH, connect_for_explain, explain_limit=SLOW_QUERY_EXPLAIN_LIMIT,
+        max_bytes=SLOW_QUERY_LOG_MAX_BYTES, backup_count=SLOW_QUERY_LOG_BACKUP_COUNT)
+InstrumentedCursor.slow_query_log = slow_query_log
+
+# --- Request Metrics ---
+# Latency per route is recorded around every request; pool, cache, queue and group-commit state
+# is read from their existing stats() at scrape time. Served at /metrics (see metrics.py).
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method, status=response.status_code)
+    return response
+
+def collect_state_metrics():
+    families = []
+    pool = db_pool_stats()
+    if pool is not None:
+        families += [
+            ("vgst_db_pool_connections", "gauge", "Pooled connections by state.",
+             [({"state": "in_use"}, pool["in_use"]), ({"state": "idle"}, pool["idle"]), ({"state": "max"}, pool["max_connections"])]),
+            ("vgst_db_pool_events_total", "counter", "Pool checkouts, waits, timeouts, connections opened and dead connections discarded.",
+             [({"event": event}, pool[event]) for event in ("checkouts", "waits", "timeouts", "connections_opened", "dead_connections_discarded")]),
+        ]
+    caches = {"users": user_cache.stats(), "auth": auth_cache.stats(), "games": game_cache.stats(), "players": player_cache.stats(), "ranks": rank_cache.stats(),
+              "game_modes": game_mode_cache.stats(), "stat_types": stat_type_cache.stats(), "responses": response_cache_stats()}
+    families += [
+        ("vgst_cache_lookups_total", "counter", "Dimension and response cache lookups by result.",
+         [({"cache": name, "result": result}, stats[key]) for name, stats in caches.items() for result, key in (("hit", "hits"), ("miss", "misses"))]),
+        ("vgst_cache_hit_ratio", "gauge", "Hits / lookups since the worker started.",
+         [({"cache": name}, stats["hit_rate"]) for name, stats in caches.items()]),
+    ]
+    commits = group_committer.stats()
+    families.append(("vgst_group_commit_events_total", "counter", "Write units, groups, commits, reruns, write-conflict reruns and failed units of the group committer.",
+                     [({"event": event}, commits[event]) for event in ("units", "groups", "commits", "reruns", "conflicts", "failed_units")]))
+    flusher = write_queue_flusher if write_queue_pid == os.getpid() else None
+    if flusher is not None:
+        queue = flusher.stats()
+        families += [
+            ("vgst_write_queue_tickets", "gauge", "Write queue tickets by status (shared by the workers on this host).",
+             [({"status": status}, queue["depth"][status]) for status in ("queued", "flushing", "done", "failed")]),
+            ("vgst_write_queue_oldest_pending_seconds", "gauge", "Age of the oldest ticket not yet flushed.",
+             [({}, queue["depth"]["oldest_pending_age_seconds"])]),
+            ("vgst_write_queue_flush_batch_size", "gauge", "Tickets in the last flushed batch.", [({}, queue["batch_size"]["last"])]),
+            ("vgst_write_queue_flush_latency_ms", "gauge", "Flush latency over recent batches.",
+             [({"quantile": quantile}, queue["flush_latency_ms"][quantile]) for quantile in ("p50", "p95", "max")]),
+        ]
+    return families
+
+REGISTRY.register_collector(collect_state_metrics)
+
 # --- API Endpoints ---
 
 @app.route('/api/login', methods=['POST'])
@@ -192,10 +1869,11 @@ def login():
 
         with conn.cursor() as cur:
             # Check if user exists
-            cur.execute("SELECT user_id, is_trusted FROM dim.dim_users WHERE user_email = %s;", (user_email,))
+            cur.execute("SELECT user_id, is_trusted, token_version FROM dim.dim_users WHERE user_email = %s;", (user_email,))
             user_record = cur.fetchone()
             user_id = None
             db_is_trusted = False # Status currently in DB
+            token_version = 0
 
             if not user_record:
                 # User doesn't exist, create them. Trust status based on env list.
@@ -203,32 +1881,31 @@ def login():
                 cur.execute("INSERT INTO dim.dim_users (user_email, is_trusted) VALUES (%s, %s);", (user_email, should_be_trusted))
                 conn.commit()
                 # Fetch the new user's ID and trust status
-                cur.execute("SELECT user_id, is_trusted FROM dim.dim_users WHERE user_email = %s;", (user_email,))
+                cur.execute("SELECT user_id, is_trusted, token_version FROM dim.dim_users WHERE user_email = %s;", (user_email,))
                 new_user_record = cur.fetchone()
                 if new_user_record:
-                    user_id, db_is_trusted = new_user_record
+                    user_id, db_is_trusted, token_version = new_user_record
                     print(f"New user created with ID: {user_id}, DB Trusted: {db_is_trusted}")
                 else:
                     raise Exception("Failed to retrieve user ID after insert.")
             else:
                 # User exists, check if trust status needs updating
-                user_id, db_is_trusted = user_record
+                user_id, db_is_trusted, token_version = user_record
                 print(f"Existing user {user_email} found. DB Trusted: {db_is_trusted}. Should be trusted: {should_be_trusted}")
                 # Sync DB trust status with environment list if different
                 if should_be_trusted != db_is_trusted:
                     print(f"Updating user {user_email} trust status in DB to: {should_be_trusted}")
-                    cur.execute("UPDATE dim.dim_users SET is_trusted = %s WHERE user_id = %s;", (should_be_trusted, user_id))
+                    # Bump the token version so tokens minted with the old trust level stop working
+                    cur.execute("UPDATE dim.dim_users SET is_trusted = %s, token_version = token_version + 1 WHERE user_id = %s;", (should_be_trusted, user_id))
                     conn.commit()
                     db_is_trusted = should_be_trusted # Update local variable to reflect change
+                    token_version += 1
+
+            user_cache.set(user_email, (user_id, db_is_trusted, token_version))
+            auth_cache.discard(user_email)
 
             # Generate JWT with the *final confirmed* trust status (db_is_trusted)
-            payload = {
-                'email': user_email,
-                'user_id': user_id,
-                'is_trusted': db_is_trusted,
-                'exp': datetime.now(timezone.utc) + timedelta(minutes=60) # Token expiry time
-            }
-            access_token = jwt.encode(payload, JWT_SECRET_KEY, algorithm='HS256')
+            access_token = issue_jwt(user_email, user_id, db_is_trusted, token_version)
             print(f"JWT generated for {user_email}, Final DB Trusted: {db_is_trusted}")
             # Return token and the trust status confirmed/updated in DB
             return jsonify(token=access_token, is_trusted=db_is_trusted), 200
@@ -303,12 +1980,15 @@ def add_trusted_user():
 
         if user_record:
             print(f"Updating trust status for existing user: {user_email} to {is_trusted_flag}")
-            cur.execute("UPDATE dim.dim_users SET is_trusted = %s WHERE user_email = %s;", (is_trusted_flag, user_email))
+            # Bumping token_version revokes every JWT issued under the previous trust status
+            cur.execute("UPDATE dim.dim_users SET is_trusted = %s, token_version = token_version + 1 WHERE user_email = %s;", (is_trusted_flag, user_email))
         else:
             print(f"Adding new user with trust status: {user_email}, Trusted: {is_trusted_flag}")
             cur.execute("INSERT INTO dim.dim_users (user_email, is_trusted) VALUES (%s, %s);", (user_email, is_trusted_flag))
 
         conn.commit()
+        user_cache.discard(user_email)
+        auth_cache.discard(user_email) # Other workers pick up the new version within AUTH_CACHE_TTL_SECONDS
         print(f"Admin action: User {user_email} added/updated. Trusted status set to: {is_trusted_flag}.")
         return jsonify({"message": f"User {user_email} added/updated successfully. Trusted status set to: {is_trusted_flag}."}), 201
     except (Exception, psycopg2.DatabaseError) as error:
@@ -323,10 +2003,11 @@ def add_trusted_user():
 
 @app.route('/api/add_stats', methods=['POST'])
 @requires_jwt_auth
-def add_stats(user_email):
+@idempotent
+def add_stats(auth):
     """
     API endpoint to securely add game stats to the database.
-    Requires a valid JWT for authentication.
+    Requires a valid JWT for authentication. Send an Idempotency-Key header to make retries safe.
     """
     data = request.json
     game_name = data.get('game_name')
@@ -335,7 +2016,6 @@ def add_stats(user_email):
     game_subgenre = data.get('game_subgenre')
     player_name = data.get('player_name')
     stats = data.get('stats')
-    conn = None
 
     # This is a sample of the data that's expected
     # stats = [{
@@ -361,110 +2041,499 @@ def add_stats(user_email):
 
     if not all([game_name, player_name, stats]) or not isinstance(stats, list) or len(stats) == 0:
         return jsonify({"error": "Missing or invalid fields: game_name, player_name, and stats (must be a non-empty list)"}), 400
+    valid_stats = [stat_record for stat_record in stats if is_valid_stat_record(stat_record)]
+    if not valid_stats:
+        return jsonify({"error": "No valid stats provided to insert."}), 400
+
+    if not auth.is_trusted: return jsonify({"error": "User not authorized"}), 403
+    user_id = auth.user_id
+
+    if queued_write_requested():
+        return enqueue_match_submission(user_id, data)
+    claim = g.get('idempotency_claim')
+
+    def write(cur):
+        game_id = get_or_create_game_id(cur, game_name, game_installment, game_genre, game_subgenre)
+        player_id = get_or_create_player_id(cur, player_name, user_id)
+
+        dim_ids = resolve_dimension_ids(cur, game_id, valid_stats)
+
+        # --- Stat Insertion (set-based, single transaction) ---
+        successful_inserts = insert_stat_rows(cur, game_id, player_id, valid_stats, dim_ids=dim_ids)
+        refresh_daily_rollups(cur, [(player_id, game_id, day) for day in rollup_days()])
+        result = {"message": f"Stats successfully added ({successful_inserts} records)!"}
+        record_idempotent_response(cur, result, 201, claim)
+        return result, game_id, player_id, dim_ids
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        result, game_id, player_id, dim_ids = run_write_unit(write)
+        game_cache.set(game_cache_key(game_name, game_installment), game_id)
+        player_cache.set((player_name, user_id), player_id)
+        cache_dimension_ids(game_id, dim_ids)
+        invalidate_user_responses(user_id)
+        return jsonify(result), 201
+    except IdempotencyError as error:
+        return jsonify({"error": str(error)}), error.status_code
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error: {error}")
+        return jsonify({"error": f"An internal error occurred: {str(error)}"}), 500
 
-        # Get the user_id from the authenticated email
-        cur.execute("SELECT user_id, is_trusted FROM dim.dim_users WHERE user_email = %s;", (user_email,))
-        user_result = cur.fetchone()
-        if not user_result: return jsonify({"error": "Authenticated user not found."}), 404
-        user_id, is_trusted = user_result
-        if not is_trusted: return jsonify({"error": "User not authorized"}), 403
-
-         # --- Game Handling ---
-        # Handle NULL game_installment properly
-        if game_installment:
-            cur.execute("SELECT game_id FROM dim.dim_games WHERE game_name = %s AND game_installment = %s;", (game_name, game_installment))
-        else:
-            cur.execute("SELECT game_id FROM dim.dim_games WHERE game_name = %s AND game_installment IS NULL;", (game_name,))
-        
-        game_record = cur.fetchone()
-        game_id = None
-        if not game_record:
-            print(f"Game '{game_name}' (Series: '{game_installment}') not found, creating.")
-            cur.execute("""
-                INSERT INTO dim.dim_games (game_name, game_installment, game_genre, game_subgenre, created_at, last_played_at)
-                VALUES (%s, %s, %s, %s, GETDATE(), GETDATE());
-            """, (game_name, game_installment, game_genre, game_subgenre))
-            conn.commit()
-            if game_installment:
-                cur.execute("SELECT game_id FROM dim.dim_games WHERE game_name = %s AND game_installment = %s;", (game_name, game_installment))
-            else:
-                cur.execute("SELECT game_id FROM dim.dim_games WHERE game_name = %s AND game_installment IS NULL;", (game_name,))
-            game_id_result = cur.fetchone()
-            if not game_id_result: raise Exception("Failed to get game_id after insert.")
-            game_id = game_id_result[0]
-        else:
-            game_id = game_record[0]
-            cur.execute("UPDATE dim.dim_games SET last_played_at = GETDATE() WHERE game_id = %s;", (game_id,))
-
-        # --- Player Handling (Redshift Safe) ---
-        cur.execute("SELECT player_id FROM dim.dim_players WHERE player_name = %s AND user_id = %s;", (player_name, user_id))
-        player_record = cur.fetchone()
-        player_id = None
-        if not player_record:
-            print(f"Player '{player_name}' for user {user_id} not found, creating.")
-            cur.execute("INSERT INTO dim.dim_players (player_name, user_id, created_at) VALUES (%s, %s, GETDATE());", (player_name, user_id))
+def enqueue_match_submission(user_id, data):
+    """The 'Prefer: respond-async' path of add_stats: queues the validated payload and answers 202 with a ticket."""
+    try:
+        key = get_idempotency_key()
+        flusher = get_write_queue()
+        ticket, created = flusher.queue.enqueue(
+            user_id, {"request": data, "queued_at": utc_now().isoformat()},
+            idempotency_key=key, request_hash=request_fingerprint(request.endpoint, request.get_data()) if key else None
+        )
+    except QueueKeyReused as error:
+        return jsonify({"error": str(error)}), 422
+    except Exception as error:
+        print(f"Error queueing stats for user {user_id}: {error}")
+        return jsonify({"error": "An error occurred while queueing the stats."}), 500
+    if created:
+        flusher.wake()
+    response = jsonify({"ticket_id": ticket['ticket_id'], "status": ticket['status'],
+                        "status_url": f"/api/write_tickets/{ticket['ticket_id']}"})
+    response.headers['Preference-Applied'] = 'respond-async'
+    if not created:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response, 202
+
+@app.route('/api/write_tickets/<ticket_id>', methods=['GET'])
+@requires_jwt_auth
+def get_write_ticket(ticket_id, auth):
+    """
+    Status of a queued add_stats request: queued, flushing, done (with the add_stats result)
+    or failed (with the last error). Only the user who queued it can see it.
+    """
+    flusher = get_write_queue()
+    ticket = flusher.queue.get(ticket_id, auth.user_id) if flusher is not None else None
+    if ticket is None:
+        return jsonify({"error": "Ticket not found"}), 404
+    ticket.pop('user_id')
+    return jsonify(ticket), 200
+
+@app.route('/api/bulk_add_stats', methods=['POST'])
+@requires_jwt_auth
+def bulk_add_stats(auth):
+    """
+    Bulk import of historical matches. The body is newline-delimited JSON, one match per line,
+    in the same shape as the /api/add_stats payload plus an optional ISO-8601 'played_at'.
+    The body is read incrementally and committed every `chunk_size` lines (query param,
+    default BULK_COMMIT_CHUNK_SIZE). Games and players are resolved once per distinct key.
+    Responds with NDJSON: one result per input line (emitted after its chunk commits),
+    followed by a summary line. A line that hits a database error rolls back the pending
+    chunk, whose earlier lines are then written again without it; if the chunk's commit
+    itself fails, every line in it is reported as an error.
+    With an Idempotency-Key header, each committed line is recorded under "<key>:<line number>";
+    resending the same body with the same key replays those lines ("replayed": true) and only
+    imports the rest, so a dropped connection can be retried with the whole file.
+    """
+    try:
+        chunk_size = int(request.args.get('chunk_size', BULK_COMMIT_CHUNK_SIZE))
+    except ValueError:
+        return jsonify({"error": "'chunk_size' must be an integer"}), 400
+    if not 1 <= chunk_size <= BULK_MAX_CHUNK_SIZE:
+        return jsonify({"error": f"'chunk_size' must be between 1 and {BULK_MAX_CHUNK_SIZE}"}), 400
+
+    if not auth.is_trusted: return jsonify({"error": "User not authorized"}), 403
+    user_email, user_id = auth.user_email, auth.user_id
+
+    # Claimed up front so a concurrent retry of the same import gets a 409 instead of racing it.
+    # The claim is never completed (lines are replayed one by one) and is released at the end.
+    try:
+        key = get_idempotency_key()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    claim = None
+    if key is not None:
+        conn = None
+        try:
+            conn = get_db_connection()
+            claim = claim_idempotency_key(conn.cursor(), user_id, key, request_fingerprint(request.endpoint))
             conn.commit()
-            cur.execute("SELECT player_id FROM dim.dim_players WHERE player_name = %s AND user_id = %s;", (player_name, user_id))
-            player_id_result = cur.fetchone()
-            if not player_id_result: raise Exception("Failed to get player_id after insert.")
-            player_id = player_id_result[0]
-        else:
-            player_id = player_record[0]
+        except IdempotencyError as error:
+            conn.rollback()
+            return jsonify({"error": str(error)}), error.status_code
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Idempotency-Key claim failed for {user_email}: {error}")
+            if conn: conn.rollback()
+            return jsonify({"error": "An error occurred while checking the Idempotency-Key."}), 500
+        finally:
+            release_db_connection(conn)
 
-        # --- Stat Insertion ---
-        successful_inserts = 0
-        for stat_record in stats:
-            if not stat_record.get('stat_type') or stat_record.get('stat_value') is None: continue
-            cur.execute("""
-                INSERT INTO fact.fact_game_stats
-                (game_id, player_id, stat_type, stat_value, game_mode, game_level, win, ranked, pre_match_rank_value, post_match_rank_value, played_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, GETDATE());
-            """, (
-                game_id, player_id, stat_record.get('stat_type'), stat_record.get('stat_value'),
-                stat_record.get('game_mode'), stat_record.get('game_level'), stat_record.get('win'),
-                stat_record.get('ranked'), stat_record.get('pre_match_rank_value'), stat_record.get('post_match_rank_value')
-            ))
-            successful_inserts += 1
-        if successful_inserts > 0:
-             conn.commit()
-             return jsonify({"message": f"Stats successfully added ({successful_inserts} records)!"}), 201
+    def parse_line(line):
+        """Returns (match_record, valid_stats, played_at) or raises ValueError with a client-facing message."""
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError("Invalid JSON")
+        if not isinstance(record, dict):
+            raise ValueError("Each line must be a JSON object")
+        stats = record.get('stats')
+        if not all([record.get('game_name'), record.get('player_name'), stats]) or not isinstance(stats, list):
+            raise ValueError("Missing or invalid fields: game_name, player_name, and stats (must be a non-empty list)")
+        valid_stats = [stat_record for stat_record in stats if isinstance(stat_record, dict) and is_valid_stat_record(stat_record)]
+        if not valid_stats:
+            raise ValueError("No valid stats provided to insert.")
+        played_at = record.get('played_at')
+        if played_at is not None:
+            try:
+                played_at = datetime.fromisoformat(str(played_at))
+            except ValueError:
+                raise ValueError("'played_at' must be an ISO-8601 timestamp")
+        return record, valid_stats, played_at
+
+    def generate():
+        game_ids, player_ids, dim_ids = {}, {}, {} # dim_ids: game_id -> resolve_dimension_ids result
+        touched = set() # (player_id, game_id, day) rollup keys written in the pending chunk
+        chunk_results = []
+        pending_lines = [] # (line key, line hash, result) to record with the chunk's commit
+        written = [] # (record, valid_stats, played_at, result) for lines written in the pending chunk
+        totals = {"lines": 0, "matches_added": 0, "records_added": 0, "replayed": 0, "errors": 0}
+
+        def flush_chunk():
+            conflicts = 0
+            while True:
+                try:
+                    refresh_daily_rollups(cur, touched)
+                    if claim is not None:
+                        renew_idempotency_claim(cur, claim)
+                        expires_at = utc_now() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+                        committed = [(line_key, line_hash, json.dumps(result)) for line_key, line_hash, result in pending_lines
+                                     if result["status"] == "ok"]
+                        if committed:
+                            execute_values(cur, """
+                                INSERT INTO ops.idempotency_keys
+                                (user_id, idempotency_key, request_hash, status_code, response_body, claimed_at, expires_at) VALUES %s;
+                            """, [(user_id, line_key, line_hash, 201, body, utc_now(), expires_at) for line_key, line_hash, body in committed])
+                    conn.commit()
+                    for game_key, game_id in game_ids.items(): game_cache.set(game_key, game_id)
+                    for player_name, player_id in player_ids.items(): player_cache.set((player_name, user_id), player_id)
+                    for game_id, game_dim_ids in dim_ids.items(): cache_dimension_ids(game_id, game_dim_ids)
+                    invalidate_user_responses(user_id)
+                except (Exception, psycopg2.DatabaseError) as error:
+                    if is_write_conflict(error) and conflicts < WRITE_CONFLICT_RETRIES:
+                        conflicts += 1
+                        print(f"Bulk import commit hit a write conflict for {user_email}, rewriting the chunk: {error}")
+                        write_conflict_backoff(conflicts)
+                        rewrite_chunk()
+                        continue
+                    print(f"Bulk import commit failed for {user_email}: {error}")
+                    conn.rollback()
+                    game_ids.clear(); player_ids.clear(); dim_ids.clear()
+                    for result in chunk_results:
+                        if result["status"] == "ok" and not result.get("replayed"):
+                            result.update(status="error", error=f"Chunk rolled back: {str(error)}")
+                break
+            touched.clear(); pending_lines.clear(); written.clear()
+            for result in chunk_results:
+                if result.get("replayed"):
+                    totals["replayed"] += 1
+                elif result["status"] == "ok":
+                    totals["matches_added"] += 1
+                    totals["records_added"] += result["records"]
+                else:
+                    totals["errors"] += 1
+                yield json.dumps(result) + "\n"
+            chunk_results.clear()
+
+        def write_line(record, valid_stats, played_at):
+            """Writes one parsed line in the open transaction. Returns the stat rows inserted."""
+            game_key = game_cache_key(record['game_name'], record.get('game_installment'))
+            if game_key not in game_ids:
+                game_ids[game_key] = get_or_create_game_id(cur, *game_key, record.get('game_genre'), record.get('game_subgenre'))
+            if record['player_name'] not in player_ids:
+                player_ids[record['player_name']] = get_or_create_player_id(cur, record['player_name'], user_id)
+            game_id = game_ids[game_key]
+            dim_ids[game_id] = resolve_dimension_ids(cur, game_id, valid_stats, dim_ids.get(game_id))
+            inserted = insert_stat_rows(cur, game_id, player_ids[record['player_name']], valid_stats, played_at, dim_ids[game_id])
+            touched.update((player_ids[record['player_name']], game_id, day) for day in rollup_days(played_at))
+            return inserted
+
+        def rewrite_chunk():
+            """
+            Rolls back and writes the pending chunk's lines again, so one bad line doesn't take the
+            rest of its chunk with it. A line that fails again is marked as an error and dropped,
+            unless it hit a write conflict, which reruns the chunk as it was.
+            """
+            conflicts = 0
+            while True:
+                conn.rollback()
+                game_ids.clear(); player_ids.clear(); dim_ids.clear(); touched.clear()
+                entry = None
+                try:
+                    for entry in written:
+                        entry[3]["records"] = write_line(*entry[:3])
+                    return
+                except (Exception, psycopg2.DatabaseError) as error:
+                    if is_write_conflict(error) and conflicts < WRITE_CONFLICT_RETRIES:
+                        conflicts += 1
+                        write_conflict_backoff(conflicts)
+                        continue
+                    print(f"Bulk import error on line {entry[3]['line']} for {user_email} while rewriting its chunk: {error}")
+                    entry[3].update(status="error", error=str(error))
+                    entry[3].pop("records", None)
+                    written.remove(entry)
+
+        conn = get_db_connection()
+        if conn is None:
+            if claim is not None: release_idempotency_claim(claim)
+            yield json.dumps({"error": "Database connection failed"}) + "\n"
+            return
+        try:
+            cur = conn.cursor()
+            recorded_lines = {} # line key -> (line hash, stored result) from earlier attempts
+            if claim is not None:
+                prefix = f"{key}:"
+                cur.execute("""
+                    SELECT idempotency_key, request_hash, response_body FROM ops.idempotency_keys
+                    WHERE user_id = %s AND SUBSTRING(idempotency_key, 1, %s) = %s AND status_code IS NOT NULL AND expires_at > %s;
+                """, (user_id, len(prefix), prefix, utc_now()))
+                recorded_lines = {line_key: (line_hash, body) for line_key, line_hash, body in cur.fetchall()}
+                conn.commit()
+            for line_no, raw_line in enumerate(request.stream, start=1):
+                line = raw_line.strip()
+                if not line:
+                    continue
+                totals["lines"] += 1
+                line_key = f"{key}:{line_no}" if claim is not None else None
+                line_hash = request_fingerprint(line) if claim is not None else None
+                if line_key in recorded_lines:
+                    recorded_hash, body = recorded_lines[line_key]
+                    if recorded_hash == line_hash:
+                        chunk_results.append({**json.loads(body), "replayed": True})
+                    else:
+                        chunk_results.append({"line": line_no, "status": "error",
+                                              "error": "Line differs from the one imported earlier with this Idempotency-Key"})
+                    continue
+                try:
+                    record, valid_stats, played_at = parse_line(line)
+                except ValueError as error:
+                    chunk_results.append({"line": line_no, "status": "error", "error": str(error)})
+                else:
+                    try:
+                        inserted = write_line(record, valid_stats, played_at)
+                    except (Exception, psycopg2.DatabaseError) as error:
+                        # The transaction is aborted; write the chunk's earlier lines again, and this
+                        # one too when it only lost a write conflict.
+                        print(f"Bulk import error on line {line_no} for {user_email}: {error}")
+                        if is_write_conflict(error):
+                            chunk_results.append({"line": line_no, "status": "ok"})
+                            written.append((record, valid_stats, played_at, chunk_results[-1]))
+                            if claim is not None:
+                                pending_lines.append((line_key, line_hash, chunk_results[-1]))
+                        else:
+                            chunk_results.append({"line": line_no, "status": "error", "error": str(error)})
+                        rewrite_chunk()
+                    else:
+                        chunk_results.append({"line": line_no, "status": "ok", "records": inserted})
+                        written.append((record, valid_stats, played_at, chunk_results[-1]))
+                        if claim is not None:
+                            pending_lines.append((line_key, line_hash, chunk_results[-1]))
+                if len(chunk_results) >= chunk_size:
+                    yield from flush_chunk()
+            yield from flush_chunk()
+            print(f"Bulk import by {user_email}: {totals}")
+            yield json.dumps({"summary": totals}) + "\n"
+        finally:
+            release_db_connection(conn)
+            if claim is not None:
+                release_idempotency_claim(claim)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+STAT_EDIT_MAX_BATCH = 1000
+STAT_EDIT_FIELDS = ('stat_type', 'stat_value')
+
+def stat_edit_error(edit):
+    """Client-facing problem with one /api/update_stats edit, or None if it is well formed."""
+    unknown = set(edit) - {'stat_id'} - set(STAT_EDIT_FIELDS) - set(MATCH_HEADER_FIELDS)
+    if unknown:
+        return f"Unknown fields: {', '.join(sorted(unknown))}"
+    if len(edit) == 1:
+        return "No fields to update"
+    if 'stat_type' in edit and (not isinstance(edit['stat_type'], str) or not edit['stat_type'].strip() or len(edit['stat_type']) > 50):
+        return "'stat_type' must be a non-empty string of up to 50 characters" # dim_stat_types.stat_type is VARCHAR(50)
+    for field in ('stat_value', 'game_level', 'win', 'ranked'):
+        if field not in edit or edit[field] is None and field != 'stat_value':
+            continue
+        if not isinstance(edit[field], int) or isinstance(edit[field], bool):
+            return f"'{field}' must be an integer" + ("" if field == 'stat_value' else " or null")
+    for field in ('win', 'ranked'):
+        if edit.get(field) not in (None, 0, 1):
+            return f"'{field}' must be 0, 1 or null"
+    for field, max_length in (('game_mode', 255), ('pre_match_rank_value', 50), ('post_match_rank_value', 50)):
+        value = edit.get(field)
+        if value is not None and (not isinstance(value, str) or len(value) > max_length):
+            return f"'{field}' must be a string of up to {max_length} characters or null"
+    return None
+
+@app.route('/api/update_stats', methods=['PUT'])
+@requires_jwt_auth
+def update_stats(auth):
+    """
+    Applies a batch of partial stat edits in one transaction. Body: {"edits": [{"stat_id": 1,
+    "stat_value": 12, ...}, ...]}. stat_type and stat_value change the stat row; the match
+    fields (game_mode, game_level, win, ranked, pre/post_match_rank_value) change the match the
+    stat belongs to, and so every stat of that match. Ownership of every stat_id is checked in
+    one query, and each table gets one set-based UPDATE from a temp table. Returns one result
+    per edit, in order: "updated", "not_found" (missing or another user's), or "error".
+    """
+    if not auth.is_trusted:
+        return jsonify({"error": "User not authorized to update stats"}), 403
+    edits = (request.get_json(silent=True) or {}).get('edits')
+    if not isinstance(edits, list) or not edits or len(edits) > STAT_EDIT_MAX_BATCH:
+        return jsonify({"error": f"'edits' must be a list of 1 to {STAT_EDIT_MAX_BATCH} stat edits"}), 400
+    user_id = auth.user_id
+
+    results = []
+    seen_stat_ids = set()
+    for edit in edits:
+        stat_id = edit.get('stat_id') if isinstance(edit, dict) else None
+        if not isinstance(stat_id, int) or isinstance(stat_id, bool):
+            results.append({"stat_id": stat_id, "status": "error", "error": "Each edit needs an integer 'stat_id'"})
+        elif stat_id in seen_stat_ids:
+            results.append({"stat_id": stat_id, "status": "error", "error": "Duplicate stat_id in this request"})
         else:
-             return jsonify({"error": "No valid stats provided to insert."}), 400
+            seen_stat_ids.add(stat_id)
+            error = stat_edit_error(edit)
+            results.append({"stat_id": stat_id, "status": "error", "error": error} if error else {"stat_id": stat_id, "status": "pending"})
+    pending = [(edit, result) for edit, result in zip(edits, results) if result["status"] == "pending"]
+
+    def write(cur):
+        for _, result in pending: # Reset in case the group committer reruns this unit
+            result.pop("error", None)
+            result["status"] = "pending"
+        if not pending:
+            return {}
+        cur.execute("""
+            SELECT s.stat_id, s.match_id, m.game_id, m.player_id, m.played_at, s.stat_type_id, s.stat_value,
+                   m.game_mode_id, m.game_level, m.win, m.ranked, m.pre_match_rank_value, m.post_match_rank_value,
+                   m.pre_match_rank_id, m.post_match_rank_id
+            FROM fact.fact_match_stats s
+            JOIN fact.fact_matches m ON s.match_id = m.match_id
+            JOIN dim.dim_players p ON m.player_id = p.player_id
+            WHERE s.stat_id IN %s AND p.user_id = %s;
+        """, (tuple(edit['stat_id'] for edit, _ in pending), user_id))
+        current = {row[0]: row for row in cur.fetchall()}
+
+        owned = []
+        for edit, result in pending:
+            if edit['stat_id'] in current:
+                owned.append((edit, result))
+            else:
+                result.update(status="not_found")
+        dim_ids = {} # game_id -> resolve_dimension_ids result
+        for game_id in {current[edit['stat_id']][2] for edit, _ in owned}:
+            dim_ids[game_id] = resolve_dimension_ids(cur, game_id, [edit for edit, _ in owned if current[edit['stat_id']][2] == game_id])
+
+        stat_rows, match_rows, match_fields_set = {}, {}, {}
+        for edit, result in owned:
+            (stat_id, match_id, game_id, _, _, stat_type_id, stat_value, game_mode_id, game_level, win, ranked,
+             pre_rank, post_rank, pre_rank_id, post_rank_id) = current[edit['stat_id']]
+            ids = dim_ids[game_id]
+            header_edits = {field: edit[field] for field in MATCH_HEADER_FIELDS if field in edit}
+            conflicts = [field for field, value in header_edits.items() if match_fields_set.get(match_id, {}).get(field, value) != value]
+            if conflicts:
+                result.update(status="error", error=f"Conflicts with another edit to match {match_id}: {', '.join(conflicts)}")
+                continue
+            if 'stat_type' in edit or 'stat_value' in edit:
+                stat_rows[stat_id] = (stat_id, ids["stat_type"][edit['stat_type']] if 'stat_type' in edit else stat_type_id,
+                                      edit['stat_value'] if 'stat_value' in edit else stat_value)
+            if header_edits:
+                match_fields_set.setdefault(match_id, {}).update(header_edits)
+                header = match_rows.get(match_id) or {
+                    "game_mode_id": game_mode_id, "game_level": game_level, "win": win, "ranked": ranked,
+                    "pre_match_rank_value": pre_rank, "post_match_rank_value": post_rank,
+                    "pre_match_rank_id": pre_rank_id, "post_match_rank_id": post_rank_id}
+                for field, value in header_edits.items():
+                    if field == 'game_mode':
+                        header["game_mode_id"] = ids["game_mode"].get(value)
+                    elif field in ('pre_match_rank_value', 'post_match_rank_value'):
+                        header[field] = value
+                        header[field.replace('_value', '_id')] = ids["rank"].get(value)
+                    else:
+                        header[field] = value
+                match_rows[match_id] = header
+            result.update(status="updated")
+
+        if stat_rows:
+            cur.execute("""
+                DROP TABLE IF EXISTS stat_edits;
+                CREATE TEMP TABLE stat_edits (stat_id INTEGER, stat_type_id INTEGER, stat_value INTEGER);
+            """)
+            execute_values(cur, "INSERT INTO stat_edits (stat_id, stat_type_id, stat_value) VALUES %s;", list(stat_rows.values()))
+            cur.execute("""
+                UPDATE fact.fact_match_stats s SET stat_type_id = e.stat_type_id, stat_value = e.stat_value
+                FROM stat_edits e WHERE s.stat_id = e.stat_id;
+            """)
+        if match_rows:
+            cur.execute("""
+                DROP TABLE IF EXISTS match_edits;
+                CREATE TEMP TABLE match_edits (
+                    match_id INTEGER, game_mode_id INTEGER, game_level INTEGER, win INTEGER, ranked INTEGER,
+                    pre_match_rank_value VARCHAR(50), post_match_rank_value VARCHAR(50), pre_match_rank_id INTEGER, post_match_rank_id INTEGER
+                );
+            """)
+            execute_values(cur, """
+                INSERT INTO match_edits (match_id, game_mode_id, game_level, win, ranked, pre_match_rank_value, post_match_rank_value,
+                                         pre_match_rank_id, post_match_rank_id) VALUES %s;
+            """, [(match_id, header["game_mode_id"], header["game_level"], header["win"], header["ranked"], header["pre_match_rank_value"],
+                   header["post_match_rank_value"], header["pre_match_rank_id"], header["post_match_rank_id"]) for match_id, header in match_rows.items()])
+            cur.execute("""
+                UPDATE fact.fact_matches m SET game_mode_id = e.game_mode_id, game_level = e.game_level, win = e.win, ranked = e.ranked,
+                    pre_match_rank_value = e.pre_match_rank_value, post_match_rank_value = e.post_match_rank_value,
+                    pre_match_rank_id = e.pre_match_rank_id, post_match_rank_id = e.post_match_rank_id
+                FROM match_edits e WHERE m.match_id = e.match_id;
+            """)
+        updated = {current[edit['stat_id']][1] for edit, result in owned if result["status"] == "updated"}
+        refresh_daily_rollups(cur, {(row[3], row[2], row[4].date()) for row in current.values() if row[1] in updated and row[4] is not None})
+        return dim_ids
+
+    try:
+        dim_ids = run_write_unit(write)
+        for game_id, ids in dim_ids.items():
+            cache_dimension_ids(game_id, ids)
+        updated = sum(1 for result in results if result["status"] == "updated")
+        if updated:
+            invalidate_user_responses(user_id)
+        print(f"{updated} of {len(edits)} stat edits applied by {auth.user_email}")
+        return jsonify({"message": f"{updated} of {len(edits)} entries updated.", "updated": updated, "results": results}), 200
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error: {error}"); conn.rollback()
-        return jsonify({"error": f"An internal error occurred: {str(error)}"}), 500
-    finally:
-        release_db_connection(conn)
+        print(f"Error updating stats for {auth.user_email}: {error}")
+        return jsonify({"error": f"An error occurred while updating the entries: {str(error)}"}), 500
 
 # --- Player Endpoints ---
 
 @app.route('/api/update_player/<int:player_id>', methods=['PUT'])
 @requires_jwt_auth
-def update_player(player_id, user_email):
+def update_player(player_id, auth):
     """Updates a player's name. User must be trusted and own the player."""
     data = request.json
     new_player_name = data.get('player_name')
     if not new_player_name:
         return jsonify({"error": "New player_name is required"}), 400
+    if not auth.is_trusted:
+        return jsonify({"error": "Player not found or user not authorized."}), 404
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        # Verify user is trusted AND owns this player
+        # Verify user owns this player
         cur.execute("""
             UPDATE dim.dim_players
             SET player_name = %s
-            WHERE player_id = %s
-            AND user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s AND is_trusted = TRUE);
-        """, (new_player_name, player_id, user_email))
+            WHERE player_id = %s AND user_id = %s;
+        """, (new_player_name, player_id, auth.user_id))
         conn.commit()
+        player_cache.discard_value(player_id)
+        invalidate_user_responses(auth.user_id)
         if cur.rowcount == 0:
             return jsonify({"error": "Player not found or user not authorized."}), 404
-        print(f"Player {player_id} updated to '{new_player_name}' by {user_email}")
+        print(f"Player {player_id} updated to '{new_player_name}' by {auth.user_email}")
         return jsonify({"message": "Player updated successfully."}), 200
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"Error updating player {player_id}: {error}"); conn.rollback()
@@ -474,47 +2543,89 @@ def update_player(player_id, user_email):
 
 @app.route('/api/delete_player/<int:player_id>', methods=['DELETE'])
 @requires_jwt_auth
-def delete_player(player_id, user_email):
-    """Deletes a player and all their stats. User must be trusted and own the player."""
+def delete_player(player_id, auth):
+    """
+    Deletes a player and all their stats. User must be trusted and own the player.
+    Stats are deleted in chunks of CASCADE_DELETE_BATCH_SIZE matches, each committed on its own.
+    With 'Accept: application/x-ndjson' the response streams one progress line per chunk and a
+    final summary line; otherwise it returns the summary when done. An interrupted delete leaves
+    the player with the matches not yet reached; calling it again finishes the job. The player
+    row goes last, under LOCK dim.dim_players and only once no matches are left, so matches an
+    add_stats committed between chunks are deleted by another pass instead of being orphaned.
+    """
+    if not auth.is_trusted:
+        return jsonify({"error": "User not authorized to delete."}), 403
+    user_id = auth.user_id
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        
-        # Get user_id and trust status
-        cur.execute("SELECT user_id, is_trusted FROM dim.dim_users WHERE user_email = %s;", (user_email,))
-        user_result = cur.fetchone()
-        if not user_result or not user_result[1]:
-             return jsonify({"error": "User not authorized to delete."}), 403
-        user_id = user_result[0]
 
         # Verify player belongs to user
         cur.execute("SELECT 1 FROM dim.dim_players WHERE player_id = %s AND user_id = %s;", (player_id, user_id))
         player_exists = cur.fetchone()
+        conn.commit()
         if not player_exists:
+            release_db_connection(conn)
             return jsonify({"error": "Player not found or permission denied."}), 404
-
-        # Delete associated stats first
-        cur.execute("DELETE FROM fact.fact_game_stats WHERE player_id = %s;", (player_id,))
-        print(f"Deleted {cur.rowcount} stats for player {player_id}")
-        
-        # Then delete the player
-        cur.execute("DELETE FROM dim.dim_players WHERE player_id = %s AND user_id = %s;", (player_id, user_id))
-        
-        conn.commit()
-        print(f"Player {player_id} deleted by user {user_email}")
-        return jsonify({"message": "Player and all associated stats deleted."}), 200
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error deleting player {player_id}: {error}"); conn.rollback()
-        return jsonify({"error": f"An internal error occurred: {str(error)}"}), 500
-    finally:
+        print(f"Error deleting player {player_id}: {error}")
+        if conn: conn.rollback()
         release_db_connection(conn)
+        return jsonify({"error": f"An internal error occurred: {str(error)}"}), 500
+
+    def cascade():
+        progress = {"matches_deleted": 0}
+        earlier_passes = {"matches_total": 0, "matches_deleted": 0, "stats_deleted": 0, "batches": 0}
+        invalidated = False
+        try:
+            while True:
+                for batch_progress in delete_matches_in_batches(conn, "player_id = %s", (player_id,)):
+                    progress = dict(batch_progress, **{key: count + batch_progress[key] for key, count in earlier_passes.items()})
+                    yield progress
+                # Writers that resolved the player from their cache may have committed matches since the
+                # last chunk; the lock stops new ones until the player row is gone.
+                cur.execute("""
+                    LOCK dim.dim_players;
+                    SELECT COUNT(*) FROM fact.fact_matches WHERE player_id = %s;
+                """, (player_id,))
+                if cur.fetchone()[0] == 0:
+                    break
+                conn.rollback()
+                earlier_passes = dict({key: progress.get(key, 0) for key in earlier_passes}, matches_total=progress["matches_deleted"])
+            # Then delete the player (its rollups went with its last chunk of matches)
+            cur.execute("""
+                DELETE FROM fact.agg_daily_player_game_stat WHERE player_id = %(player_id)s;
+                DELETE FROM dim.dim_players WHERE player_id = %(player_id)s AND user_id = %(user_id)s;
+            """, {"player_id": player_id, "user_id": user_id})
+            conn.commit()
+            player_cache.discard_value(player_id)
+            invalidate_user_responses(user_id) # Even with no matches, the cached player list just changed
+            invalidated = True
+            print(f"Player {player_id} deleted by user {auth.user_email} ({progress['matches_deleted']} matches)")
+            yield dict(progress, message="Player and all associated stats deleted.", done=True)
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Error deleting player {player_id}: {error}")
+            if not conn.closed: conn.rollback()
+            yield dict(progress, error=f"An internal error occurred: {str(error)}", done=False)
+        finally:
+            if progress["matches_deleted"] and not invalidated: # Chunks committed before a failure or disconnect
+                invalidate_user_responses(user_id)
+            release_db_connection(conn)
+
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        return Response(stream_with_context(json.dumps(line) + "\n" for line in cascade()), mimetype='application/x-ndjson')
+    summary = None
+    for summary in cascade():
+        pass
+    return jsonify(summary), 200 if summary.get("done") else 500
 
 # --- Game Endpoints ---
 
 @app.route('/api/get_game_details/<int:game_id>', methods=['GET'])
 @requires_jwt_auth
-def get_game_details(game_id, user_email):
+@cached_response
+def get_game_details(game_id, auth):
     """Gets details for a specific game if the user has stats for it."""
     conn = None
     try:
@@ -522,12 +2633,11 @@ def get_game_details(game_id, user_email):
         cur = conn.cursor()
         # Check if user has stats for this game (implies ownership)
         cur.execute("""
-            SELECT 1 FROM fact.fact_game_stats
+            SELECT 1 FROM fact.fact_matches
             WHERE game_id = %s
-            AND player_id IN (SELECT player_id FROM dim.dim_players WHERE user_id = (
-                SELECT user_id FROM dim.dim_users WHERE user_email = %s
-            ));
-        """, (game_id, user_email))
+            AND player_id IN (SELECT player_id FROM dim.dim_players WHERE user_id = %s)
+            LIMIT 1;
+        """, (game_id, auth.user_id))
         has_stats = cur.fetchone()
         
         if not has_stats:
@@ -550,7 +2660,7 @@ def get_game_details(game_id, user_email):
 
 @app.route('/api/update_game/<int:game_id>', methods=['PUT'])
 @requires_jwt_auth
-def update_game(game_id, user_email):
+def update_game(game_id, auth):
     """Updates a game's details. User must be trusted and have stats for the game."""
     data = request.json
     game_name = data.get('game_name')
@@ -560,28 +2670,20 @@ def update_game(game_id, user_email):
     
     if not game_name:
         return jsonify({"error": "New game_name is required"}), 400
+    # Verify user is trusted
+    if not auth.is_trusted:
+        return jsonify({"error": "User not authorized to update."}), 403
+    user_id = auth.user_id
     
-    conn = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Verify user is trusted
-        cur.execute("SELECT user_id, is_trusted FROM dim.dim_users WHERE user_email = %s;", (user_email,))
-        user_result = cur.fetchone()
-        if not user_result or not user_result[1]:
-             return jsonify({"error": "User not authorized to update."}), 403
-        user_id = user_result[0]
-        
+    def write(cur):
         # Verify user has stats for this game (implied ownership)
         cur.execute("""
-            SELECT 1 FROM fact.fact_game_stats
-            WHERE game_id = %s AND player_id IN (SELECT player_id FROM dim.dim_players WHERE user_id = %s);
+            SELECT 1 FROM fact.fact_matches
+            WHERE game_id = %s AND player_id IN (SELECT player_id FROM dim.dim_players WHERE user_id = %s)
+            LIMIT 1;
         """, (game_id, user_id))
-        has_stats = cur.fetchone()
-        
-        if not has_stats:
-            return jsonify({"error": "Game not found or user has no stats for it."}), 404
+        if not cur.fetchone():
+            return False
 
         # User is trusted and has stats, proceed with update
         cur.execute("""
@@ -589,38 +2691,38 @@ def update_game(game_id, user_email):
             SET game_name = %s, game_installment = %s, game_genre = %s, game_subgenre = %s
             WHERE game_id = %s;
         """, (game_name, game_installment, game_genre, game_subgenre, game_id))
-        conn.commit()
+        return True
+
+    try:
+        if not run_write_unit(write):
+            return jsonify({"error": "Game not found or user has no stats for it."}), 404
+        game_cache.discard_value(game_id)
+        invalidate_shared_responses()
         
-        print(f"Game {game_id} updated to '{game_name}' by {user_email}")
+        print(f"Game {game_id} updated to '{game_name}' by {auth.user_email}")
         return jsonify({"message": "Game updated successfully."}), 200
     except (Exception, psycopg2.DatabaseError) as error:
         # Handle potential unique constraint violation on game_name
         if "unique constraint" in str(error).lower():
             print(f"Error updating game {game_id}: Name '{game_name}' already exists.")
             return jsonify({"error": f"Game name '{game_name}' already exists."}), 409 # 409 Conflict
-        print(f"Error updating game {game_id}: {error}"); conn.rollback()
+        print(f"Error updating game {game_id}: {error}")
         return jsonify({"error": f"An internal error occurred: {str(error)}"}), 500
-    finally:
-        release_db_connection(conn)
 
 @app.route('/api/delete_game/<int:game_id>', methods=['DELETE'])
 @requires_jwt_auth
-def delete_game(game_id, user_email):
+def delete_game(game_id, auth):
     """Deletes a game. User must be trusted. Game must have NO associated stats."""
+    # Verify user is trusted
+    if not auth.is_trusted:
+        return jsonify({"error": "User not authorized to delete."}), 403
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        
-        # Verify user is trusted
-        cur.execute("SELECT user_id, is_trusted FROM dim.dim_users WHERE user_email = %s;", (user_email,))
-        user_result = cur.fetchone()
-        if not user_result or not user_result[1]:
-             return jsonify({"error": "User not authorized to delete."}), 403
-        user_id = user_result[0]
 
         # CRITICAL: Check if any stats still reference this game
-        cur.execute("SELECT 1 FROM fact.fact_game_stats WHERE game_id = %s LIMIT 1;", (game_id,))
+        cur.execute("SELECT 1 FROM fact.fact_matches WHERE game_id = %s LIMIT 1;", (game_id,))
         stats_exist = cur.fetchone()
         
         if stats_exist:
@@ -630,13 +2732,22 @@ def delete_game(game_id, user_email):
         # No stats exist, proceed with deletion
         # Optional: Check if user *used* to have stats for this game?
         # For simplicity, we allow any trusted user to delete an orphaned game.
-        cur.execute("DELETE FROM dim.dim_games WHERE game_id = %s;", (game_id,))
+        cur.execute("""
+            DELETE FROM dim.dim_ranks WHERE game_id = %(game_id)s;
+            DELETE FROM dim.dim_game_modes WHERE game_id = %(game_id)s;
+            DELETE FROM dim.dim_stat_types WHERE game_id = %(game_id)s;
+            DELETE FROM dim.dim_games WHERE game_id = %(game_id)s;
+        """, {"game_id": game_id})
         conn.commit()
+        game_cache.discard_value(game_id)
+        for label_cache in (rank_cache, game_mode_cache, stat_type_cache):
+            label_cache.clear() # Keys are (game_id, label); deleting a game is rare enough to drop them all
+        invalidate_shared_responses()
         
         if cur.rowcount == 0:
             return jsonify({"error": "Game not found."}), 404
             
-        print(f"Game {game_id} deleted by user {user_email}")
+        print(f"Game {game_id} deleted by user {auth.user_email}")
         return jsonify({"message": "Game successfully deleted."}), 200
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"Error deleting game {game_id}: {error}"); conn.rollback()
@@ -647,78 +2758,116 @@ def delete_game(game_id, user_email):
 
 # --- Delete Stats Endpoints ---
 
+DELETE_STATS_MAX_BATCH = 1000
+
+def delete_stat_rows(cur, user_id, stat_ids):
+    """
+    Deletes the given stats owned by user_id (matches left without stats go too) in one round
+    trip, plus one more to refresh the rollups they touched. Redshift has no DELETE ... RETURNING,
+    so the targets are staged in a temp table first. Returns {stat_id: (game_id,
+    user_has_game_stats, game_has_stats)} for the stats deleted, with the flags taken after the
+    delete. Does not commit.
+    """
+    # The temp table lives until the session ends; dropping it up front makes the call repeatable
+    # on a pooled connection (and twice in one group-commit transaction).
+    cur.execute("""
+        DROP TABLE IF EXISTS stat_delete_targets;
+        CREATE TEMP TABLE stat_delete_targets AS
+        SELECT s.stat_id, s.match_id, m.game_id, m.player_id, m.played_at
+        FROM fact.fact_match_stats s
+        JOIN fact.fact_matches m ON s.match_id = m.match_id
+        JOIN dim.dim_players p ON m.player_id = p.player_id
+        WHERE s.stat_id IN %(stat_ids)s AND p.user_id = %(user_id)s;
+        DELETE FROM fact.fact_match_stats WHERE stat_id IN (SELECT stat_id FROM stat_delete_targets);
+        DELETE FROM fact.fact_matches
+        WHERE match_id IN (SELECT match_id FROM stat_delete_targets)
+        AND match_id NOT IN (SELECT match_id FROM fact.fact_match_stats WHERE match_id IN (SELECT match_id FROM stat_delete_targets));
+        SELECT t.stat_id, t.game_id, t.player_id, t.played_at, u.game_id IS NOT NULL, a.game_id IS NOT NULL
+        FROM stat_delete_targets t
+        LEFT JOIN (
+            SELECT DISTINCT m.game_id FROM fact.fact_matches m
+            JOIN dim.dim_players p ON m.player_id = p.player_id
+            WHERE p.user_id = %(user_id)s AND m.game_id IN (SELECT game_id FROM stat_delete_targets)
+        ) u ON u.game_id = t.game_id
+        LEFT JOIN (
+            SELECT DISTINCT game_id FROM fact.fact_matches WHERE game_id IN (SELECT game_id FROM stat_delete_targets)
+        ) a ON a.game_id = t.game_id;
+    """, {"stat_ids": tuple(stat_ids), "user_id": user_id})
+    rows = cur.fetchall()
+    refresh_daily_rollups(cur, [(player_id, game_id, played_at.date()) for _, game_id, player_id, played_at, _, _ in rows if played_at is not None])
+    return {stat_id: (game_id, user_has_stats, game_has_stats) for stat_id, game_id, _, _, user_has_stats, game_has_stats in rows}
+
 @app.route('/api/delete_stats/<int:stat_id>', methods=['DELETE'])
 @requires_jwt_auth
-def delete_stats(stat_id, user_email):
+def delete_stats(stat_id, auth):
     """
     Deletes a stat entry. If it's the last stat for that game *for that user*,
     returns a flag to prompt front-end.
     """
-    conn = None
-    game_id_to_check = None
-    user_id = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Get user_id and trust status
-        cur.execute("SELECT user_id, is_trusted FROM dim.dim_users WHERE user_email = %s;", (user_email,))
-        user_result = cur.fetchone()
-        if not user_result or not user_result[1]:
-             return jsonify({"error": "User not authorized to delete stats"}), 403
-        user_id = user_result[0]
+    # Verify user is trusted
+    if not auth.is_trusted:
+        return jsonify({"error": "User not authorized to delete stats"}), 403
+    user_id = auth.user_id
 
-        # Get game_id *before* deleting, and verify ownership
-        cur.execute("""
-            SELECT gs.game_id
-            FROM fact.fact_game_stats gs
-            JOIN dim.dim_players p ON gs.player_id = p.player_id
-            WHERE gs.stat_id = %s AND p.user_id = %s;
-        """, (stat_id, user_id))
-        stat_info = cur.fetchone()
-        
-        if not stat_info:
+    try:
+        deleted = run_write_unit(lambda cur: delete_stat_rows(cur, user_id, [stat_id]))
+        if stat_id not in deleted:
             return jsonify({"message": f"Stat with ID {stat_id} not found or permission denied."}), 404
-        game_id_to_check = stat_info[0]
+        print(f"Stat entry {stat_id} deleted by user {auth.user_email}")
+        invalidate_user_responses(user_id)
 
-        # Perform the delete
-        cur.execute("DELETE FROM fact.fact_game_stats WHERE stat_id = %s;", (stat_id,))
-        print(f"Stat entry {stat_id} deleted by user {user_email}")
-        
-        # Check if any *other* stats exist for this game *for this user*
-        cur.execute("""
-            SELECT 1 FROM fact.fact_game_stats gs
-            JOIN dim.dim_players p ON gs.player_id = p.player_id
-            WHERE gs.game_id = %s AND p.user_id = %s
-            LIMIT 1;
-        """, (game_id_to_check, user_id))
-        other_stats_exist = cur.fetchone()
-        
-        conn.commit()
-        
+        game_id, user_has_stats, game_has_stats = deleted[stat_id]
         response_data = {"message": "Entry successfully deleted."}
-        if not other_stats_exist:
-            # This was the last stat for this game *for this user*
-            # Check if *any* stats exist for this game at all
-            cur.execute("SELECT 1 FROM fact.fact_game_stats WHERE game_id = %s LIMIT 1;", (game_id_to_check,))
-            any_stats_exist = cur.fetchone()
-            if not any_stats_exist:
-                print(f"Last stat for game {game_id_to_check} was deleted by {user_email}.")
-                response_data["last_stat_deleted"] = True
-                response_data["game_id"] = game_id_to_check
-        
+        if not user_has_stats:
+            response_data["last_stat_for_user"] = True
+        if not game_has_stats:
+            print(f"Last stat for game {game_id} was deleted by {auth.user_email}.")
+            response_data["last_stat_deleted"] = True
+            response_data["game_id"] = game_id
         return jsonify(response_data), 200
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error while deleting stats: {error}"); conn.rollback()
+        print(f"Error while deleting stats: {error}")
         return jsonify({"error": f"An error occurred while deleting the entry: {str(error)}"}), 500
-    finally:
-        release_db_connection(conn)
+
+@app.route('/api/delete_stats', methods=['DELETE'])
+@requires_jwt_auth
+def delete_stats_batch(auth):
+    """
+    Deletes many stat entries in one transaction. Body: {"stat_ids": [...]}. Ids that don't exist
+    or belong to another user are reported in not_found. orphaned_game_ids lists games left
+    with no stats at all, so the front-end can offer to delete them.
+    """
+    if not auth.is_trusted:
+        return jsonify({"error": "User not authorized to delete stats"}), 403
+    stat_ids = (request.get_json(silent=True) or {}).get('stat_ids')
+    if (not isinstance(stat_ids, list) or not stat_ids or len(stat_ids) > DELETE_STATS_MAX_BATCH
+            or not all(isinstance(stat_id, int) and not isinstance(stat_id, bool) for stat_id in stat_ids)):
+        return jsonify({"error": f"'stat_ids' must be a list of 1 to {DELETE_STATS_MAX_BATCH} integer ids"}), 400
+    stat_ids = list(dict.fromkeys(stat_ids))
+    user_id = auth.user_id
+
+    try:
+        deleted = run_write_unit(lambda cur: delete_stat_rows(cur, user_id, stat_ids))
+        if deleted:
+            invalidate_user_responses(user_id)
+        print(f"{len(deleted)} stat entries deleted by user {auth.user_email}")
+        return jsonify({
+            "message": f"{len(deleted)} entries deleted.",
+            "deleted": [stat_id for stat_id in stat_ids if stat_id in deleted],
+            "not_found": [stat_id for stat_id in stat_ids if stat_id not in deleted],
+            "last_stat_for_user_game_ids": sorted({game_id for game_id, user_has_stats, _ in deleted.values() if not user_has_stats}),
+            "orphaned_game_ids": sorted({game_id for game_id, _, game_has_stats in deleted.values() if not game_has_stats}),
+        }), 200
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error while deleting stats: {error}")
+        return jsonify({"error": f"An error occurred while deleting the entries: {str(error)}"}), 500
 
 # --- Read Endpoints ---
 
 @app.route('/api/get_players', methods=['GET'])
 @requires_jwt_auth
-def get_players(user_email):
+@cached_response
+def get_players(auth):
     """Gets players (id, name) associated ONLY with the authenticated user."""
     conn = None
     try:
@@ -726,21 +2875,22 @@ def get_players(user_email):
         cur = conn.cursor()
         cur.execute("""
             SELECT player_id, player_name FROM dim.dim_players
-            WHERE user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
+            WHERE user_id = %s
             ORDER BY player_name;
-        """, (user_email,))
+        """, (auth.user_id,))
         # Return list of dicts
         players = [{"player_id": row[0], "player_name": row[1]} for row in cur.fetchall()]
         return jsonify({"players": players}), 200
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error while fetching players for user {user_email}: {error}")
+        print(f"Error while fetching players for user {auth.user_email}: {error}")
         return jsonify({"error": "An error occurred while fetching players."}), 500
     finally:
         release_db_connection(conn)
 
 @app.route('/api/get_games', methods=['GET'])
 @requires_jwt_auth
-def get_games(user_email):
+@cached_response
+def get_games(auth):
     """Gets all games the authenticated user has stats for. Returns [ {id, name}, ... ]."""
     conn = None
     try:
@@ -749,67 +2899,472 @@ def get_games(user_email):
         cur.execute("""
             SELECT DISTINCT g.game_id, g.game_name
             FROM dim.dim_games g
-            JOIN fact.fact_game_stats gs ON g.game_id = gs.game_id
-            JOIN dim.dim_players p ON gs.player_id = p.player_id
-            WHERE p.user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
+            JOIN fact.agg_daily_player_game_stat a ON g.game_id = a.game_id
+            JOIN dim.dim_players p ON a.player_id = p.player_id
+            WHERE p.user_id = %s
             ORDER BY g.game_name;
-        """, (user_email,))
+        """, (auth.user_id,))
         games = [{"game_id": row[0], "game_name": row[1]} for row in cur.fetchall()]
         return jsonify({"games": games}), 200
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error while fetching games for user {user_email}: {error}")
+        print(f"Error while fetching games for user {auth.user_email}: {error}")
         return jsonify({"error": "An error occurred while fetching games."}), 500
     finally:
-        if conn: conn.close()
+        release_db_connection(conn)
+
+def encode_stats_cursor(played_at, stat_id):
+    """Opaque keyset cursor for /api/stats: the (played_at, stat_id) of the last row returned."""
+    return base64.urlsafe_b64encode(json.dumps([played_at.isoformat(), stat_id]).encode()).decode()
+
+def decode_stats_cursor(cursor):
+    """Returns (played_at, stat_id) or raises ValueError."""
+    try:
+        played_at, stat_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(played_at), int(stat_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def build_stats_filters(args, auth, alias='m', time_column='played_at', stat_alias='s', label_ids=True):
+    """
+    WHERE conditions and params shared by /api/stats, /api/summary and /api/rank_progression,
+    scoped to the user. Expects fact.fact_matches (or the rollup) aliased as `alias`,
+    fact.fact_match_stats as `stat_alias` (None when the query doesn't join stat rows) and
+    dim_players as p. The match tables store game_mode_id / stat_type_id, so label filters go
+    through the dimension tables; pass label_ids=False for the rollup, which keeps the labels.
+    Raises ValueError on bad input.
+    """
+    conditions, params = ["p.user_id = %s", f"{alias}.{time_column} IS NOT NULL"], [auth.user_id]
+    for name in ('game_id', 'player_id', 'ranked', 'win'):
+        if args.get(name) not in (None, ''):
+            try:
+                params.append(int(args[name]))
+            except ValueError:
+                raise ValueError(f"'{name}' must be an integer")
+            conditions.append(f"{alias}.{name} = %s")
+    if args.get('game_mode'):
+        if label_ids:
+            conditions.append(f"{alias}.game_mode_id IN (SELECT game_mode_id FROM dim.dim_game_modes WHERE game_mode = %s)")
+        else:
+            conditions.append(f"{alias}.game_mode = %s")
+        params.append(args['game_mode'])
+    if args.get('stat_type'):
+        if stat_alias is None:
+            raise ValueError("'stat_type' is not supported here")
+        if label_ids:
+            conditions.append(f"{stat_alias}.stat_type_id IN (SELECT stat_type_id FROM dim.dim_stat_types WHERE stat_type = %s)")
+        else:
+            conditions.append(f"{stat_alias}.stat_type = %s")
+        params.append(args['stat_type'])
+    for name, operator in (('from', '>='), ('to', '<')):
+        if args.get(name):
+            try:
+                params.append(datetime.fromisoformat(args[name]))
+            except ValueError:
+                raise ValueError(f"'{name}' must be an ISO-8601 timestamp")
+            conditions.append(f"{alias}.{time_column} {operator} %s")
+    return conditions, params
+
+@app.route('/api/stats', methods=['GET'])
+@requires_jwt_auth
+@cached_response
+def list_stats(auth):
+    """
+    Pages through the user's stat entries, newest first, using keyset pagination on
+    (played_at, stat_id) so deep pages cost the same as the first one.
+    Optional filters: game_id, player_id, game_mode, stat_type, ranked (0/1), win (0/1),
+    from / to (ISO-8601 played_at bounds, to is exclusive), limit, cursor (from next_cursor).
+    """
+    args = request.args
+    try:
+        limit = int(args.get('limit', STATS_PAGE_DEFAULT_LIMIT))
+        if not 1 <= limit <= STATS_PAGE_MAX_LIMIT:
+            raise ValueError(f"'limit' must be between 1 and {STATS_PAGE_MAX_LIMIT}")
+        conditions, params = build_stats_filters(args, auth)
+        if args.get('cursor'):
+            cursor_played_at, cursor_stat_id = decode_stats_cursor(args['cursor'])
+            conditions.append("(m.played_at < %s OR (m.played_at = %s AND s.stat_id < %s))")
+            params += [cursor_played_at, cursor_played_at, cursor_stat_id]
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT s.stat_id, m.match_id, m.game_id, g.game_name, g.game_installment, m.player_id, p.player_name,
+                   st.stat_type, s.stat_value, gm.game_mode, m.game_level, m.win, m.ranked,
+                   m.pre_match_rank_value, m.post_match_rank_value, m.played_at
+            FROM fact.fact_matches m
+            JOIN fact.fact_match_stats s ON s.match_id = m.match_id
+            JOIN dim.dim_stat_types st ON st.stat_type_id = s.stat_type_id
+            LEFT JOIN dim.dim_game_modes gm ON gm.game_mode_id = m.game_mode_id
+            JOIN dim.dim_players p ON m.player_id = p.player_id
+            JOIN dim.dim_games g ON m.game_id = g.game_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY m.played_at DESC, s.stat_id DESC
+            LIMIT %s;
+        """, params + [limit + 1]) # One extra row tells us whether there is a next page
+        columns = [col[0] for col in cur.description]
+        rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error listing stats for user {auth.user_email}: {error}")
+        return jsonify({"error": "An error occurred while fetching stats."}), 500
+    finally:
+        release_db_connection(conn)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_stats_cursor(rows[-1]['played_at'], rows[-1]['stat_id'])
+    for row in rows:
+        row['played_at'] = row['played_at'].isoformat()
+    return jsonify({"stats": rows, "next_cursor": next_cursor}), 200
+
+# group_by name -> [(select expression, output column)]; whitelisted, never built from input
+# ({f} is the match or rollup alias, {s} the stat row alias, {t} the time column, {gm}/{st}
+# the aliases holding the game_mode/stat_type labels: the rollup itself, or the joined dimension)
+SUMMARY_GROUPS = {
+    "game": [("g.game_id", "game_id"), ("g.game_name", "game_name"), ("g.game_installment", "game_installment")],
+    "player": [("p.player_id", "player_id"), ("p.player_name", "player_name")],
+    "game_mode": [("{gm}.game_mode", "game_mode")],
+    "stat_type": [("{st}.stat_type", "stat_type")],
+    "ranked": [("{f}.ranked", "ranked")],
+    "bucket": [("DATE_TRUNC('{bucket}', CAST({f}.{t} AS TIMESTAMP))", "bucket")],
+}
+SUMMARY_BUCKETS = ("hour", "day", "week", "month", "quarter", "year")
+SUMMARY_METRICS = {
+    "count": "COUNT(s.stat_id)",
+    "sum": "SUM(s.stat_value)",
+    "avg": "AVG(CAST(s.stat_value AS FLOAT))",
+    "min": "MIN(s.stat_value)",
+    "max": "MAX(s.stat_value)",
+    "matches": "COUNT(DISTINCT m.match_id)",
+    "win_rate": """CAST(COUNT(DISTINCT CASE WHEN m.win = 1 THEN m.match_id END) AS FLOAT)
+                    / NULLIF(COUNT(DISTINCT CASE WHEN m.win IS NOT NULL THEN m.match_id END), 0)""",
+}
+# Metrics answerable from fact.fact_matches alone (no stat row join)
+SUMMARY_MATCH_METRICS = ("matches", "win_rate")
+SUMMARY_PERCENTILES = {"p25": 0.25, "p50": 0.5, "p75": 0.75, "p90": 0.9, "p95": 0.95, "p99": 0.99}
+# Metrics that fact.agg_daily_player_game_stat can answer, and how
+SUMMARY_ROLLUP_METRICS = {
+    "count": "CAST(SUM(a.stat_count) AS BIGINT)",
+    "sum": "CAST(SUM(a.stat_sum) AS BIGINT)",
+    "avg": "CAST(SUM(a.stat_sum) AS FLOAT) / NULLIF(SUM(a.value_count), 0)",
+    "min": "MIN(a.stat_min)",
+    "max": "MAX(a.stat_max)",
+}
+SUMMARY_ROLLUP_GROUPS = ("game", "player", "game_mode", "stat_type", "bucket")
+
+def summary_can_use_rollup(args, group_by, metrics, bucket):
+    """True when the query's granularity is daily or coarser and needs no per-row columns."""
+    if not SUMMARY_USE_ROLLUPS or bucket == "hour":
+        return False
+    if any(name not in SUMMARY_ROLLUP_GROUPS for name in group_by) or any(name not in SUMMARY_ROLLUP_METRICS for name in metrics):
+        return False
+    if any(args.get(name) not in (None, '') for name in ('ranked', 'win')):
+        return False
+    for name in ('from', 'to'):
+        if args.get(name):
+            try:
+                bound = datetime.fromisoformat(args[name])
+            except ValueError:
+                return False # Let the fact path report the error
+            if bound.time() != datetime.min.time():
+                return False
+    return True
+
+def summary_percentile_sql(fraction):
+    if SUMMARY_PERCENTILE_MODE == "exact":
+        return f"PERCENTILE_CONT({fraction}) WITHIN GROUP (ORDER BY s.stat_value)"
+    return f"APPROXIMATE PERCENTILE_DISC({fraction}) WITHIN GROUP (ORDER BY s.stat_value)"
+
+@app.route('/api/summary', methods=['GET'])
+@requires_jwt_auth
+@cached_response
+def get_summary(auth):
+    """
+    Grouped aggregates over the user's stat rows, computed in the database.
+    group_by: comma list of game, player, game_mode, stat_type, ranked, bucket (default: none).
+    bucket: hour/day/week/month/quarter/year (default day), used when grouping by bucket.
+    metrics: comma list of count, sum, avg, min, max, matches, win_rate, p25/p50/p75/p90/p95/p99
+    (default count,sum,avg,win_rate). win_rate is per match, not per stat row.
+    Accepts the same filters as /api/stats. Returns at most SUMMARY_MAX_GROUPS groups.
+    Daily-or-coarser queries over count/sum/avg/min/max read the daily rollup table, and
+    queries over matches/win_rate that don't involve stat_type read only fact.fact_matches
+    ('source' in the response says rollup, matches or fact).
+    """
+    args = request.args
+    group_by = [name.strip() for name in args.get('group_by', '').split(',') if name.strip()]
+    metrics = [name.strip() for name in args.get('metrics', 'count,sum,avg,win_rate').split(',') if name.strip()]
+    bucket = args.get('bucket', 'day').lower()
+    unknown_groups = [name for name in group_by if name not in SUMMARY_GROUPS]
+    unknown_metrics = [name for name in metrics if name not in SUMMARY_METRICS and name not in SUMMARY_PERCENTILES]
+    if unknown_groups:
+        return jsonify({"error": f"Unknown group_by: {', '.join(unknown_groups)}. Allowed: {', '.join(SUMMARY_GROUPS)}"}), 400
+    if not metrics or unknown_metrics:
+        return jsonify({"error": f"Unknown metrics: {', '.join(unknown_metrics)}. Allowed: {', '.join(list(SUMMARY_METRICS) + list(SUMMARY_PERCENTILES))}"}), 400
+    if bucket not in SUMMARY_BUCKETS:
+        return jsonify({"error": f"'bucket' must be one of {', '.join(SUMMARY_BUCKETS)}"}), 400
+    if summary_can_use_rollup(args, group_by, metrics, bucket):
+        source, fact_alias, stat_alias, time_column = "rollup", "a", "a", "stat_date"
+    elif all(name in SUMMARY_MATCH_METRICS for name in metrics) and "stat_type" not in group_by and not args.get('stat_type'):
+        source, fact_alias, stat_alias, time_column = "matches", "m", None, "played_at"
+    else:
+        source, fact_alias, stat_alias, time_column = "fact", "m", "s", "played_at"
+    try:
+        conditions, params = build_stats_filters(args, auth, fact_alias, time_column, stat_alias, label_ids=source != "rollup")
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    label_aliases = {"gm": "a", "st": "a"} if source == "rollup" else {"gm": "gm", "st": "st"}
+    group_columns = [(expr.format(bucket=bucket, f=fact_alias, s=stat_alias, t=time_column, **label_aliases), alias)
+                     for name in dict.fromkeys(group_by) for expr, alias in SUMMARY_GROUPS[name]]
+    if source == "rollup":
+        metric_columns = [(SUMMARY_ROLLUP_METRICS[name], name) for name in dict.fromkeys(metrics)]
+        source_table = "fact.agg_daily_player_game_stat a"
+    else:
+        metric_columns = [(SUMMARY_METRICS[name] if name in SUMMARY_METRICS else summary_percentile_sql(SUMMARY_PERCENTILES[name]), name)
+                          for name in dict.fromkeys(metrics)]
+        source_table = "fact.fact_matches m"
+        if source == "fact":
+            source_table += "\n            JOIN fact.fact_match_stats s ON s.match_id = m.match_id"
+        if "game_mode" in group_by:
+            source_table += "\n            LEFT JOIN dim.dim_game_modes gm ON gm.game_mode_id = m.game_mode_id"
+        if "stat_type" in group_by:
+            source_table += "\n            JOIN dim.dim_stat_types st ON st.stat_type_id = s.stat_type_id"
+    select_list = ",\n                   ".join(f"{expr} AS {alias}" for expr, alias in group_columns + metric_columns)
+    group_clause = ""
+    if group_columns:
+        positions = ", ".join(str(i) for i in range(1, len(group_columns) + 1))
+        group_clause = f"GROUP BY {positions} ORDER BY {positions}"
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {select_list}
+            FROM {source_table}
+            JOIN dim.dim_players p ON {fact_alias}.player_id = p.player_id
+            JOIN dim.dim_games g ON {fact_alias}.game_id = g.game_id
+            WHERE {" AND ".join(conditions)}
+            {group_clause}
+            LIMIT %s;
+        """, params + [SUMMARY_MAX_GROUPS + 1])
+        columns = [col[0] for col in cur.description]
+        rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error computing summary for user {auth.user_email}: {error}")
+        return jsonify({"error": "An error occurred while computing the summary."}), 500
+    finally:
+        release_db_connection(conn)
+
+    truncated = len(rows) > SUMMARY_MAX_GROUPS
+    rows = rows[:SUMMARY_MAX_GROUPS]
+    for row in rows:
+        if row.get('bucket') is not None: row['bucket'] = row['bucket'].isoformat()
+        for name in metrics:
+            if isinstance(row.get(name), Decimal): row[name] = float(row[name])
+    return jsonify({"group_by": group_by, "metrics": metrics, "rows": rows, "truncated": truncated,
+                    "source": source}), 200
+
+@app.route('/api/rank_progression', methods=['GET'])
+@requires_jwt_auth
+@cached_response
+def get_rank_progression(auth):
+    """
+    Rank history per player for one game (game_id is required; ordinals are per game).
+    One row per ranked match in fact.fact_matches, newest `limit` per player, oldest first, with:
+      match_delta           post - pre rank ordinal within the match
+      delta_since_previous  post ordinal change since the player's previous ranked match
+      peak_ordinal_to_date  best post-match ordinal up to and including the match
+    plus each player's current rank, peak rank and net change over the filtered range.
+    Accepts the /api/stats filters except stat_type (player_id, game_mode, ranked, win, from, to).
+    """
+    args = request.args
+    if args.get('game_id') in (None, ''):
+        return jsonify({"error": "'game_id' is required"}), 400
+    try:
+        limit = int(args.get('limit', STATS_PAGE_DEFAULT_LIMIT))
+        if not 1 <= limit <= STATS_PAGE_MAX_LIMIT:
+            raise ValueError(f"'limit' must be between 1 and {STATS_PAGE_MAX_LIMIT}")
+        conditions, params = build_stats_filters(args, auth, stat_alias=None)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            WITH matches AS (
+                SELECT m.player_id, m.played_at, m.win,
+                       m.pre_match_rank_id AS pre_rank_id, m.post_match_rank_id AS post_rank_id
+                FROM fact.fact_matches m
+                JOIN dim.dim_players p ON m.player_id = p.player_id
+                WHERE {" AND ".join(conditions)} AND m.post_match_rank_id IS NOT NULL
+            ), progression AS (
+                SELECT m.player_id, m.played_at, m.win,
+                       pre.rank_label AS pre_rank, pre.rank_ordinal AS pre_ordinal,
+                       post.rank_label AS post_rank, post.rank_ordinal AS post_ordinal,
+                       post.rank_ordinal - pre.rank_ordinal AS match_delta,
+                       post.rank_ordinal - LAG(post.rank_ordinal) OVER (PARTITION BY m.player_id ORDER BY m.played_at) AS delta_since_previous,
+                       MAX(post.rank_ordinal) OVER (PARTITION BY m.player_id ORDER BY m.played_at
+                                                    ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS peak_ordinal_to_date,
+                       FIRST_VALUE(post.rank_label) OVER (PARTITION BY m.player_id ORDER BY post.rank_ordinal DESC, m.played_at
+                                                          ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS peak_rank,
+                       FIRST_VALUE(m.played_at) OVER (PARTITION BY m.player_id ORDER BY post.rank_ordinal DESC, m.played_at
+                                                      ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS peak_reached_at,
+                       MAX(post.rank_ordinal) OVER (PARTITION BY m.player_id) AS peak_ordinal,
+                       FIRST_VALUE(COALESCE(pre.rank_ordinal, post.rank_ordinal)) OVER (PARTITION BY m.player_id ORDER BY m.played_at
+                                                          ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS starting_ordinal,
+                       COUNT(*) OVER (PARTITION BY m.player_id) AS ranked_matches,
+                       ROW_NUMBER() OVER (PARTITION BY m.player_id ORDER BY m.played_at DESC) AS recency
+                FROM matches m
+                JOIN dim.dim_ranks post ON post.rank_id = m.post_rank_id
+                LEFT JOIN dim.dim_ranks pre ON pre.rank_id = m.pre_rank_id
+            )
+            SELECT pr.player_id, pl.player_name, pr.played_at, pr.win, pr.pre_rank, pr.pre_ordinal,
+                   pr.post_rank, pr.post_ordinal, pr.match_delta, pr.delta_since_previous, pr.peak_ordinal_to_date,
+                   pr.peak_rank, pr.peak_ordinal, pr.peak_reached_at, pr.starting_ordinal, pr.ranked_matches, pr.recency
+            FROM progression pr
+            JOIN dim.dim_players pl ON pr.player_id = pl.player_id
+            WHERE pr.recency <= %s
+            ORDER BY pr.player_id, pr.played_at;
+        """, params + [limit])
+        rows = cur.fetchall()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error fetching rank progression for {auth.user_email}: {error}")
+        return jsonify({"error": "An error occurred while fetching rank progression."}), 500
+    finally:
+        release_db_connection(conn)
+
+    players = {}
+    for (player_id, player_name, played_at, win, pre_rank, pre_ordinal, post_rank, post_ordinal, match_delta,
+         delta_since_previous, peak_ordinal_to_date, peak_rank, peak_ordinal, peak_reached_at, starting_ordinal,
+         ranked_matches, recency) in rows:
+        player = players.setdefault(player_id, {
+            "player_id": player_id, "player_name": player_name, "ranked_matches": ranked_matches,
+            "peak": {"rank_label": peak_rank, "rank_ordinal": peak_ordinal, "reached_at": peak_reached_at.isoformat()},
+            "matches": []
+        })
+        player["matches"].append({
+            "played_at": played_at.isoformat(), "win": win,
+            "pre_match_rank": pre_rank, "pre_match_ordinal": pre_ordinal,
+            "post_match_rank": post_rank, "post_match_ordinal": post_ordinal,
+            "match_delta": match_delta, "delta_since_previous": delta_since_previous,
+            "peak_ordinal_to_date": peak_ordinal_to_date
+        })
+        if recency == 1:
+            player["current"] = {"rank_label": post_rank, "rank_ordinal": post_ordinal}
+            player["net_change"] = post_ordinal - starting_ordinal
+    return jsonify({"game_id": int(args['game_id']), "players": list(players.values())}), 200
 
 @app.route('/api/get_game_ranks/<int:game_id>', methods=['GET']) # Changed to game_id
 @requires_jwt_auth
-def get_game_ranks_by_id(game_id, user_email): # Renamed function
-    """Gets ranks for a specific game, scoped to the user."""
+@cached_response
+def get_game_ranks_by_id(game_id, auth): # Renamed function
+    """
+    Gets the ranks the user has recorded for a specific game, lowest first on the game's ladder.
+    The ladder in dim.dim_ranks is shared by everyone who plays the game, so labels only other
+    users entered are left out.
+    """
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("""
-            SELECT DISTINCT rank_value
-            FROM (
-                SELECT pre_match_rank_value AS rank_value FROM fact.fact_game_stats gs
-                JOIN dim.dim_players p ON gs.player_id = p.player_id
-                WHERE gs.game_id = %s AND gs.ranked = 1 AND gs.pre_match_rank_value IS NOT NULL
-                AND p.user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
+            SELECT r.rank_id, r.rank_label, r.rank_ordinal
+            FROM dim.dim_ranks r
+            WHERE r.game_id = %(game_id)s AND r.rank_id IN (
+                SELECT m.pre_match_rank_id FROM fact.fact_matches m
+                JOIN dim.dim_players p ON m.player_id = p.player_id
+                WHERE m.game_id = %(game_id)s AND p.user_id = %(user_id)s AND m.ranked = 1
                 UNION
-                SELECT post_match_rank_value AS rank_value FROM fact.fact_game_stats gs
-                JOIN dim.dim_players p ON gs.player_id = p.player_id
-                WHERE gs.game_id = %s AND gs.ranked = 1 AND gs.post_match_rank_value IS NOT NULL
-                AND p.user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
-            ) AS combined_ranks
-            WHERE rank_value IS NOT NULL AND rank_value != ''
-            ORDER BY rank_value;
-        """, (game_id, user_email, game_id, user_email))
-        ranks = [row[0] for row in cur.fetchall()]
-        return jsonify({"ranks": ranks}), 200
+                SELECT m.post_match_rank_id FROM fact.fact_matches m
+                JOIN dim.dim_players p ON m.player_id = p.player_id
+                WHERE m.game_id = %(game_id)s AND p.user_id = %(user_id)s AND m.ranked = 1
+            )
+            ORDER BY r.rank_ordinal, r.rank_id;
+        """, {"game_id": game_id, "user_id": auth.user_id})
+        rank_rows = cur.fetchall()
+        return jsonify({
+            "ranks": [rank_label for _, rank_label, _ in rank_rows],
+            "rank_details": [{"rank_id": rank_id, "rank_label": rank_label, "rank_ordinal": rank_ordinal}
+                             for rank_id, rank_label, rank_ordinal in rank_rows]
+        }), 200
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"Error while fetching ranks for game {game_id}: {error}")
         return jsonify({"error": "An error occurred while fetching ranks."}), 500
     finally:
         release_db_connection(conn)
 
+@app.route('/api/game_ranks/<int:game_id>/order', methods=['PUT'])
+@requires_jwt_auth
+def set_game_rank_order(game_id, auth):
+    """
+    Sets a game's rank ladder order. Body: {"ranks": [lowest, ..., highest]}; it must list every
+    existing rank label for the game and may add new ones. User must be trusted.
+    """
+    if not auth.is_trusted:
+        return jsonify({"error": "User not authorized"}), 403
+    ordered = (request.json or {}).get('ranks')
+    if not isinstance(ordered, list) or not ordered or not all(isinstance(label, str) and label for label in ordered):
+        return jsonify({"error": "'ranks' must be a non-empty list of rank labels"}), 400
+    if len(set(ordered)) != len(ordered):
+        return jsonify({"error": "'ranks' contains duplicate labels"}), 400
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM dim.dim_games WHERE game_id = %s;", (game_id,))
+        if not cur.fetchone():
+            return jsonify({"error": "Game not found."}), 404
+        rank_ids, _ = get_or_create_rank_ids(cur, game_id, ordered) # Takes LOCK dim.dim_ranks on any miss
+        cur.execute("""
+            LOCK dim.dim_ranks;
+            SELECT rank_label, MIN(rank_id), MIN(rank_ordinal) FROM dim.dim_ranks
+            WHERE game_id = %s GROUP BY rank_label;
+        """, (game_id,))
+        ranks = {label: (rank_id, ordinal) for label, rank_id, ordinal in cur.fetchall()}
+        missing = sorted(ranks.keys() - set(ordered))
+        if missing:
+            conn.rollback()
+            return jsonify({"error": "'ranks' must include every existing rank for the game", "missing": missing}), 400
+        renumber_ranks(cur, game_id, ordered, ranks)
+        conn.commit()
+        cache_rank_ids(game_id, rank_ids)
+        invalidate_game_responses(game_id)
+        return jsonify({"message": "Rank order updated.",
+                        "ranks": [{"rank_id": ranks[label][0], "rank_label": label, "rank_ordinal": ordinal}
+                                  for ordinal, label in enumerate(ordered, start=1)]}), 200
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error ordering ranks for game {game_id}: {error}"); conn.rollback()
+        return jsonify({"error": f"An internal error occurred: {str(error)}"}), 500
+    finally:
+        release_db_connection(conn)
+
 @app.route('/api/get_game_modes/<int:game_id>', methods=['GET'])
 @requires_jwt_auth
-def get_game_modes(game_id, user_email):
-    """Gets all unique game modes for a specific game, scoped to the user."""
+@cached_response
+def get_game_modes(game_id, auth):
+    """
+    Gets all unique game modes for a specific game, scoped to the user. Reads the per-player daily
+    rollup rather than dim.dim_game_modes, which is shared by every user of the game.
+    """
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("""
-            SELECT DISTINCT game_mode
-            FROM fact.fact_game_stats gs
-            JOIN dim.dim_players p ON gs.player_id = p.player_id
-            WHERE gs.game_id = %s AND p.user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
-            AND gs.game_mode IS NOT NULL AND gs.game_mode != ''
+            SELECT DISTINCT a.game_mode
+            FROM fact.agg_daily_player_game_stat a
+            JOIN dim.dim_players p ON a.player_id = p.player_id
+            WHERE a.game_id = %s AND p.user_id = %s
+            AND a.game_mode IS NOT NULL AND a.game_mode != ''
             ORDER BY game_mode;
-        """, (game_id, user_email))
+        """, (game_id, auth.user_id))
         modes = [row[0] for row in cur.fetchall()]
         return jsonify({"game_modes": modes}), 200
     except (Exception, psycopg2.DatabaseError) as error:
@@ -820,20 +3375,24 @@ def get_game_modes(game_id, user_email):
 
 @app.route('/api/get_game_stat_types/<int:game_id>', methods=['GET'])
 @requires_jwt_auth
-def get_game_stat_types(game_id, user_email):
-    """Gets all unique stat types for a specific game, scoped to the user."""
+@cached_response
+def get_game_stat_types(game_id, auth):
+    """
+    Gets all unique stat types for a specific game, scoped to the user. Reads the per-player daily
+    rollup rather than dim.dim_stat_types, which is shared by every user of the game.
+    """
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("""
-            SELECT DISTINCT gs.stat_type
-            FROM fact.fact_game_stats gs
-            JOIN dim.dim_players p ON gs.player_id = p.player_id
-            WHERE gs.game_id = %s AND p.user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
-            AND gs.stat_type IS NOT NULL AND gs.stat_type != ''
+            SELECT DISTINCT a.stat_type
+            FROM fact.agg_daily_player_game_stat a
+            JOIN dim.dim_players p ON a.player_id = p.player_id
+            WHERE a.game_id = %s AND p.user_id = %s
+            AND a.stat_type IS NOT NULL AND a.stat_type != ''
             ORDER BY stat_type;
-        """, (game_id, user_email))
+        """, (game_id, auth.user_id))
         stat_types = [row[0] for row in cur.fetchall()]
         return jsonify({"stat_types": stat_types}), 200
     except (Exception, psycopg2.DatabaseError) as error:
@@ -842,10 +3401,87 @@ def get_game_stat_types(game_id, user_email):
     finally:
         release_db_connection(conn)
 
+@app.route('/api/game_context/<int:game_id>', methods=['GET'])
+@requires_jwt_auth
+@cached_response
+def get_game_context(game_id, auth):
+    """
+    Modes, stat types and ranks for a game in one call (replaces get_game_modes, get_game_stat_types
+    and get_game_ranks on the entry form). One grouped scan of the user's rows, folded in Python.
+    Each value comes with its usage count and last use; 'recent' holds the latest match's values.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT gm.game_mode, st.stat_type, m.ranked, m.pre_match_rank_value, m.post_match_rank_value,
+                   COUNT(*), MAX(m.played_at)
+            FROM fact.fact_matches m
+            JOIN fact.fact_match_stats s ON s.match_id = m.match_id
+            JOIN dim.dim_stat_types st ON st.stat_type_id = s.stat_type_id
+            LEFT JOIN dim.dim_game_modes gm ON gm.game_mode_id = m.game_mode_id
+            JOIN dim.dim_players p ON m.player_id = p.player_id
+            WHERE m.game_id = %s AND p.user_id = %s
+            GROUP BY 1, 2, 3, 4, 5;
+        """, (game_id, auth.user_id))
+        rows = cur.fetchall()
+        cur.execute("SELECT rank_label, MIN(rank_ordinal) FROM dim.dim_ranks WHERE game_id = %s GROUP BY rank_label;", (game_id,))
+        rank_ordinals = dict(cur.fetchall())
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error fetching game context for game {game_id}: {error}")
+        return jsonify({"error": "An error occurred fetching the game context."}), 500
+    finally:
+        release_db_connection(conn)
+
+    def tally(usage, value, count, last_used):
+        if value is None or value == '': return
+        entry = usage.setdefault(value, {"count": 0, "last_used": None})
+        entry["count"] += count
+        if last_used and (entry["last_used"] is None or last_used > entry["last_used"]):
+            entry["last_used"] = last_used
+
+    modes, stat_types, ranks = {}, {}, {}
+    latest_played_at, latest_ranked_at = None, None
+    recent = {"game_mode": None, "post_match_rank_value": None, "stat_types": []}
+    for game_mode, stat_type, ranked, pre_rank, post_rank, count, last_used in rows:
+        tally(modes, game_mode, count, last_used)
+        tally(stat_types, stat_type, count, last_used)
+        if ranked == 1:
+            tally(ranks, pre_rank, count, last_used)
+            tally(ranks, post_rank, count, last_used)
+            if post_rank and last_used and (latest_ranked_at is None or last_used > latest_ranked_at):
+                latest_ranked_at, recent["post_match_rank_value"] = last_used, post_rank
+        if last_used is None: continue
+        if latest_played_at is None or last_used > latest_played_at:
+            latest_played_at = last_used
+            recent["game_mode"], recent["stat_types"] = game_mode, []
+        if last_used == latest_played_at and stat_type and stat_type not in recent["stat_types"]:
+            recent["stat_types"].append(stat_type)
+
+    def as_list(usage):
+        return [{"value": value, "count": entry["count"],
+                 "last_used": entry["last_used"].isoformat() if entry["last_used"] else None}
+                for value, entry in sorted(usage.items())]
+
+    # Ranks follow the game's ladder (lowest first); labels without an ordinal go last
+    rank_list = sorted(as_list(ranks), key=lambda entry: rank_ordinals.get(entry["value"], float("inf")))
+    for entry in rank_list:
+        entry["ordinal"] = rank_ordinals.get(entry["value"])
+
+    return jsonify({
+        "game_id": game_id,
+        "game_modes": as_list(modes),
+        "stat_types": as_list(stat_types),
+        "ranks": rank_list,
+        "recent": dict(recent, played_at=latest_played_at.isoformat() if latest_played_at else None)
+    }), 200
+
 
 @app.route('/api/get_game_franchises', methods=['GET'])
 @requires_jwt_auth
-def get_game_franchises(user_email):
+@cached_response
+def get_game_franchises(auth):
     """Gets all unique game names (franchises) the authenticated user has stats for."""
     conn = None
     try:
@@ -854,12 +3490,12 @@ def get_game_franchises(user_email):
         cur.execute("""
             SELECT DISTINCT g.game_name
             FROM dim.dim_games g
-            JOIN fact.fact_game_stats gs ON g.game_id = gs.game_id
-            JOIN dim.dim_players p ON gs.player_id = p.player_id
-            WHERE p.user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
+            JOIN fact.agg_daily_player_game_stat a ON g.game_id = a.game_id
+            JOIN dim.dim_players p ON a.player_id = p.player_id
+            WHERE p.user_id = %s
             AND g.game_name IS NOT NULL
             ORDER BY g.game_name;
-        """, (user_email,))
+        """, (auth.user_id,))
         franchises = [row[0] for row in cur.fetchall()]
         return jsonify({"game_franchises": franchises}), 200
     except (Exception, psycopg2.DatabaseError) as error:
@@ -870,7 +3506,8 @@ def get_game_franchises(user_email):
 
 @app.route('/api/get_game_installments/<path:franchise_name>', methods=['GET'])
 @requires_jwt_auth
-def get_game_installments(franchise_name, user_email):
+@cached_response
+def get_game_installments(franchise_name, auth):
     """Gets games (id, installment) for a specific franchise, scoped to the user."""
     conn = None
     try:
@@ -880,12 +3517,12 @@ def get_game_installments(franchise_name, user_email):
         cur.execute("""
             SELECT DISTINCT g.game_id, g.game_installment
             FROM dim.dim_games g
-            JOIN fact.fact_game_stats gs ON g.game_id = gs.game_id
-            JOIN dim.dim_players p ON gs.player_id = p.player_id
-            WHERE p.user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
+            JOIN fact.agg_daily_player_game_stat a ON g.game_id = a.game_id
+            JOIN dim.dim_players p ON a.player_id = p.player_id
+            WHERE p.user_id = %s
             AND g.game_name = %s
             ORDER BY g.game_installment;
-        """, (user_email, franchise_name))
+        """, (auth.user_id, franchise_name))
         
         installments = [{"game_id": row[0], "installment_name": row[1] if row[1] is not None else "(Main Game)"} for row in cur.fetchall()]
         return jsonify({"game_installments": installments}), 200
@@ -907,16 +3544,114 @@ def db_health_check():
         conn = get_db_connection()
         if conn:
             cur = conn.cursor(); cur.execute("SELECT 1;"); cur.fetchone()
-            release_db_connection(conn)
-            return jsonify({"status": "healthy", "db_connection": "successful"}), 200
+            return jsonify({"status": "healthy", "db_connection": "successful", "pool": db_pool_stats()}), 200
         else:
-            return jsonify({"status": "unhealthy", "db_connection": "failed to get from pool"}), 503
+            return jsonify({"status": "unhealthy", "db_connection": "failed to get from pool", "pool": db_pool_stats()}), 503
     except (Exception, psycopg2.DatabaseError) as e:
         print(f"DB health check failed: {e}")
         return jsonify({"status": "unhealthy", "db_connection": "failed query"}), 503
     finally:
         if conn: release_db_connection(conn)
 
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for this worker's dimension and response caches."""
+    return jsonify({"users": user_cache.stats(), "auth": auth_cache.stats(), "games": game_cache.stats(), "players": player_cache.stats(),
+                    "ranks": rank_cache.stats(), "responses": response_cache_stats()}), 200
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recomputes fact.agg_daily_player_game_stat from the fact table to repair drift."""
+    conn = get_db_connection()
+    if conn is None:
+        raise SystemExit("Could not get a database connection; check the DB_* environment variables.")
+    try:
+        rows = rebuild_daily_rollups(conn.cursor())
+        conn.commit()
+        print(f"Rebuilt daily rollups: {rows} rows.")
+    except (Exception, psycopg2.DatabaseError) as error:
+        conn.rollback()
+        raise SystemExit(f"Rollup rebuild failed: {error}")
+    finally:
+        release_db_connection(conn)
+
+@app.cli.command("backfill-ranks")
+def backfill_ranks_command():
+    """Creates dim.dim_ranks entries for stored rank labels and sets the fact rows' rank ids."""
+    conn = get_db_connection()
+    if conn is None:
+        raise SystemExit("Could not get a database connection; check the DB_* environment variables.")
+    try:
+        rows = backfill_rank_ids(conn.cursor())
+        conn.commit()
+        print(f"Set rank ids on {rows} stat rows.")
+    except (Exception, psycopg2.DatabaseError) as error:
+        conn.rollback()
+        raise SystemExit(f"Rank backfill failed: {error}")
+    finally:
+        release_db_connection(conn)
+
+@app.cli.command("migrate-matches")
+def migrate_matches_command():
+    """Moves the old per-stat fact.fact_game_stats table into fact.fact_matches / fact.fact_match_stats."""
+    conn = get_db_connection()
+    if conn is None:
+        raise SystemExit("Could not get a database connection; check the DB_* environment variables.")
+    try:
+        cur = conn.cursor()
+        if not table_exists(cur, "fact", "fact_game_stats"):
+            print("Nothing to migrate: fact.fact_game_stats does not exist.")
+            return
+        counts = migrate_legacy_game_stats(cur)
+        ranked = backfill_rank_ids(cur)
+        rollup_rows = rebuild_daily_rollups(cur)
+        conn.commit()
+        print(f"Migrated {counts['stats']} stat rows into {counts['matches']} matches "
+              f"({ranked} rank links, {rollup_rows} rollup rows). Old table kept as fact.fact_game_stats_legacy.")
+    except (Exception, psycopg2.DatabaseError) as error:
+        conn.rollback()
+        raise SystemExit(f"Match migration failed: {error}")
+    finally:
+        release_db_connection(conn)
+
+@app.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    """Connection pool, group-commit and table maintenance counters for this worker."""
+    return jsonify({"pool": db_pool_stats(), "group_commit": group_committer.stats(),
+                    "table_maintenance": table_maintenance_stats()}), 200
+
+@app.route('/queue_stats', methods=['GET'])
+def queue_stats():
+    """Write queue depth, batch sizes and flush latency for this worker's flusher."""
+    flusher = write_queue_flusher if write_queue_pid == os.getpid() else None
+    return jsonify({"enabled": bool(WRITE_QUEUE_PATH), "flusher": flusher.stats() if flusher is not None else None}), 200
+
+@app.route('/admin/slow_queries', methods=['GET', 'DELETE'])
+@requires_api_key # Normalized SQL and plans describe the schema, so keep them behind the API key
+def slow_queries():
+    """Top statements over SLOW_QUERY_THRESHOLD_MS seen by this worker; DELETE clears them."""
+    if slow_query_log is None:
+        return jsonify({"error": "Slow-query log is disabled (SLOW_QUERY_THRESHOLD_MS is negative)."}), 404
+    if request.method == 'DELETE':
+        slow_query_log.reset()
+        return jsonify({"message": "Slow-query aggregates cleared."}), 200
+    sort = request.args.get('sort', 'total_ms')
+    if sort not in ('total_ms', 'count', 'max_ms', 'avg_ms'):
+        return jsonify({"error": "sort must be one of total_ms, count, max_ms, avg_ms."}), 400
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer."}), 400
+    if not 1 <= limit <= 1000:
+        return jsonify({"error": "limit must be between 1 and 1000."}), 400
+    return jsonify({"threshold_ms": SLOW_QUERY_THRESHOLD_MS, "explain_limit": SLOW_QUERY_EXPLAIN_LIMIT,
+                    "pid": os.getpid(), "sort": sort, "statements": slow_query_log.top(limit, sort)}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """This worker's metrics in the Prometheus text exposition format."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     create_tables()
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get("PORT", 5000)))
\ No newline at end of file
@@ -47,10 +47,14 @@ if 'auth_mode' not in st.session_state:
     st.session_state.auth_mode = 'guest' # 'guest', 'prompt_login', 'logged_in'
 if 'data_cache' not in st.session_state:
     st.session_state.data_cache = {}
+if 'etag_cache' not in st.session_state:
+    st.session_state.etag_cache = {} # Last 200 response per API URL, revalidated via ETag
 if 'jwt_token' not in st.session_state:
     st.session_state.jwt_token = None
-if 'last_deleted_game_id' not in st.session_state:
-    st.session_state.last_deleted_game_id = None
+if 'orphaned_game_ids' not in st.session_state:
+    st.session_state.orphaned_game_ids = [] # Games left without stats by a delete, offered for deletion one at a time
+if 'pending_submission' not in st.session_state:
+    st.session_state.pending_submission = None # (payload hash, Idempotency-Key) of an unconfirmed add_stats submit
     
 # Set state variables for Edit/Delete tabs
 if 'player_edit_data_loaded' not in st.session_state:
@@ -85,6 +89,8 @@ if 'recent_games_df' not in st.session_state:
     st.session_state.recent_games_df = pd.DataFrame()
 if 'recent_stats_df' not in st.session_state:
     st.session_state.recent_stats_df = pd.DataFrame()
+if 'stats_next_cursor' not in st.session_state:
+    st.session_state.stats_next_cursor = None
 
 # Rank data session state
 if 'is_ranked' not in st.session_state:
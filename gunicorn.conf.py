@@ -0,0 +1,27 @@
+"""
+Gunicorn settings for the Flask backend:  gunicorn -c gunicorn.conf.py flask_app:app
+
+Each worker builds its own database pool lazily (see get_db_pool in flask_app.py), so
+preload_app is safe. Keep GUNICORN_THREADS <= DB_POOL_MAX, or requests will queue for a connection.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120)) # Bulk imports can stream for a while
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+def post_fork(server, worker):
+    # Open this worker's pool up front instead of on its first request, and start its write
+    # queue flusher so tickets queued before a restart are drained without waiting for traffic.
+    from flask_app import get_db_pool, get_write_queue
+    try:
+        get_db_pool()
+    except Exception as error:
+        worker.log.error(f"Database pool init failed in worker {worker.pid}: {error}")
+    try:
+        get_write_queue()
+    except Exception as error:
+        worker.log.error(f"Write queue init failed in worker {worker.pid}: {error}")
@@ -0,0 +1,271 @@
+"""
+Process-local metrics in the Prometheus text exposition format, served by flask_app at /metrics.
+
+Counters and histograms are sharded per thread: each gunicorn thread updates its own dict
+without taking a lock, and a scrape merges the shards. The only lock is taken once per thread
+per metric, when its shard is created, and by render(). Shards of threads that have exited are
+folded into a retired total at scrape time (and whenever the shard count doubles), since Flask's
+threaded dev server runs every request on a new thread. Every worker keeps its own registry,
+like /pool_stats, so a scrape reports the worker that answered it.
+
+InstrumentedConnection/InstrumentedCursor time every execute(), commit() and rollback() into
+vgst_db_query_seconds. The query is named after the function that issued it (e.g.
+get_or_create_game_id, refresh_daily_rollups, add_stats.write), found by walking past psycopg2's own frames,
+so call sites don't need to change. Statements over the slow-query threshold also go to
+InstrumentedCursor.slow_query_log (see slow_queries.py).
+"""
+import bisect
+import sys
+import threading
+import time
+
+import psycopg2.extensions
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in list(zip(labelnames, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _ShardedMetric:
+    """Base for metrics whose samples live in one dict per recording thread."""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = {} # thread -> the dict that thread records into
+        self._retired = {} # samples of threads that have exited
+        self._reap_at = 64
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._lock:
+                self._shards[threading.current_thread()] = shard
+                if len(self._shards) >= self._reap_at:
+                    self._reap()
+                    self._reap_at = max(64, 2 * len(self._shards))
+            self._local.shard = shard
+        return shard
+
+    def _reap(self):
+        """Folds the shards of exited threads into _retired. Caller holds _lock."""
+        for thread in [thread for thread in self._shards if not thread.is_alive()]:
+            self._merge(self._retired, self._shards.pop(thread))
+
+    def _merge(self, total, shard):
+        raise NotImplementedError
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _merged(self):
+        """Samples summed over the live shards and the retired total."""
+        merged = {}
+        with self._lock:
+            self._reap()
+            self._merge(merged, self._retired)
+            shards = list(self._shards.values())
+        for shard in shards:
+            # dict() copies in C without releasing the GIL, so a concurrent insert can't tear it.
+            self._merge(merged, dict(shard))
+        return merged
+
+class Counter(_ShardedMetric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, total, shard):
+        for key, value in shard.items():
+            total[key] = total.get(key, 0) + value
+
+    def collect(self):
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in sorted(self._merged().items())]
+
+class Histogram(_ShardedMetric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            state = shard[key] = [[0] * (len(self.buckets) + 1), 0.0, 0] # per-bucket counts (+Inf last), sum, count
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def time(self, **labels):
+        """Context manager that observes the time spent in its block."""
+        return _Timer(self, labels)
+
+    def _merge(self, total, shard):
+        for key, (counts, value_sum, count) in shard.items():
+            entry = total.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += value_sum
+            entry[2] += count
+
+    def collect(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Registry:
+    """Metrics plus collector callbacks for values read at scrape time (pool and cache state)."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect):
+        """`collect()` returns [(name, kind, documentation, [(labels dict, value), ...]), ...]."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines += [f"# HELP {metric.name} {metric.documentation}", f"# TYPE {metric.name} {metric.kind}"]
+            lines += metric.collect()
+        for collect in collectors:
+            try:
+                families = collect()
+            except Exception as error:
+                print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {error}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{format_labels(list(labels), list(labels.values()))} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "vgst_http_request_seconds", "Time to produce a response (streamed bodies: time to the first byte), by route, method and status.",
+    ("route", "method", "status"))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "vgst_db_query_seconds", "Time in cursor.execute()/executemany(), commit() and rollback(), by the function that issued it.",
+    ("query",))
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "vgst_db_pool_wait_seconds", "Time spent waiting for a pooled connection when every slot was in use.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+ROWS_INSERTED = REGISTRY.counter(
+    "vgst_rows_inserted_total", "Fact rows written by insert_stat_rows(), including rows of transactions later rolled back.",
+    ("table",))
+
+def query_name():
+    """Qualified name of the first function up the stack outside psycopg2 and this module, with
+    closures named after their enclosing function (add_stats.write, delete_player.cascade)."""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get("__name__", "").startswith(("psycopg2", __name__)):
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    # co_qualname is new in Python 3.11; older versions fall back to the bare name.
+    return getattr(frame.f_code, "co_qualname", frame.f_code.co_name).replace(".<locals>", "")
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    slow_query_log = None # A slow_queries.SlowQueryLog, set by flask_app when the slow-query log is on
+
+    def _observe(self, start, query, vars, failed):
+        elapsed = time.perf_counter() - start
+        name = query_name()
+        DB_QUERY_SECONDS.observe(elapsed, query=name)
+        slow_query_log = self.slow_query_log
+        if slow_query_log is not None and elapsed >= slow_query_log.threshold_seconds:
+            slow_query_log.record(self, query, vars, elapsed, name, failed)
+
+    def execute(self, query, vars=None):
+        start, failed = time.perf_counter(), True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            self._observe(start, query, vars, failed)
+
+    def executemany(self, query, vars_list):
+        start, failed = time.perf_counter(), True
+        try:
+            result = super().executemany(query, vars_list)
+            failed = False
+            return result
+        finally:
+            self._observe(start, query, None, failed)
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Pass as connection_factory to psycopg2.connect; its cursors are InstrumentedCursors."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = InstrumentedCursor
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, query="commit")
+
+    def rollback(self):
+        start = time.perf_counter()
+        try:
+            return super().rollback()
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, query="rollback")
@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import json
 import pandas as pd
 from datetime import datetime
 from utils import (
@@ -9,7 +10,9 @@ from utils import (
     add_stat_input, delete_stat_input, update_genre_state,
     update_guest_genre_state_callback, get_recent_stats_for_display, 
     clear_edit_cache, clear_delete_cache,
-    get_game_franchises, get_game_installments
+    get_game_franchises, get_game_installments, get_game_context,
+    load_stats_for_management, post_idempotent, submission_idempotency_key,
+    clear_submission_idempotency_key
 )
 
 # --- Page Guard ---
@@ -61,7 +64,7 @@ if st.session_state.is_trusted_user:
                 st.session_state.player_name = new_selection
                 st.session_state.player_id = player_name_to_id.get(new_selection) 
                 st.success(f"Player set to '{st.session_state.player_name}'.")
-                keys_to_remove = [k for k in st.session_state.data_cache if k.startswith(f"player_games_{st.session_state.email}") or k.startswith(f"game_ranks_{st.session_state.email}")]
+                keys_to_remove = [k for k in st.session_state.data_cache if k.startswith(f"player_games_{st.session_state.email}") or k.startswith(f"game_ranks_{st.session_state.email}") or k.startswith(f"game_context_{st.session_state.email}")]
                 for k in keys_to_remove: st.session_state.data_cache.pop(k, None)
                 st.session_state.selected_game_for_rank = None
                 st.rerun()
@@ -259,7 +262,10 @@ if st.session_state.player_name and st.session_state.is_trusted_user:
             final_game_series, final_game_genre, final_game_subgenre = None, None, None
         
         # --- Stat Type Guidance ---
+        game_context = None
         if not is_new_installment_mode and selected_game_id:
+            # One request fills the stat type, rank and game mode caches used below
+            game_context = get_game_context(selected_game_id)
             stat_types_list = get_game_stat_types(selected_game_id)
             if stat_types_list:
                 if final_game_installment:
@@ -284,10 +290,13 @@ if st.session_state.player_name and st.session_state.is_trusted_user:
                 if not ranks_list:
                     st.warning("No ranks found for this game. Please enter ranks manually.")
                     ranks_list = ["Unranked"]
-                rank_options = list(set(ranks_list)) + ["(Enter New Rank)"] # Unique ranks
+                rank_options = list(dict.fromkeys(ranks_list)) + ["(Enter New Rank)"] # Unique ranks
+                # Default the pre-match rank to where the last ranked match ended
+                last_rank = (game_context or {}).get('recent', {}).get('post_match_rank_value')
+                last_rank_index = rank_options.index(last_rank) if last_rank in rank_options else 0
                 
                  # --- Pre-match Rank ---
-                pre_rank_select = st.selectbox("Pre-match Rank (Select)", rank_options, index=0, key="pre_rank_select", help="Select pre-match rank")
+                pre_rank_select = st.selectbox("Pre-match Rank (Select)", rank_options, index=last_rank_index, key="pre_rank_select", help="Select pre-match rank")
                 pre_match_rank_text = ""
                 if pre_rank_select == "(Enter New Rank)":
                     pre_match_rank_text = st.text_input("New Pre-match Rank", value="", help="Type the new rank.")
@@ -317,7 +326,11 @@ if st.session_state.player_name and st.session_state.is_trusted_user:
             if not is_new_installment_mode and selected_game_id:
                 game_mode_list = get_game_modes(selected_game_id)
                 if game_mode_list:
-                    game_mode_select_options = list(set(game_mode_list))
+                    game_mode_select_options = list(dict.fromkeys(game_mode_list))
+                    # Most recently played mode first
+                    last_mode = (game_context or {}).get('recent', {}).get('game_mode')
+                    if last_mode in game_mode_select_options:
+                        game_mode_select_options.remove(last_mode); game_mode_select_options.insert(0, last_mode)
             
             game_mode_select = st.selectbox("Game Mode *", game_mode_select_options, index=0, key="game_mode_select_inside", help="Select existing mode.")
             new_game_mode_text = st.text_input("Game Mode (New/Override)", value="", help="Leave blank to use selection. Type a new mode here.")
@@ -374,8 +387,8 @@ if st.session_state.player_name and st.session_state.is_trusted_user:
                     auth_headers = get_auth_headers()
                     if auth_headers:
                         try:
-                            response = requests.post(f"{FLASK_API_URL}/add_stats", json=payload, headers=auth_headers)
-                            response.raise_for_status(); st.success("Stats submitted!"); st.session_state.num_stats = 1; st.session_state.data_cache.clear(); st.session_state.selected_genre = "Select a Genre"; st.session_state.selected_subgenre = "Select a Subgenre"; st.rerun()
+                            response = post_idempotent(f"{FLASK_API_URL}/add_stats", payload, auth_headers, submission_idempotency_key(payload))
+                            response.raise_for_status(); clear_submission_idempotency_key(); st.success("Stats submitted!"); st.session_state.num_stats = 1; st.session_state.data_cache.clear(); st.session_state.selected_genre = "Select a Genre"; st.session_state.selected_subgenre = "Select a Subgenre"; st.rerun()
                         except requests.exceptions.RequestException as e:
                             st.error(f"Submit error: {e}")
                             if 'response' in locals() and response is not None:
@@ -506,59 +519,58 @@ if st.session_state.player_name and st.session_state.is_trusted_user:
 
             # --- Edit Stats ---
             with edit_tabs[2]:
-                st.markdown("This editing individual stat entries (e.g., a single match).")
+                st.markdown("Edit stat entries in the table, then save them all at once. Match fields (mode, level, win, ranked, ranks) apply to every stat of that match.")
                 if st.button("Load Data for Editing", key="load_edit_data_button_stats"):
-                    st.session_state.recent_stats_df = get_recent_stats_for_display()
+                    load_stats_for_management()
                     st.session_state.stat_edit_data_loaded = True; st.session_state.stat_edit_confirmed = False; st.rerun()
                 
                 if st.session_state.stat_edit_data_loaded:
                     recent_stats_df_edit = st.session_state.recent_stats_df
                     if not recent_stats_df_edit.empty:
-                        def format_edit_text(row):
-                            text = f"({row['stat_id']}) {row['game_name']} {row['stat_type']} {row['stat_value']} by {row['player_name']} @ {row['played_at'].strftime('%y-%m-%d %H:%M')}"
-                            if row['ranked'] == 1: text += f" (R:{row.get('pre_match_rank_value','?')}-{row.get('post_match_rank_value','?')})"
-                            return text
-                        recent_stats_df_edit['display_text'] = recent_stats_df_edit.apply(format_edit_text, axis=1)
-                        selected_entry_edit_text = st.selectbox("Select entry to edit:", recent_stats_df_edit['display_text'], key="edit_select_stat", index=None)
-                        
-                        if selected_entry_edit_text:
-                            selected_row = recent_stats_df_edit[recent_stats_df_edit['display_text'] == selected_entry_edit_text].iloc[0]
-                            stat_id_to_edit = int(selected_row['stat_id']) 
-                            if not st.session_state.stat_edit_confirmed:
-                                if st.button("Confirm Edit Selection", key="confirm_edit_button_stat"): st.session_state.stat_edit_confirmed = True; st.rerun()
-                            if st.session_state.stat_edit_confirmed:
-                                st.info(f"Editing: {selected_entry_edit_text}")
-                                with st.form(key=f'edit_form_{stat_id_to_edit}'):
-                                    new_stat_type = st.text_input("Stat Type", value=selected_row.get('stat_type', ''))
-                                    new_stat_value = st.number_input("Stat Value", value=int(selected_row.get('stat_value', 0)), min_value=0, step=1)
-                                    new_game_mode = st.text_input("Game Mode", value=selected_row.get('game_mode', '') or "")
-                                    new_game_level = st.number_input("Game Level/Wave", value=int(selected_row.get('game_level', 0) or 0), min_value=0, step=1)
-                                    win_options=[None, 'Win', 'Loss']; current_win=selected_row.get('win'); default_win_idx=1 if current_win == 1 else 2 if current_win == 0 else 0
-                                    new_win_sel = st.selectbox("Win/Loss", win_options, index=default_win_idx)
-                                    win_val_edit = 1 if new_win_sel == 'Win' else 0 if new_win_sel == 'Loss' else None
-                                    new_is_ranked = st.checkbox("Ranked?", value=selected_row.get('ranked') == 1)
-                                    new_pre_rank, new_post_rank = selected_row.get('pre_match_rank_value'), selected_row.get('post_match_rank_value')
-                                    if new_is_ranked:
-                                        edit_game_id = selected_row.get('game_id'); ranks = get_game_ranks(edit_game_id) if edit_game_id else []; rank_opts = ["Unranked"] + ranks
-                                        pre_rank_val = new_pre_rank or "Unranked"; pre_idx = rank_opts.index(pre_rank_val) if pre_rank_val in rank_opts else 0
-                                        new_pre_rank = st.selectbox("Pre-match Rank", rank_opts, index=pre_idx)
-                                        post_rank_val = new_post_rank or "Unranked"; post_idx = rank_opts.index(post_rank_val) if post_rank_val in rank_opts else 0
-                                        new_post_rank = st.selectbox("Post-match Rank", rank_opts, index=post_idx)
-                                    else: new_pre_rank, new_post_rank = None, None
-                                    
-                                    submitted_edit = st.form_submit_button("Update Entry")
-                                    if submitted_edit:
-                                        payload = {"stat_type": new_stat_type, "stat_value": int(new_stat_value), "game_mode": new_game_mode or None,
-                                                   "game_level": int(new_game_level) or None, "win": win_val_edit, "ranked": 1 if new_is_ranked else 0,
-                                                   "pre_match_rank_value": new_pre_rank, "post_match_rank_value": new_post_rank}
-                                        auth_headers = get_auth_headers()
-                                        if auth_headers:
-                                            try:
-                                                response=requests.put(f"{FLASK_API_URL}/update_stats/{stat_id_to_edit}", json=payload, headers=auth_headers)
-                                                response.raise_for_status(); st.success("Entry updated!"); clear_edit_cache(); st.rerun()
-                                            except requests.exceptions.RequestException as e:
-                                                st.error(f"Update error: {e}")
-                                                # (Full error handling)
+                        editable_columns = ['stat_type', 'stat_value', 'game_mode', 'game_level', 'win', 'ranked', 'pre_match_rank_value', 'post_match_rank_value']
+                        edit_source_df = recent_stats_df_edit[['stat_id', 'game_name', 'player_name', 'played_at'] + editable_columns].copy()
+                        edited_df = st.data_editor(
+                            edit_source_df, key="edit_stats_table", hide_index=True, use_container_width=True,
+                            disabled=['stat_id', 'game_name', 'player_name', 'played_at'],
+                            column_config={
+                                "stat_value": st.column_config.NumberColumn("Stat Value", min_value=0, step=1, required=True),
+                                "game_level": st.column_config.NumberColumn("Game Level/Wave", min_value=0, step=1),
+                                "win": st.column_config.SelectboxColumn("Win (1) / Loss (0)", options=[1, 0]),
+                                "ranked": st.column_config.SelectboxColumn("Ranked", options=[1, 0]),
+                                "played_at": st.column_config.DatetimeColumn("Played At", format="YYYY-MM-DD HH:mm"),
+                            })
+                        if st.session_state.stats_next_cursor and st.button("Load older entries", key="load_more_edit_stats"):
+                            load_stats_for_management(more=True); st.rerun()
+
+                        def edit_value(value):
+                            """JSON-ready cell value: NaN/empty -> None, numpy numbers -> int."""
+                            if value is None or (not isinstance(value, str) and pd.isna(value)): return None
+                            if isinstance(value, str): return value.strip() or None
+                            return int(value)
+
+                        stat_edits = []
+                        for (_, original), (_, edited) in zip(edit_source_df.iterrows(), edited_df.iterrows()):
+                            changes = {column: edit_value(edited[column]) for column in editable_columns
+                                       if edit_value(edited[column]) != edit_value(original[column])}
+                            if changes: stat_edits.append({"stat_id": int(original['stat_id']), **changes})
+
+                        if stat_edits and st.button(f"Save {len(stat_edits)} changed entr{'y' if len(stat_edits) == 1 else 'ies'}", key="save_stat_edits"):
+                            auth_headers = get_auth_headers()
+                            if auth_headers:
+                                try:
+                                    response = requests.put(f"{FLASK_API_URL}/update_stats", json={"edits": stat_edits}, headers=auth_headers)
+                                    response.raise_for_status()
+                                    response_data = response.json()
+                                    problems = [result for result in response_data.get("results", []) if result.get("status") != "updated"]
+                                    if problems:
+                                        st.warning(response_data.get("message", "Some entries were not updated."))
+                                        for result in problems:
+                                            st.error(f"Stat {result.get('stat_id')}: {result.get('error') or result.get('status')}")
+                                    else:
+                                        st.success(response_data.get("message", "Entries updated!")); clear_edit_cache(); st.rerun()
+                                except requests.exceptions.RequestException as e:
+                                    st.error(f"Update error: {e}")
+                                    # (Full error handling)
                                     
                     else: st.info("No recent stats loaded or available for editing.")
 
@@ -598,10 +610,23 @@ if st.session_state.player_name and st.session_state.is_trusted_user:
                                     auth_headers = get_auth_headers()
                                     if auth_headers:
                                         try:
-                                            response = requests.delete(f"{FLASK_API_URL}/delete_player/{player_id_to_delete}", headers=auth_headers)
+                                            # Stats are deleted in chunks; the NDJSON stream reports each one
+                                            response = requests.delete(f"{FLASK_API_URL}/delete_player/{player_id_to_delete}",
+                                                                       headers={**auth_headers, "Accept": "application/x-ndjson"}, stream=True)
                                             response.raise_for_status()
-                                            st.success(f"Player '{selected_player_name_to_del}' and all stats deleted.")
-                                            clear_delete_cache(); st.rerun()
+                                            progress_bar = st.progress(0.0, text="Deleting stats...")
+                                            progress = {}
+                                            for line in response.iter_lines():
+                                                if not line: continue
+                                                progress = json.loads(line)
+                                                total = progress.get("matches_total") or 1
+                                                progress_bar.progress(min(progress.get("matches_deleted", 0) / total, 1.0),
+                                                                      text=f"Deleted {progress.get('matches_deleted', 0)} of {progress.get('matches_total', 0)} matches")
+                                            if not progress.get("done"):
+                                                st.error(f"Error deleting player: {progress.get('error', 'incomplete response')}. Run the delete again to finish.")
+                                            else:
+                                                st.success(f"Player '{selected_player_name_to_del}' and all stats deleted.")
+                                                clear_delete_cache(); st.rerun()
                                         except requests.exceptions.RequestException as e:
                                             st.error(f"Error deleting player: {e}")
                                             # (Full error handling)
@@ -650,33 +675,33 @@ if st.session_state.player_name and st.session_state.is_trusted_user:
             
             # --- Delete Stat ---
             with delete_tabs[2]:
-                st.markdown("This is for deleting individual stat entries (e.g., a single match).")
+                st.markdown("This is for deleting individual stat entries (e.g., a single match). Select several to delete them together.")
                 if st.button("Load Data for Deletion", key="load_delete_data_button_stat"):
-                    st.session_state.recent_stats_df = get_recent_stats_for_display()
+                    load_stats_for_management()
                     st.session_state.stat_delete_data_loaded = True; st.session_state.stat_delete_confirmed = False; st.rerun()
                 
-                if st.session_state.get('last_deleted_game_id'):
-                    st.warning(f"You deleted the last stat for Game ID {st.session_state.last_deleted_game_id}. Do you want to delete the game entry itself?")
+                if st.session_state.get('orphaned_game_ids'):
+                    game_id_to_del = st.session_state.orphaned_game_ids[0]
+                    st.warning(f"You deleted the last stat for Game ID {game_id_to_del}. Do you want to delete the game entry itself?")
                     col1, col2 = st.columns(2)
                     with col1:
                         if st.button("Yes, Delete Game Entry Now", key="prompt_delete_game", use_container_width=True):
                             auth_headers = get_auth_headers()
                             if auth_headers:
                                 try:
-                                    game_id_to_del = st.session_state.last_deleted_game_id
                                     response = requests.delete(f"{FLASK_API_URL}/delete_game/{game_id_to_del}", headers=auth_headers)
                                     response.raise_for_status()
                                     st.success(f"Game ID {game_id_to_del} successfully deleted.")
-                                    st.session_state.last_deleted_game_id = None
-                                    clear_delete_cache(); st.rerun()
+                                    remaining_game_ids = st.session_state.orphaned_game_ids[1:]
+                                    clear_delete_cache(); st.session_state.orphaned_game_ids = remaining_game_ids; st.rerun()
                                 except requests.exceptions.RequestException as e:
                                     st.error(f"Error deleting game: {e}")
                                     if 'response' in locals() and response is not None and response.status_code == 409:
                                         st.error(f"Delete failed: {response.json().get('error')}")
-                            st.session_state.last_deleted_game_id = None
+                            st.session_state.orphaned_game_ids = st.session_state.orphaned_game_ids[1:]
                     with col2:
                         if st.button("No, Keep Game Entry", key="prompt_keep_game", use_container_width=True):
-                            st.session_state.last_deleted_game_id = None
+                            st.session_state.orphaned_game_ids = st.session_state.orphaned_game_ids[1:]
                             st.rerun()
 
 
@@ -688,29 +713,32 @@ if st.session_state.player_name and st.session_state.is_trusted_user:
                             if row['ranked'] == 1: text += f" (R:{row.get('pre_match_rank_value','?')}-{row.get('post_match_rank_value','?')})"
                             return text
                         recent_stats_df_del['display_text'] = recent_stats_df_del.apply(format_del_text, axis=1)
-                        selected_entry_del = st.selectbox("Select entry to delete:", recent_stats_df_del['display_text'], key="del_select_stat", index=None)
+                        selected_entries_del = st.multiselect("Select entries to delete:", recent_stats_df_del['display_text'], key="del_select_stat")
+                        if st.session_state.stats_next_cursor and st.button("Load older entries", key="load_more_delete_stats"):
+                            load_stats_for_management(more=True); st.rerun()
 
-                        if selected_entry_del:
-                            selected_row_del = recent_stats_df_del[recent_stats_df_del['display_text'] == selected_entry_del].iloc[0]
-                            stat_id_to_delete = int(selected_row_del['stat_id'])
+                        if selected_entries_del:
+                            selected_rows_del = recent_stats_df_del[recent_stats_df_del['display_text'].isin(selected_entries_del)]
+                            stat_ids_to_delete = [int(stat_id) for stat_id in selected_rows_del['stat_id']]
                             
                             if not st.session_state.stat_delete_confirmed:
                                 if st.button("Confirm Delete Selection", key="confirm_delete_button_stat"): st.session_state.stat_delete_confirmed = True; st.rerun()
                             if st.session_state.stat_delete_confirmed:
-                                st.warning(f"DELETE entry?\n'{selected_entry_del}'")
+                                st.warning(f"DELETE {len(stat_ids_to_delete)} entr{'y' if len(stat_ids_to_delete) == 1 else 'ies'}?\n" + "\n".join(f"'{entry}'" for entry in selected_entries_del))
                                 if st.button("DELETE FOREVER", key="final_delete_button_stat"):
                                     auth_headers = get_auth_headers()
                                     if auth_headers:
                                         try:
-                                            response = requests.delete(f"{FLASK_API_URL}/delete_stats/{stat_id_to_delete}", headers=auth_headers)
+                                            response = requests.delete(f"{FLASK_API_URL}/delete_stats", headers=auth_headers, json={"stat_ids": stat_ids_to_delete})
                                             response.raise_for_status()
                                             response_data = response.json()
-                                            st.success("Entry deleted!")
-                                            
-                                            if response_data.get("last_stat_deleted") == True:
-                                                st.session_state.last_deleted_game_id = response_data.get("game_id")
+                                            st.success(response_data.get("message", "Entries deleted!"))
+                                            if response_data.get("not_found"):
+                                                st.warning(f"Not found or not yours: {response_data['not_found']}")
                                             
-                                            clear_delete_cache(); st.rerun()
+                                            clear_delete_cache()
+                                            st.session_state.orphaned_game_ids = response_data.get("orphaned_game_ids", [])
+                                            st.rerun()
                                         except requests.exceptions.RequestException as e:
                                             st.error(f"Delete error: {e}")
                                             # (Full error handling)
@@ -0,0 +1,195 @@
+"""
+Slow-query log for statements run through metrics.InstrumentedCursor.
+
+Any statement slower than the threshold is written as a JSON line to a rotating local log (one
+file per process, named after its pid) with its normalized SQL (literals and placeholders
+replaced by ?, IN lists and repeated UNION ALL / VALUES rows collapsed), the shape of its parameters (types only, never values), duration,
+row count and the function that issued it. Statements are aggregated by normalized SQL for
+top-N reports, and the first `explain_limit` occurrences of each single SELECT/INSERT/UPDATE/
+DELETE get an EXPLAIN, run on a background thread over its own connection so the request
+isn't slowed down and its transaction can't be aborted by a failing EXPLAIN.
+"""
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+
+PLACEHOLDER = r"%\(\w+\)s|%s" # psycopg2 placeholders
+VALUES_ROW = r"\((?:[^()]|\([^()]*\))*\)" # (?, ?, GETDATE())
+EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+NORMALIZE_RULES = (
+    (re.compile(r"--[^\n]*"), " "),                                      # line comments
+    (re.compile(r"/\*.*?\*/", re.DOTALL), " "),                          # block comments
+    (re.compile(r"'(?:[^']|'')*'"), "?"),                                # string literals
+    (re.compile(PLACEHOLDER), "?"),
+    (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])"), "?"),            # numeric literals
+    (re.compile(r"\bCAST\(NULL\b", re.IGNORECASE), "CAST(?"),              # NULL values in mogrified rows
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"\bIN \((?:\?, )*\?\)", re.IGNORECASE), "IN (...)"),
+    (re.compile(rf"\bVALUES {VALUES_ROW}(?:, ?{VALUES_ROW})+", re.IGNORECASE), "VALUES (...), ..."),
+)
+
+def fold_union_all(query):
+    """Folds one run of identical rows (SELECT ?, ? UNION ALL SELECT ?, ? ...), as built by
+    insert_stat_rows and get_or_create_label_ids, so 2 and 200 rows normalize the same way."""
+    parts = query.split(" UNION ALL ")
+    start = parts[0].rfind("SELECT ")
+    if len(parts) < 2 or start < 0:
+        return query
+    row = parts[0][start:]
+    if not all(part == row for part in parts[1:-1]) or not parts[-1].startswith(row):
+        return query
+    return parts[0] + " UNION ALL ..." + parts[-1][len(row):]
+
+def normalize_sql(query):
+    """SQL with literals replaced by ?, whitespace collapsed and repeated row lists folded."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    for pattern, replacement in NORMALIZE_RULES:
+        query = pattern.sub(replacement, query)
+    return fold_union_all(query).strip()
+
+def params_shape(params):
+    """Types of the parameters (e.g. ["int", "tuple[3]"] or {"game_id": "int"}), never their values."""
+    def shape(value):
+        if isinstance(value, (tuple, list)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: shape(value) for key, value in params.items()}
+    if isinstance(params, (tuple, list)):
+        return [shape(value) for value in params]
+    return shape(params)
+
+class SlowQueryLog:
+    """Records slow statements; `connect` opens the EXPLAIN worker's own connection."""
+
+    def __init__(self, threshold_seconds, log_path, connect, explain_limit=3, max_bytes=10 * 1024 * 1024,
+                 backup_count=5, max_statements=1000):
+        self.threshold_seconds = threshold_seconds
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.explain_limit = explain_limit
+        self.max_statements = max_statements
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._statements = OrderedDict() # fingerprint -> aggregate, least recently seen first
+        self._explains = queue.Queue(maxsize=100)
+        self._explain_thread = None
+        self._explain_pid = None
+        self._handler = None
+        self._handler_pid = None
+
+    def _write(self, entry):
+        """Appends one JSON line to this process's log file, <log_path stem>.<pid><ext>."""
+        pid = os.getpid()
+        if self._handler_pid != pid:
+            with self._lock:
+                if self._handler_pid != pid:
+                    # RotatingFileHandler can't be shared between processes (gunicorn workers forked
+                    # from a preloaded app would rotate each other's files), so each process gets its own.
+                    stem, ext = os.path.splitext(self.log_path)
+                    os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+                    self._handler = logging.handlers.RotatingFileHandler(
+                        f"{stem}.{pid}{ext}", maxBytes=self.max_bytes, backupCount=self.backup_count, delay=True)
+                    self._handler_pid = pid
+        self._handler.handle(logging.makeLogRecord({"msg": json.dumps(entry), "levelno": logging.INFO, "levelname": "INFO"}))
+
+    def record(self, cursor, query, params, seconds, name, failed=False):
+        """Called by InstrumentedCursor for statements at or over the threshold."""
+        try:
+            if isinstance(query, bytes):
+                query = query.decode("utf-8", "replace")
+            normalized = normalize_sql(query)
+            fingerprint = hashlib.md5(normalized.encode()).hexdigest()[:16]
+            rows = cursor.rowcount
+            explain_sql = None
+            with self._lock:
+                statement = self._statements.pop(fingerprint, None) or {
+                    "fingerprint": fingerprint, "query_name": name, "normalized_sql": normalized, "params_shape": params_shape(params),
+                    "count": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0, "rows_total": 0,
+                    "first_seen": time.time(), "explains_requested": 0, "explain": None,
+                }
+                self._statements[fingerprint] = statement
+                statement["count"] += 1
+                statement["failures"] += 1 if failed else 0
+                statement["total_ms"] += seconds * 1000
+                statement["max_ms"] = max(statement["max_ms"], seconds * 1000)
+                statement["rows_total"] += max(rows, 0)
+                statement["last_seen"] = time.time()
+                # executemany() passes no params, and its placeholders can't be filled in for an EXPLAIN.
+                if (not failed and statement["explains_requested"] < self.explain_limit
+                        and EXPLAINABLE.match(normalized) and ";" not in normalized.rstrip("; ")
+                        and not (params is None and re.search(PLACEHOLDER, query))):
+                    statement["explains_requested"] += 1
+                    explain_sql = cursor.mogrify(query, params)
+                while len(self._statements) > self.max_statements:
+                    self._statements.popitem(last=False)
+            self._write({
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid(), "fingerprint": fingerprint, "query_name": name,
+                "duration_ms": round(seconds * 1000, 2), "rows": rows, "failed": failed,
+                "params_shape": params_shape(params), "normalized_sql": normalized,
+            })
+            if explain_sql is not None:
+                self._queue_explain(fingerprint, explain_sql)
+        except Exception as error:
+            # Never let the log break the query it is observing.
+            print(f"Slow query log error: {error}")
+
+    def _queue_explain(self, fingerprint, sql):
+        if self._explain_thread is None or self._explain_pid != os.getpid() or not self._explain_thread.is_alive():
+            with self._lock:
+                if self._explain_thread is None or self._explain_pid != os.getpid() or not self._explain_thread.is_alive():
+                    self._explain_thread = threading.Thread(target=self._run_explains, name="slow-query-explain", daemon=True)
+                    self._explain_pid = os.getpid()
+                    self._explain_thread.start()
+        try:
+            self._explains.put_nowait((fingerprint, sql))
+        except queue.Full:
+            pass
+
+    def _run_explains(self):
+        conn = None
+        while True:
+            fingerprint, sql = self._explains.get()
+            try:
+                if conn is None or conn.closed:
+                    conn = self._connect()
+                cur = conn.cursor()
+                cur.execute(b"EXPLAIN " + sql)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+                conn.rollback()
+            except Exception as error:
+                # Temp tables and objects created earlier in the request's transaction aren't visible here.
+                plan = f"EXPLAIN failed: {error}".strip()
+                if conn is not None and not conn.closed:
+                    try: conn.rollback()
+                    except Exception: conn = None
+            with self._lock:
+                statement = self._statements.get(fingerprint)
+                if statement is not None and (statement["explain"] is None or statement["explain"].startswith("EXPLAIN failed")):
+                    statement["explain"] = plan
+            self._write({"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid(), "fingerprint": fingerprint, "explain": plan})
+
+    def top(self, limit=20, sort="total_ms"):
+        """The `limit` statements with the highest `sort` (total_ms, count, max_ms or avg_ms)."""
+        with self._lock:
+            statements = [dict(statement) for statement in self._statements.values()]
+        for statement in statements:
+            statement["avg_ms"] = round(statement["total_ms"] / statement["count"], 2)
+            statement["total_ms"] = round(statement["total_ms"], 2)
+            statement["max_ms"] = round(statement["max_ms"], 2)
+        return sorted(statements, key=lambda statement: statement[sort], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
@@ -1,5 +1,10 @@
 import streamlit as st
 import requests
+import hashlib
+import json
+import time
+import uuid
+from urllib.parse import urlencode
 import pandas as pd
 from datetime import datetime
 from sqlalchemy import create_engine
@@ -124,7 +129,61 @@ def get_auth_headers():
         # print("get_auth_headers: No valid JWT token found or user not trusted.") # Debug
         return None
 
+def submission_idempotency_key(payload):
+    """
+    Idempotency-Key for submitting `payload`. The same payload keeps its key until
+    clear_submission_idempotency_key() is called after a success, so pressing Submit again
+    after an error can't store the match twice.
+    """
+    payload_hash = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    pending = st.session_state.get('pending_submission')
+    if not pending or pending[0] != payload_hash:
+        pending = st.session_state.pending_submission = (payload_hash, uuid.uuid4().hex)
+    return pending[1]
+
+def clear_submission_idempotency_key():
+    st.session_state.pending_submission = None
+
+def post_idempotent(url, payload, headers, idempotency_key, attempts=3, timeout=30):
+    """
+    POSTs with an Idempotency-Key, retrying connection errors, timeouts, 409 (first attempt still
+    running) and 5xx with exponential backoff. The backend replays the first successful response
+    for a repeated key, so a retry after a lost response can't store the data twice.
+    Returns the last response; re-raises the last connection error if no attempt got one.
+    """
+    request_headers = {**headers, "Idempotency-Key": idempotency_key}
+    for attempt in range(attempts):
+        try:
+            response = requests.post(url, json=payload, headers=request_headers, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            print(f"POST {url} attempt {attempt + 1} failed: {e}")
+            if attempt == attempts - 1: raise
+        else:
+            if response.status_code < 500 and response.status_code != 409 or attempt == attempts - 1:
+                return response
+            print(f"POST {url} attempt {attempt + 1} returned {response.status_code}")
+        time.sleep(0.5 * 2 ** attempt)
+
 # --- Data fetching functions with caching ---
+def conditional_get(url, headers):
+    """
+    GET that revalidates with the backend's ETag. The last 200 response per user+URL is kept in
+    st.session_state.etag_cache; on a 304 that stored response is returned instead, so callers
+    can treat it exactly like a fresh 200.
+    """
+    if 'etag_cache' not in st.session_state: st.session_state.etag_cache = {}
+    cache_key = f"{st.session_state.email}:{url}"
+    cached_response = st.session_state.etag_cache.get(cache_key)
+    request_headers = dict(headers)
+    if cached_response is not None:
+        request_headers['If-None-Match'] = cached_response.headers['ETag']
+    response = requests.get(url, headers=request_headers)
+    if response.status_code == 304 and cached_response is not None:
+        return cached_response
+    if response.status_code == 200 and response.headers.get('ETag'):
+        st.session_state.etag_cache[cache_key] = response
+    return response
+
 def get_all_players():
     """Fetches players (id, name) for the ldeleting individual stat entries (e.g., a single match).deleting individual stat entries (e.g., a single match).ogged-in user."""
     if not st.session_state.is_trusted_user: return []
@@ -133,7 +192,7 @@ def get_all_players():
     auth_headers = get_auth_headers()
     if not auth_headers: st.error("Auth token missing for players."); return []
     try:
-        response = requests.get(f"{FLASK_API_URL}/get_players", headers=auth_headers)
+        response = conditional_get(f"{FLASK_API_URL}/get_players", auth_headers)
         if response.status_code == 401: st.error("Auth failed (players)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return []
         response.raise_for_status(); players = response.json().get('players', []); st.session_state.data_cache[cache_key] = players; return players
     except requests.exceptions.RequestException as e: st.error(f"Error fetching players: {e}"); return []
@@ -146,7 +205,7 @@ def get_all_games():
     auth_headers = get_auth_headers()
     if not auth_headers: st.error("Auth token missing for games list."); return []
     try:
-        response = requests.get(f"{FLASK_API_URL}/get_games", headers=auth_headers)
+        response = conditional_get(f"{FLASK_API_URL}/get_games", auth_headers)
         if response.status_code == 401: st.error("Auth failed (games list)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return []
         response.raise_for_status(); games = response.json().get('games', []); st.session_state.data_cache[cache_key] = games; return games
     except requests.exceptions.RequestException as e: st.error(f"Error fetching games list: {e}"); return []
@@ -159,7 +218,7 @@ def get_game_details(game_id):
     auth_headers = get_auth_headers()
     if not auth_headers: st.error("Auth token missing for game details."); return None
     try:
-        response = requests.get(f"{FLASK_API_URL}/get_game_details/{game_id}", headers=auth_headers)
+        response = conditional_get(f"{FLASK_API_URL}/get_game_details/{game_id}", auth_headers)
         if response.status_code == 401: st.error("Auth failed (game details)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return None
         response.raise_for_status(); details = response.json(); st.session_state.data_cache[cache_key] = details; return details
     except requests.exceptions.RequestException as e: st.error(f"Error fetching game details for {game_id}: {e}"); return None
@@ -171,7 +230,7 @@ def get_game_ranks(game_id):
     auth_headers = get_auth_headers()
     if not auth_headers: st.error("Auth token missing for ranks."); return []
     try:
-        response = requests.get(f"{FLASK_API_URL}/get_game_ranks/{game_id}", headers=auth_headers)
+        response = conditional_get(f"{FLASK_API_URL}/get_game_ranks/{game_id}", auth_headers)
         if response.status_code == 401: st.error("Auth failed (ranks)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return []
         response.raise_for_status(); ranks = response.json().get('ranks', []); st.session_state.data_cache[cache_key] = ranks; return ranks
     except requests.exceptions.RequestException as e: st.error(f"Error fetching ranks for game {game_id}: {e}"); return []
@@ -186,7 +245,7 @@ def get_game_modes(game_id):
     auth_headers = get_auth_headers()
     if not auth_headers: st.error("Auth token missing for game modes."); return []
     try:
-        response = requests.get(f"{FLASK_API_URL}/get_game_modes/{game_id}", headers=auth_headers)
+        response = conditional_get(f"{FLASK_API_URL}/get_game_modes/{game_id}", auth_headers)
         if response.status_code == 401: st.error("Auth failed (game modes)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return []
         response.raise_for_status()
         modes = response.json().get('game_modes', [])
@@ -205,7 +264,7 @@ def get_game_stat_types(game_id):
     auth_headers = get_auth_headers()
     if not auth_headers: st.error("Auth token missing for stat types."); return []
     try:
-        response = requests.get(f"{FLASK_API_URL}/get_game_stat_types/{game_id}", headers=auth_headers)
+        response = conditional_get(f"{FLASK_API_URL}/get_game_stat_types/{game_id}", auth_headers)
         if response.status_code == 401: st.error("Auth failed (stat types)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return []
         response.raise_for_status()
         stat_types = response.json().get('stat_types', [])
@@ -214,6 +273,32 @@ def get_game_stat_types(game_id):
     except requests.exceptions.RequestException as e: 
         st.error(f"Error fetching stat types for game {game_id}: {e}"); return []
 
+def get_game_context(game_id):
+    """
+    Fetches modes, stat types and ranks for a game in one request and fills the
+    get_game_modes / get_game_stat_types / get_game_ranks cache entries with it.
+    Returns the full context (values with usage counts and the most recent match).
+    """
+    if not st.session_state.is_trusted_user or not game_id: return None
+    cache_key = f"game_context_{st.session_state.email}_{game_id}"
+    if cache_key in st.session_state.data_cache: return st.session_state.data_cache[cache_key]
+
+    auth_headers = get_auth_headers()
+    if not auth_headers: st.error("Auth token missing for game context."); return None
+    try:
+        response = conditional_get(f"{FLASK_API_URL}/game_context/{game_id}", auth_headers)
+        if response.status_code == 401: st.error("Auth failed (game context)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return None
+        response.raise_for_status()
+        context = response.json()
+        email = st.session_state.email
+        st.session_state.data_cache[f"game_modes_{email}_{game_id}"] = [m['value'] for m in context.get('game_modes', [])]
+        st.session_state.data_cache[f"game_stat_types_{email}_{game_id}"] = [s['value'] for s in context.get('stat_types', [])]
+        st.session_state.data_cache[f"game_ranks_{email}_{game_id}"] = [r['value'] for r in context.get('ranks', [])]
+        st.session_state.data_cache[cache_key] = context
+        return context
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error fetching game context for game {game_id}: {e}"); return None
+
 def get_game_franchises():
     """Fetches all unique game franchises associated with the logged-in user."""
     if not st.session_state.auth_mode == 'logged_in': return []
@@ -223,7 +308,7 @@ def get_game_franchises():
     auth_headers = get_auth_headers()
     if not auth_headers: st.error("Auth token missing for game franchises."); return []
     try:
-        response = requests.get(f"{FLASK_API_URL}/get_game_franchises", headers=auth_headers)
+        response = conditional_get(f"{FLASK_API_URL}/get_game_franchises", auth_headers)
         if response.status_code == 401: st.error("Auth failed (game franchises)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return []
         response.raise_for_status()
         franchises = response.json().get('game_franchises', [])
@@ -242,7 +327,7 @@ def get_game_installments(franchise_name):
     try:
         # URL encode the franchise name in case it has spaces or special chars
         encoded_franchise_name = requests.utils.quote(franchise_name)
-        response = requests.get(f"{FLASK_API_URL}/get_game_installments/{encoded_franchise_name}", headers=auth_headers)
+        response = conditional_get(f"{FLASK_API_URL}/get_game_installments/{encoded_franchise_name}", auth_headers)
         if response.status_code == 401: st.error("Auth failed (game installments)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return []
         response.raise_for_status()
         games = response.json().get('game_installments', [])
@@ -250,6 +335,37 @@ def get_game_installments(franchise_name):
     except requests.exceptions.RequestException as e: 
         st.error(f"Error fetching game installments for {franchise_name}: {e}"); return []
         
+def get_stats_page(cursor=None, limit=50, **filters):
+    """
+    Fetches one page of the user's stat entries (newest first) from /api/stats.
+    Filters: game_id, player_id, game_mode, stat_type, ranked, win, from, to.
+    Returns (DataFrame, next_cursor); next_cursor is None on the last page.
+    """
+    if not st.session_state.is_trusted_user: return pd.DataFrame(), None
+    auth_headers = get_auth_headers()
+    if not auth_headers: st.error("Auth token missing for stats."); return pd.DataFrame(), None
+    params = {k: v for k, v in filters.items() if v is not None}
+    params['limit'] = limit
+    if cursor: params['cursor'] = cursor
+    try:
+        response = conditional_get(f"{FLASK_API_URL}/stats?{urlencode(params)}", auth_headers)
+        if response.status_code == 401: st.error("Auth failed (stats)."); st.session_state.jwt_token = None; st.session_state.auth_mode = 'guest'; st.rerun(); return pd.DataFrame(), None
+        response.raise_for_status()
+        page = response.json()
+        df = pd.DataFrame(page.get('stats', []))
+        if not df.empty: df['played_at'] = pd.to_datetime(df['played_at'])
+        return df, page.get('next_cursor')
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error fetching stats: {e}"); return pd.DataFrame(), None
+
+def load_stats_for_management(more=False):
+    """Loads the first page of stats into st.session_state.recent_stats_df, or appends the next one."""
+    cursor = st.session_state.stats_next_cursor if more else None
+    if more and not cursor: return
+    df, st.session_state.stats_next_cursor = get_stats_page(cursor=cursor)
+    if more: df = pd.concat([st.session_state.recent_stats_df, df], ignore_index=True)
+    st.session_state.recent_stats_df = df
+
 # --- Database Read Functions (Direct Connection - TRUSTED USERS ONLY) ---
 def get_db_conn_read_only():
     if not st.session_state.is_trusted_user:
@@ -271,16 +387,27 @@ def get_recent_stats_for_display(limit=50):
     if not conn: return pd.DataFrame()
     try:
         query = """
+            WITH recent_matches AS (
+                SELECT t1.match_id, t1.game_id, t1.player_id, t1.played_at, t1.ranked, t1.pre_match_rank_value,
+                       t1.post_match_rank_value, t1.game_mode_id, t1.game_level, t1.win
+                FROM fact.fact_matches t1
+                JOIN dim.dim_players t3 ON t1.player_id = t3.player_id
+                WHERE t3.user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
+                ORDER BY t1.played_at DESC LIMIT %s
+            )
             SELECT
-                t1.stat_id, t2.game_name, t3.player_name, t1.stat_type, t1.stat_value, t1.played_at,
-                t1.ranked, t1.pre_match_rank_value, t1.post_match_rank_value, t1.game_mode, t1.game_level, t1.win
-            FROM fact.fact_game_stats t1
-            JOIN dim.dim_games t2 ON t1.game_id = t2.game_id
-            JOIN dim.dim_players t3 ON t1.player_id = t3.player_id
-            WHERE t3.user_id = (SELECT user_id FROM dim.dim_users WHERE user_email = %s)
-            ORDER BY t1.played_at DESC LIMIT %s;
+                s.stat_id, t2.game_name, t3.player_name, t4.stat_type, s.stat_value, m.played_at,
+                m.ranked, m.pre_match_rank_value, m.post_match_rank_value, t5.game_mode, m.game_level, m.win
+            FROM recent_matches m
+            JOIN fact.fact_match_stats s ON s.match_id = m.match_id
+            JOIN dim.dim_stat_types t4 ON s.stat_type_id = t4.stat_type_id
+            LEFT JOIN dim.dim_game_modes t5 ON m.game_mode_id = t5.game_mode_id
+            JOIN dim.dim_games t2 ON m.game_id = t2.game_id
+            JOIN dim.dim_players t3 ON m.player_id = t3.player_id
+            ORDER BY m.played_at DESC, s.stat_id DESC LIMIT %s;
         """
-        params = (st.session_state.email, limit)
+        # Only the newest `limit` matches can hold the newest `limit` stat rows
+        params = (st.session_state.email, limit, limit)
         df = pd.read_sql_query(query, conn, params=params)
         return df
     except Exception as e:
@@ -329,4 +456,4 @@ def clear_delete_cache():
     st.session_state.player_delete_confirmed = False
     st.session_state.game_delete_data_loaded = False
     st.session_state.game_delete_confirmed = False
-    st.session_state.last_deleted_game_id = None
\ No newline at end of file
+    st.session_state.orphaned_game_ids = []
\ No newline at end of file
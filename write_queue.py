@@ -0,0 +1,283 @@
+"""
+Durable write-behind queue for /api/add_stats requests sent with `Prefer: respond-async`.
+
+The endpoint validates the payload, appends it to a SQLite database in WAL mode and answers
+202 with a ticket id. A QueueFlusher thread in each worker drains the queue in batches through
+a flush callback (flask_app.flush_queued_matches) that writes a whole batch in one Redshift
+transaction, so many requests share one commit. Failed tickets are retried with exponential
+backoff until max_attempts, then marked failed.
+
+Workers on the same host share the file; batches are claimed inside BEGIN IMMEDIATE, so two
+flushers never take the same ticket, and a batch whose flusher died is reclaimed after
+lease_seconds. The queue is local to the host: poll a ticket on the host that issued it.
+"""
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+import uuid
+from collections import deque
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tickets (
+        ticket_id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        idempotency_key TEXT,
+        request_hash TEXT,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,               -- queued, flushing, done, failed
+        attempts INTEGER NOT NULL DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        enqueued_at REAL NOT NULL,
+        next_attempt_at REAL NOT NULL,
+        claimed_at REAL,
+        completed_at REAL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS tickets_idempotency_key ON tickets (user_id, idempotency_key)
+        WHERE idempotency_key IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS tickets_ready ON tickets (status, next_attempt_at);
+"""
+
+class QueueKeyReused(Exception):
+    """The Idempotency-Key was already used to enqueue a different request."""
+
+class WriteQueue:
+    """SQLite-backed ticket queue. Safe to share between threads and between processes on one host."""
+
+    def __init__(self, path, lease_seconds=300, retention_seconds=7 * 86400):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+
+    def _conn(self):
+        """One connection per thread (sqlite3 connections can't be shared across threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE.
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=FULL;") # fsync every commit: an acknowledged ticket survives a crash
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, work):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            result = work(conn)
+            conn.execute("COMMIT;")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK;")
+            raise
+
+    def enqueue(self, user_id, payload, idempotency_key=None, request_hash=None):
+        """
+        Appends a request and returns (ticket, created). With an idempotency_key, a repeated
+        request returns its existing ticket (created=False); a different request under the same
+        key raises QueueKeyReused.
+        """
+        def work(conn):
+            if idempotency_key is not None:
+                row = conn.execute("SELECT * FROM tickets WHERE user_id = ? AND idempotency_key = ?;",
+                                   (user_id, idempotency_key)).fetchone()
+                if row is not None:
+                    if row["request_hash"] != request_hash:
+                        raise QueueKeyReused("Idempotency-Key was already used for a different request")
+                    return self._ticket(row), False
+            now = time.time()
+            ticket_id = uuid.uuid4().hex
+            conn.execute("""
+                INSERT INTO tickets (ticket_id, user_id, idempotency_key, request_hash, payload, status, enqueued_at, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?, 'queued', ?, ?);
+            """, (ticket_id, user_id, idempotency_key, request_hash, json.dumps(payload), now, now))
+            return self._ticket(conn.execute("SELECT * FROM tickets WHERE ticket_id = ?;", (ticket_id,)).fetchone()), True
+        return self._transaction(work)
+
+    def claim_batch(self, max_size):
+        """Marks up to max_size ready tickets (oldest first) as flushing and returns them with their payloads."""
+        def work(conn):
+            now = time.time()
+            rows = conn.execute("""
+                SELECT * FROM tickets
+                WHERE (status = 'queued' AND next_attempt_at <= ?) OR (status = 'flushing' AND claimed_at < ?)
+                ORDER BY enqueued_at LIMIT ?;
+            """, (now, now - self.lease_seconds, max_size)).fetchall()
+            conn.executemany("UPDATE tickets SET status = 'flushing', claimed_at = ? WHERE ticket_id = ?;",
+                             [(now, row["ticket_id"]) for row in rows])
+            return [dict(self._ticket(row), payload=json.loads(row["payload"])) for row in rows]
+        return self._transaction(work)
+
+    def complete(self, results):
+        """Marks tickets done. `results` maps ticket_id -> result (JSON-serializable)."""
+        now = time.time()
+        self._transaction(lambda conn: conn.executemany("""
+            UPDATE tickets SET status = 'done', result = ?, error = NULL, completed_at = ? WHERE ticket_id = ?;
+        """, [(json.dumps(result), now, ticket_id) for ticket_id, result in results.items()]))
+
+    def retry(self, errors, max_attempts, backoff_base, backoff_max):
+        """
+        Requeues tickets with exponential backoff, or marks them failed once they have had
+        max_attempts. `errors` maps ticket_id -> error message. Returns the ids marked failed.
+        """
+        def work(conn):
+            now, failed = time.time(), []
+            for ticket_id, error in errors.items():
+                row = conn.execute("SELECT attempts FROM tickets WHERE ticket_id = ?;", (ticket_id,)).fetchone()
+                attempts = row["attempts"] + 1
+                if attempts >= max_attempts:
+                    failed.append(ticket_id)
+                    conn.execute("""
+                        UPDATE tickets SET status = 'failed', attempts = ?, error = ?, completed_at = ? WHERE ticket_id = ?;
+                    """, (attempts, error, now, ticket_id))
+                else:
+                    delay = min(backoff_max, backoff_base * 2 ** (attempts - 1))
+                    conn.execute("""
+                        UPDATE tickets SET status = 'queued', attempts = ?, error = ?, next_attempt_at = ? WHERE ticket_id = ?;
+                    """, (attempts, error, now + delay, ticket_id))
+            return failed
+        return self._transaction(work)
+
+    def get(self, ticket_id, user_id):
+        """The ticket, if it exists and belongs to user_id."""
+        row = self._conn().execute("SELECT * FROM tickets WHERE ticket_id = ? AND user_id = ?;", (ticket_id, user_id)).fetchone()
+        return self._ticket(row) if row is not None else None
+
+    def depth(self):
+        """Ticket counts by status, plus the age in seconds of the oldest ticket not yet flushed."""
+        conn = self._conn()
+        counts = {status: 0 for status in ("queued", "flushing", "done", "failed")}
+        counts.update(dict(conn.execute("SELECT status, COUNT(*) FROM tickets GROUP BY status;").fetchall()))
+        oldest = conn.execute("SELECT MIN(enqueued_at) FROM tickets WHERE status IN ('queued', 'flushing');").fetchone()[0]
+        counts["oldest_pending_age_seconds"] = round(time.time() - oldest, 3) if oldest else None
+        return counts
+
+    def purge(self):
+        """Deletes finished tickets older than retention_seconds. Returns the number removed."""
+        return self._transaction(lambda conn: conn.execute(
+            "DELETE FROM tickets WHERE status IN ('done', 'failed') AND completed_at < ?;",
+            (time.time() - self.retention_seconds,)).rowcount)
+
+    @staticmethod
+    def _ticket(row):
+        return {
+            "ticket_id": row["ticket_id"], "user_id": row["user_id"], "status": row["status"],
+            "attempts": row["attempts"], "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"], "enqueued_at": row["enqueued_at"], "completed_at": row["completed_at"],
+        }
+
+class QueueFlusher(threading.Thread):
+    """
+    Background thread that drains a WriteQueue. `flush_batch(tickets)` writes a batch and
+    returns {ticket_id: ("done", result) | ("retry", error)}; if it raises, the whole batch is
+    retried with backoff. Keeps the counters served by stats().
+    """
+
+    def __init__(self, queue, flush_batch, batch_size=200, interval_seconds=1.0, max_attempts=8,
+                 backoff_base_seconds=2.0, backoff_max_seconds=300.0, purge_interval_seconds=3600):
+        super().__init__(name="write-queue-flusher", daemon=True)
+        self.queue = queue
+        self.flush_batch = flush_batch
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.purge_interval_seconds = purge_interval_seconds
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._lock = threading.Lock()
+        self._latencies_ms = deque(maxlen=500)
+        self._batch_sizes = deque(maxlen=500)
+        self.counters = {"batches": 0, "batch_failures": 0, "tickets_done": 0, "tickets_retried": 0,
+                         "tickets_failed": 0, "last_error": None, "last_flush_at": None}
+
+    def wake(self):
+        """Skips the rest of the idle wait (called after an enqueue)."""
+        self._wake_event.set()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self._wake_event.set()
+        self.join(timeout)
+
+    def run(self):
+        last_purge = 0.0
+        while not self._stop_event.is_set():
+            try:
+                if time.time() - last_purge > self.purge_interval_seconds:
+                    last_purge = time.time()
+                    self.queue.purge()
+                if not self.flush_once():
+                    self._wake_event.wait(self.interval_seconds)
+                    self._wake_event.clear()
+            except Exception as error:
+                # Keep the thread alive through queue-file errors; the tickets stay queued.
+                print(f"Write queue flusher error: {error}")
+                with self._lock:
+                    self.counters["last_error"] = str(error)
+                self._stop_event.wait(self.interval_seconds)
+
+    def flush_once(self):
+        """Flushes one batch. Returns the number of tickets claimed (0 when the queue is idle)."""
+        tickets = self.queue.claim_batch(self.batch_size)
+        if not tickets:
+            return 0
+        start = time.perf_counter()
+        try:
+            outcomes = self.flush_batch(tickets)
+        except Exception as error:
+            print(f"Write queue batch of {len(tickets)} failed: {error}")
+            outcomes = {ticket["ticket_id"]: ("retry", str(error)) for ticket in tickets}
+            with self._lock:
+                self.counters["batch_failures"] += 1
+                self.counters["last_error"] = str(error)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        done = {ticket_id: value for ticket_id, (outcome, value) in outcomes.items() if outcome == "done"}
+        errors = {ticket_id: value for ticket_id, (outcome, value) in outcomes.items() if outcome != "done"}
+        # Tickets the callback didn't report on are retried rather than left flushing.
+        errors.update({ticket["ticket_id"]: "No result from flush" for ticket in tickets if ticket["ticket_id"] not in outcomes})
+        if done:
+            self.queue.complete(done)
+        failed = self.queue.retry(errors, self.max_attempts, self.backoff_base_seconds, self.backoff_max_seconds) if errors else []
+        with self._lock:
+            self.counters["batches"] += 1
+            self.counters["tickets_done"] += len(done)
+            self.counters["tickets_retried"] += len(errors) - len(failed)
+            self.counters["tickets_failed"] += len(failed)
+            self.counters["last_flush_at"] = time.time()
+            self._latencies_ms.append(elapsed_ms)
+            self._batch_sizes.append(len(tickets))
+        return len(tickets)
+
+    def stats(self):
+        """Queue depth, batch sizes and flush latency (over the last 500 batches) for this worker's flusher."""
+        with self._lock:
+            last_latency = self._latencies_ms[-1] if self._latencies_ms else None
+            latencies = sorted(self._latencies_ms)
+            sizes = list(self._batch_sizes)
+            stats = dict(self.counters)
+
+        def percentile(values, fraction):
+            return round(values[min(len(values) - 1, int(fraction * len(values)))], 2) if values else None
+
+        stats.update(
+            depth=self.queue.depth(),
+            batch_size={"last": sizes[-1] if sizes else None, "avg": round(statistics.mean(sizes), 2) if sizes else None,
+                        "max": max(sizes) if sizes else None, "configured": self.batch_size},
+            flush_latency_ms={"last": round(last_latency, 2) if last_latency is not None else None,
+                              "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                              "max": round(latencies[-1], 2) if latencies else None},
+            alive=self.is_alive(),
+        )
+        return stats